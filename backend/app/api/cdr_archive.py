@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.core.security import get_current_user
+from app.models import User
+from app.services.cdr_archive import cdr_archive
+
+router = APIRouter()
+
+
+@router.get("/")
+async def list_cdr_archive(
+    current_user: User = Depends(get_current_user)
+):
+    """Meses gravados no arquivo colunar; dropped indica que já saíram do banco"""
+    return {"path": cdr_archive.path, "months": cdr_archive.list()}
+
+
+@router.post("/{month}")
+async def archive_cdr_month(
+    month: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Grava um mês fechado (AAAA-MM) no arquivo colunar, sem removê-lo do banco"""
+    try:
+        period = datetime.strptime(month, "%Y-%m").date()
+        return await cdr_archive.archive_month(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,64 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.core.metrics import metrics
+from app.core.security import get_current_user
+from app.models import User
+from app.services.cdr_attribution import attribution_backfill
+from app.services.cdr_ingest import cdr_ingest_service
+
+router = APIRouter()
+
+
+class BackfillRequest(BaseModel):
+    date_from: datetime
+    date_to: datetime
+    chunk_size: int = Field(20000, ge=1000, le=200000)
+
+
+@router.get("/status")
+async def get_cdr_ingest_status(
+    current_user: User = Depends(get_current_user)
+):
+    """Estado da ingestão de CDRs: fila, CDRs/s, atraso e duração dos lotes"""
+    snapshot = metrics.snapshot()
+    return {
+        **cdr_ingest_service.status(),
+        "lag": snapshot["timings"].get("cdr.ingest.lag"),
+        "flush": snapshot["timings"].get("cdr.ingest.flush"),
+        "attribution": {
+            "attributed": snapshot["counters"].get("cdr.attribution.attributed", 0),
+            "unattributed": snapshot["counters"].get("cdr.attribution.unattributed", 0),
+        },
+    }
+
+
+@router.get("/backfill")
+async def get_attribution_backfill(
+    current_user: User = Depends(get_current_user)
+):
+    """Progresso da atribuição em lote dos CDRs já gravados"""
+    return attribution_backfill.state
+
+
+@router.post("/backfill", status_code=status.HTTP_202_ACCEPTED)
+async def start_attribution_backfill(
+    data: BackfillRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Atribui cliente, ramal, gateway e rota aos CDRs do período ainda sem atribuição"""
+    if data.date_to <= data.date_from:
+        raise HTTPException(status_code=400, detail="Periodo invalido")
+    if not attribution_backfill.start(data.date_from, data.date_to, data.chunk_size):
+        raise HTTPException(status_code=409, detail="Atribuicao ja em execucao")
+    return attribution_backfill.state
+
+
+@router.post("/backfill/cancel")
+async def cancel_attribution_backfill(
+    current_user: User = Depends(get_current_user)
+):
+    if not attribution_backfill.cancel():
+        raise HTTPException(status_code=409, detail="Atribuicao nao esta em execucao")
+    return {"message": "Cancelamento solicitado"}
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_db
+from app.core.security import get_current_user
+from app.models import User
+from app.services.cdr_partitions import cdr_partition_manager
+
+router = APIRouter()
+
+
+@router.get("/")
+async def list_cdr_partitions(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Partições mensais da tabela cdr e a política de retenção"""
+    return {
+        "months_ahead": cdr_partition_manager.months_ahead,
+        "retention_months": cdr_partition_manager.retention_months,
+        "retention_action": cdr_partition_manager.retention_action,
+        "last_run": cdr_partition_manager.last_run,
+        "partitions": await cdr_partition_manager.list_partitions(db),
+    }
+
+
+@router.post("/maintenance")
+async def run_cdr_partition_maintenance(
+    current_user: User = Depends(get_current_user)
+):
+    """Cria as partições futuras e aplica a retenção imediatamente"""
+    return await cdr_partition_manager.run_maintenance()
@@ -0,0 +1,87 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import metrics
+from app.core.security import get_current_user
+from app.models import User
+from app.services.asterisk import CONFIG_ERROR, asterisk_service
+from app.services.config_backup import BackupError
+from app.services.provisioning import provisioning_queue
+
+router = APIRouter()
+
+
+@router.get("/")
+async def list_backup_files(
+    current_user: User = Depends(get_current_user)
+):
+    """Arquivos de configuração com backups e custo acumulado dos backups"""
+    store = asterisk_service.backups
+    files = await asyncio.to_thread(store.list_files)
+    snapshot = metrics.snapshot()
+    return {
+        "max_per_file": store.max_per_file,
+        "max_age_days": store.max_age_days,
+        "files": files,
+        "cost": {
+            "count": snapshot["counters"].get("asterisk.backup.count", 0),
+            "bytes": snapshot["counters"].get("asterisk.backup.bytes", 0),
+            "compressed_bytes": snapshot["counters"].get("asterisk.backup.compressed_bytes", 0),
+            "pruned": snapshot["counters"].get("asterisk.backup.pruned", 0),
+            "failed": snapshot["counters"].get("asterisk.backup.failed", 0),
+            "duration": snapshot["timings"].get("asterisk.backup.duration"),
+        },
+    }
+
+
+@router.post("/prune")
+async def prune_backups(
+    current_user: User = Depends(get_current_user)
+):
+    """Aplica a retenção a todos os backups (inclusive os '.bak' antigos)"""
+    removed = await asyncio.to_thread(asterisk_service.backups.prune_all)
+    return {"removed": removed}
+
+
+@router.get("/{key}")
+async def list_file_backups(
+    key: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Backups de um arquivo, do mais recente para o mais antigo"""
+    try:
+        return await asyncio.to_thread(asterisk_service.backups.list_backups, key)
+    except BackupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+
+@router.get("/{key}/{backup_id}", response_class=PlainTextResponse)
+async def get_backup_content(
+    key: str,
+    backup_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Conteúdo de um backup"""
+    try:
+        content = await asyncio.to_thread(asterisk_service.backups.read, key, backup_id)
+    except BackupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return content.decode(errors="replace")
+
+
+@router.post("/{key}/{backup_id}/restore")
+async def restore_backup(
+    key: str,
+    backup_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Restaura um backup e recarrega o Asterisk"""
+    try:
+        result = await provisioning_queue.restore_backup(key, backup_id)
+    except BackupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    if result == CONFIG_ERROR:
+        raise HTTPException(status_code=500, detail="Backup restaurado, mas o reload do Asterisk falhou")
+    return {"message": f"Backup {backup_id} restaurado com sucesso"}
@@ -0,0 +1,59 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.core.security import get_current_user
+from app.models import User
+from app.services.asterisk import CONFIG_ERROR, asterisk_service
+from app.services.config_snapshots import SnapshotError
+from app.services.provisioning import provisioning_queue
+
+router = APIRouter()
+
+
+@router.get("/")
+async def list_snapshots(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Snapshots de configuração, do mais recente para o mais antigo"""
+    total, snapshots = asterisk_service.snapshots.list(limit=limit, offset=offset)
+    return {"total": total, "snapshots": snapshots}
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def create_snapshot(
+    current_user: User = Depends(get_current_user)
+):
+    """Registra manualmente um snapshot dos arquivos atuais"""
+    return await asyncio.to_thread(asterisk_service.record_snapshot, f"manual:{current_user.username}")
+
+
+@router.get("/{snapshot_id}")
+async def get_snapshot(
+    snapshot_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Detalhes de um snapshot com a lista de arquivos e hashes"""
+    try:
+        entry = asterisk_service.snapshots.get(snapshot_id)
+        files = await asyncio.to_thread(asterisk_service.snapshots.files, snapshot_id)
+    except SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return {**entry, "file_hashes": files}
+
+
+@router.post("/{snapshot_id}/rollback")
+async def rollback_snapshot(
+    snapshot_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Volta todos os arquivos gerenciados ao snapshot e recarrega o Asterisk uma vez"""
+    try:
+        result = await provisioning_queue.rollback(snapshot_id)
+    except SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    if result["result"] == CONFIG_ERROR:
+        raise HTTPException(status_code=500, detail="Arquivos restaurados, mas o reload do Asterisk falhou")
+    return result
@@ -12,7 +12,8 @@ from app.core.security import get_current_user
 from app.models.customer import Customer
 from app.models.route_plan import RoutePlan
 from app.models.tariff_plan import TariffPlan
-from app.services.asterisk import AsteriskService
+from app.services.provisioning import provisioning_queue
+from app.services.rating import rating_engine
 
 router = APIRouter()
 
@@ -122,12 +123,9 @@ async def create_customer(
     await db.commit()
     await db.refresh(customer)
 
-    # Sync com Asterisk
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_customer_trunks(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("trunks", "extensions", "dids")
+    rating_engine.invalidate()
 
     # Recarregar com relacionamentos
     query = select(Customer).options(
@@ -157,12 +155,9 @@ async def update_customer(
 
     await db.commit()
 
-    # Sync com Asterisk
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_customer_trunks(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("trunks", "extensions", "dids")
+    rating_engine.invalidate()
 
     # Recarregar com relacionamentos
     query = select(Customer).options(
@@ -188,11 +183,8 @@ async def delete_customer(
     await db.delete(customer)
     await db.commit()
 
-    # Sync com Asterisk
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_customer_trunks(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("trunks", "extensions", "dids")
+    rating_engine.invalidate()
 
     return {"message": "Cliente excluído com sucesso"}
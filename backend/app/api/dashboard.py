@@ -1,77 +1,73 @@
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from fastapi import APIRouter, Depends
+from typing import Any, Dict, List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from app.core.database import get_db
+from sqlalchemy import select, func, true
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import async_session, get_db
 from app.core.security import get_current_user
-from app.models import Customer, DID, Extension, Provider, CDR, User
+from app.models import Customer, DID, Extension, Gateway, Provider, CDR, User, cdr_hourly
 from app.schemas import DashboardStats
+from app.services.cdr_rollups import cdr_rollups, floor_hour
+from app.services.channels import channel_table
 
 router = APIRouter()
 
-
-@router.get("/stats", response_model=DashboardStats)
-async def get_dashboard_stats(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Retorna estatísticas gerais do dashboard"""
-
-    # Total de clientes
-    total_customers = await db.execute(select(func.count(Customer.id)))
-    total_customers = total_customers.scalar() or 0
-
-    # Clientes ativos
-    active_customers = await db.execute(
-        select(func.count(Customer.id)).where(Customer.status == "active")
-    )
-    active_customers = active_customers.scalar() or 0
-
-    # Total de DIDs
-    total_dids = await db.execute(select(func.count(DID.id)))
-    total_dids = total_dids.scalar() or 0
-
-    # DIDs alocados
-    allocated_dids = await db.execute(
-        select(func.count(DID.id)).where(DID.status == "allocated")
+# Snapshot compartilhado entre todos os que estão com o dashboard aberto
+dashboard_cache = TTLCache("dashboard", settings.DASHBOARD_CACHE_SECONDS)
+
+
+_BUCKET_STEPS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1)}
+
+
+class RollupRebuildRequest(BaseModel):
+    date_from: datetime
+    date_to: datetime
+
+
+def _stats_query(today_start: datetime):
+    """Todas as estatísticas numa única consulta (agregados com FILTER)"""
+
+    customers = select(
+        func.count().label("total"),
+        func.count().filter(Customer.status == "active").label("active"),
+    ).select_from(Customer).subquery()
+    dids = select(
+        func.count().label("total"),
+        func.count().filter(DID.status == "allocated").label("allocated"),
+        func.count().filter(DID.status == "available").label("available"),
+    ).select_from(DID).subquery()
+    extensions = select(func.count().label("total")).select_from(Extension).subquery()
+    providers = select(func.count().label("total")).select_from(Provider).subquery()
+    # Chamadas de hoje pelos agregados horários (hoje começa em hora cheia)
+    calls = select(
+        func.coalesce(func.sum(cdr_hourly.c.calls), 0).label("calls"),
+        func.coalesce(func.sum(cdr_hourly.c.billsec), 0).label("billsec"),
+        func.coalesce(func.sum(cdr_hourly.c.price), 0).label("price"),
+    ).where(cdr_hourly.c.hour >= today_start).subquery()
+
+    return select(
+        customers.c.total, customers.c.active,
+        dids.c.total, dids.c.allocated, dids.c.available,
+        extensions.c.total, providers.c.total,
+        calls.c.calls, calls.c.billsec, calls.c.price,
+    ).select_from(
+        customers.join(dids, true()).join(extensions, true()).join(providers, true()).join(calls, true())
     )
-    allocated_dids = allocated_dids.scalar() or 0
 
-    # DIDs disponíveis
-    available_dids = await db.execute(
-        select(func.count(DID.id)).where(DID.status == "available")
-    )
-    available_dids = available_dids.scalar() or 0
 
-    # Total de ramais
-    total_extensions = await db.execute(select(func.count(Extension.id)))
-    total_extensions = total_extensions.scalar() or 0
+async def _load_stats() -> DashboardStats:
+    today_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    async with async_session() as db:
+        row = (await db.execute(_stats_query(today_start))).one()
 
-    # Total de provedores
-    total_providers = await db.execute(select(func.count(Provider.id)))
-    total_providers = total_providers.scalar() or 0
-
-    # Chamadas de hoje - usando calldate
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-
-    calls_today = await db.execute(
-        select(func.count(CDR.id)).where(CDR.calldate >= today_start)
-    )
-    total_calls_today = calls_today.scalar() or 0
-
-    # Minutos de hoje
-    minutes_today = await db.execute(
-        select(func.sum(CDR.billsec)).where(CDR.calldate >= today_start)
-    )
-    total_seconds_today = minutes_today.scalar() or 0
-
-    # Receita de hoje
-    revenue = await db.execute(
-        select(func.sum(CDR.price)).where(CDR.calldate >= today_start)
-    )
-    revenue_today = revenue.scalar() or Decimal("0")
+    (total_customers, active_customers, total_dids, allocated_dids, available_dids,
+     total_extensions, total_providers, total_calls_today, total_seconds_today, revenue_today) = row
 
     return DashboardStats(
         total_customers=total_customers,
@@ -83,46 +79,133 @@ async def get_dashboard_stats(
         total_providers=total_providers,
         total_calls_today=total_calls_today,
         total_minutes_today=total_seconds_today // 60 if total_seconds_today >= 60 else total_seconds_today,
-        revenue_today=revenue_today
+        revenue_today=revenue_today or Decimal("0")
     )
 
 
-@router.get("/calls/by-hour")
-async def get_calls_by_hour(
-    days: int = 1,
-    db: AsyncSession = Depends(get_db),
+@router.get("/stats", response_model=DashboardStats)
+async def get_dashboard_stats(
     current_user: User = Depends(get_current_user)
 ):
-    """Retorna chamadas agrupadas por hora"""
-    start_date = datetime.utcnow() - timedelta(days=days)
+    """Retorna estatísticas gerais do dashboard (snapshot em cache)"""
+    return await dashboard_cache.get("stats", _load_stats)
 
+
+def _timezone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Fuso horario invalido")
+
+
+def _truncate(value: datetime, unit: str) -> datetime:
+    value = value.replace(second=0, microsecond=0)
+    if unit in ("hour", "day"):
+        value = value.replace(minute=0)
+    if unit == "day":
+        value = value.replace(hour=0)
+    return value
+
+
+def _buckets(unit: str, start: datetime, end: datetime, tz: ZoneInfo) -> List[datetime]:
+    """Intervalos locais (sem tzinfo) entre start e end (UTC), na ordem e sem repetição"""
+    if unit == "day":
+        first = start.replace(tzinfo=timezone.utc).astimezone(tz).date()
+        last = (end - timedelta(microseconds=1)).replace(tzinfo=timezone.utc).astimezone(tz).date()
+        return [datetime.combine(first + timedelta(days=i), datetime.min.time()) for i in range((last - first).days + 1)]
+
+    step = _BUCKET_STEPS[unit]
+    buckets: List[datetime] = []
+    cursor = start.replace(tzinfo=timezone.utc)
+    while cursor < end.replace(tzinfo=timezone.utc):
+        bucket = _truncate(cursor.astimezone(tz).replace(tzinfo=None), unit)
+        if not buckets or buckets[-1] != bucket:
+            buckets.append(bucket)
+        cursor += step
+    return buckets
+
+
+def _whole_hour_offsets(tz: ZoneInfo, start: datetime, end: datetime) -> bool:
+    """O fuso só tem deslocamentos de horas cheias no período (agregados horários servem)"""
+    return all(
+        moment.replace(tzinfo=timezone.utc).astimezone(tz).utcoffset().total_seconds() % 3600 == 0
+        for moment in (start, end)
+    )
+
+
+async def _calls_series(db: AsyncSession, unit: str, start: datetime, tz: ZoneInfo) -> List[Dict[str, Any]]:
+    """Chamadas e minutos por minuto/hora/dia local desde start (UTC), com intervalos vazios zerados.
+
+    Agrupado no banco com date_trunc no fuso pedido; hora e dia vêm dos
+    agregados horários, minuto dos CDRs.
+    """
+    end = datetime.utcnow()
+    if unit != "minute" and _whole_hour_offsets(tz, start, end):
+        timestamp = cdr_hourly.c.hour
+        calls = func.sum(cdr_hourly.c.calls)
+        seconds = func.sum(cdr_hourly.c.billsec)
+        where = cdr_hourly.c.hour >= floor_hour(start)
+    else:
+        timestamp = CDR.calldate
+        calls = func.count()
+        seconds = func.sum(CDR.billsec)
+        where = CDR.calldate >= start
+
+    bucket = func.date_trunc(unit, func.timezone(tz.key, func.timezone("UTC", timestamp))).label("bucket")
     result = await db.execute(
-        select(CDR.calldate, CDR.billsec)
-        .where(CDR.calldate >= start_date)
-        .order_by(CDR.calldate)
+        select(bucket, calls.label("total_calls"), seconds.label("total_seconds"))
+        .where(where)
+        .group_by(bucket)
     )
-    rows = result.all()
+    totals = {row.bucket: row for row in result.all()}
+
+    series = []
+    for local in _buckets(unit, start, end, tz):
+        row = totals.get(local)
+        series.append({
+            unit: local.replace(tzinfo=tz).isoformat(),
+            "total_calls": row.total_calls if row else 0,
+            "total_minutes": (row.total_seconds or 0) // 60 if row else 0,
+        })
+    return series
+
+
+@router.get("/calls/by-minute")
+async def get_calls_by_minute(
+    minutes: int = Query(60, ge=1, le=1440),
+    tz: str = "UTC",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Retorna chamadas agrupadas por minuto"""
+    start = _truncate(datetime.utcnow() - timedelta(minutes=minutes - 1), "minute")
+    return await _calls_series(db, "minute", start, _timezone(tz))
 
-    if not rows:
-        return []
 
-    hourly_data = {}
-    for row in rows:
-        if row.calldate:
-            hour_key = row.calldate.replace(minute=0, second=0, microsecond=0)
-            if hour_key not in hourly_data:
-                hourly_data[hour_key] = {"total_calls": 0, "total_seconds": 0}
-            hourly_data[hour_key]["total_calls"] += 1
-            hourly_data[hour_key]["total_seconds"] += row.billsec or 0
+@router.get("/calls/by-hour")
+async def get_calls_by_hour(
+    days: int = Query(1, ge=1, le=31),
+    tz: str = "UTC",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Retorna chamadas agrupadas por hora"""
+    start = floor_hour(datetime.utcnow() - timedelta(days=days))
+    return await _calls_series(db, "hour", start, _timezone(tz))
+
 
-    return [
-        {
-            "hour": hour.isoformat(),
-            "total_calls": data["total_calls"],
-            "total_minutes": data["total_seconds"] // 60
-        }
-        for hour, data in sorted(hourly_data.items())
-    ]
+@router.get("/calls/by-day")
+async def get_calls_by_day(
+    days: int = Query(30, ge=1, le=366),
+    tz: str = "UTC",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Retorna chamadas agrupadas por dia (dias do fuso informado)"""
+    zone = _timezone(tz)
+    first_day = (datetime.now(zone) - timedelta(days=days - 1)).date()
+    start = datetime.combine(first_day, datetime.min.time(), zone).astimezone(timezone.utc).replace(tzinfo=None)
+    return await _calls_series(db, "day", start, zone)
 
 
 @router.get("/calls/by-destination")
@@ -132,19 +215,20 @@ async def get_calls_by_destination(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retorna top destinos"""
-    start_date = datetime.utcnow() - timedelta(days=days)
+    """Retorna top destinos (agregados horários)"""
+    start_date = floor_hour(datetime.utcnow() - timedelta(days=days))
+    total_calls = func.sum(cdr_hourly.c.calls)
 
     result = await db.execute(
         select(
-            func.substr(CDR.dst, 1, 4).label('prefix'),
-            func.count(CDR.id).label('total_calls'),
-            func.sum(CDR.billsec).label('total_seconds'),
-            func.sum(CDR.cost).label('total_cost')
+            cdr_hourly.c.prefix,
+            total_calls.label('total_calls'),
+            func.sum(cdr_hourly.c.billsec).label('total_seconds'),
+            func.sum(cdr_hourly.c.cost).label('total_cost')
         )
-        .where(CDR.calldate >= start_date)
-        .group_by(func.substr(CDR.dst, 1, 4))
-        .order_by(func.count(CDR.id).desc())
+        .where(cdr_hourly.c.hour >= start_date)
+        .group_by(cdr_hourly.c.prefix)
+        .order_by(total_calls.desc())
         .limit(limit)
     )
 
@@ -166,21 +250,22 @@ async def get_top_customers(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retorna clientes com maior consumo"""
-    start_date = datetime.utcnow() - timedelta(days=days)
+    """Retorna clientes com maior consumo (agregados horários)"""
+    start_date = floor_hour(datetime.utcnow() - timedelta(days=days))
+    total_seconds = func.sum(cdr_hourly.c.billsec)
 
     result = await db.execute(
         select(
             Customer.code,
             Customer.name,
-            func.count(CDR.id).label('total_calls'),
-            func.sum(CDR.billsec).label('total_seconds'),
-            func.sum(CDR.price).label('total_price')
+            func.sum(cdr_hourly.c.calls).label('total_calls'),
+            total_seconds.label('total_seconds'),
+            func.sum(cdr_hourly.c.price).label('total_price')
         )
-        .join(CDR, CDR.customer_id == Customer.id)
-        .where(CDR.calldate >= start_date)
+        .join(cdr_hourly, cdr_hourly.c.customer_id == Customer.id)
+        .where(cdr_hourly.c.hour >= start_date)
         .group_by(Customer.id, Customer.code, Customer.name)
-        .order_by(func.sum(CDR.billsec).desc())
+        .order_by(total_seconds.desc())
         .limit(limit)
     )
 
@@ -202,20 +287,22 @@ async def get_providers_usage(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retorna uso por provedor"""
-    start_date = datetime.utcnow() - timedelta(days=days)
+    """Retorna uso por provedor (agregados horários)"""
+    start_date = floor_hour(datetime.utcnow() - timedelta(days=days))
+    total_calls = func.sum(cdr_hourly.c.calls)
 
     result = await db.execute(
         select(
             Provider.name,
-            func.count(CDR.id).label('total_calls'),
-            func.sum(CDR.billsec).label('total_seconds'),
-            func.sum(CDR.cost).label('total_cost')
+            total_calls.label('total_calls'),
+            func.sum(cdr_hourly.c.billsec).label('total_seconds'),
+            func.sum(cdr_hourly.c.cost).label('total_cost')
         )
-        .join(CDR, CDR.gateway_id == Provider.id)
-        .where(CDR.calldate >= start_date)
+        .join(Gateway, Gateway.provider_id == Provider.id)
+        .join(cdr_hourly, cdr_hourly.c.gateway_id == Gateway.id)
+        .where(cdr_hourly.c.hour >= start_date)
         .group_by(Provider.id, Provider.name)
-        .order_by(func.count(CDR.id).desc())
+        .order_by(total_calls.desc())
     )
 
     return [
@@ -229,67 +316,73 @@ async def get_providers_usage(
     ]
 
 
+@router.get("/rollups")
+async def get_rollups_status(
+    current_user: User = Depends(get_current_user)
+):
+    """Estado do recálculo dos agregados horários"""
+    return cdr_rollups.status()
+
+
+@router.post("/rollups/rebuild", status_code=status.HTTP_202_ACCEPTED)
+async def rebuild_rollups(
+    data: RollupRebuildRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Recalcula os agregados horários do período a partir dos CDRs"""
+    if data.date_to <= data.date_from:
+        raise HTTPException(status_code=400, detail="Periodo invalido")
+    cdr_rollups.rebuild(data.date_from, data.date_to)
+    return cdr_rollups.status()
+
+
+@router.post("/rollups/cancel")
+async def cancel_rollups_rebuild(
+    current_user: User = Depends(get_current_user)
+):
+    if not cdr_rollups.cancel():
+        raise HTTPException(status_code=409, detail="Recalculo nao esta em execucao")
+    return {"message": "Cancelamento solicitado"}
+
+
 @router.get("/calls/live")
 async def get_live_calls(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retorna chamadas em andamento via AMI"""
-    import subprocess
-    import re
-    
-    try:
-        result = subprocess.run(
-            ['/usr/sbin/asterisk', '-rx', 'core show channels concise'],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        
-        lines = result.stdout.strip().split('\n')
-        live_calls = []
-        
-        for line in lines:
-            if not line or 'active' in line.lower():
-                continue
-                
-            parts = line.split('!')
-            if len(parts) >= 7:
-                channel = parts[0]
-                context = parts[1] if len(parts) > 1 else ''
-                extension = parts[2] if len(parts) > 2 else ''
-                state = parts[4] if len(parts) > 4 else ''
-                duration = parts[11] if len(parts) > 11 else '0'
-                
-                src = ''
-                if 'PJSIP/' in channel:
-                    match = re.search(r'PJSIP/(\d+)', channel)
-                    if match:
-                        src = match.group(1)
-                
-                direction = 'outbound'
-                if context == 'from-trunk' or 'inbound' in context.lower():
-                    direction = 'inbound'
-                
-                if state in ['Up', 'Ring', 'Ringing']:
-                    live_calls.append({
-                        'channel': channel,
-                        'src': src or channel.split('/')[1].split('-')[0] if '/' in channel else '',
-                        'dst': extension,
-                        'direction': direction,
-                        'state': state,
-                        'duration': duration,
-                        'start_time': datetime.utcnow().isoformat(),
-                        'customer_name': None,
-                        'gateway_name': None,
-                        'did': None
-                    })
-        
-        return live_calls
-        
-    except Exception as e:
-        print(f"Erro ao buscar chamadas ao vivo: {e}")
-        return []
+    """Retorna chamadas em andamento (tabela de canais mantida por eventos AMI)"""
+    live_calls = []
+
+    for ch in channel_table.list():
+        if ch.state not in ['Up', 'Ring', 'Ringing']:
+            continue
+
+        src = ''
+        if 'PJSIP/' in ch.channel:
+            match = re.search(r'PJSIP/(\d+)', ch.channel)
+            if match:
+                src = match.group(1)
+        if not src and '/' in ch.channel:
+            src = ch.channel.split('/')[1].split('-')[0]
+
+        direction = 'outbound'
+        if ch.context == 'from-trunk' or 'inbound' in ch.context.lower():
+            direction = 'inbound'
+
+        live_calls.append({
+            'channel': ch.channel,
+            'src': src,
+            'dst': ch.extension,
+            'direction': direction,
+            'state': ch.state,
+            'duration': ch.duration,
+            'start_time': datetime.utcfromtimestamp(ch.created_at).isoformat(),
+            'customer_name': None,
+            'gateway_name': None,
+            'did': None
+        })
+
+    return live_calls
 
 
 @router.get("/calls/recent")
@@ -299,8 +392,11 @@ async def get_recent_calls(
     current_user: User = Depends(get_current_user)
 ):
     """Retorna chamadas mais recentes"""
+    # Limite inferior em calldate: lê só as partições mais recentes
+    since = datetime.utcnow() - timedelta(days=settings.CDR_REPORT_DEFAULT_DAYS)
     result = await db.execute(
         select(CDR)
+        .where(CDR.calldate >= since)
         .order_by(CDR.calldate.desc())
         .limit(limit)
     )
@@ -320,3 +416,34 @@ async def get_recent_calls(
         }
         for call in calls
     ]
+
+
+async def _load_widgets() -> Dict[str, Any]:
+    async with async_session() as db:
+        return {
+            "calls_by_hour": await get_calls_by_hour(days=1, tz="UTC", db=db, current_user=None),
+            "calls_by_destination": await get_calls_by_destination(days=7, limit=10, db=db, current_user=None),
+            "top_customers": await get_top_customers(days=30, limit=10, db=db, current_user=None),
+            "providers_usage": await get_providers_usage(days=30, db=db, current_user=None),
+        }
+
+
+@router.get("/overview")
+async def get_dashboard_overview(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Todos os widgets do dashboard numa única resposta.
+
+    Estatísticas e gráficos vêm do snapshot em cache (períodos padrão de
+    cada widget); chamadas em andamento e recentes são sempre atuais.
+    """
+    stats = await dashboard_cache.get("stats", _load_stats)
+    widgets = await dashboard_cache.get("widgets", _load_widgets)
+    return {
+        "stats": stats,
+        **widgets,
+        "live_calls": await get_live_calls(db=db, current_user=current_user),
+        "recent_calls": await get_recent_calls(db=db, current_user=current_user),
+        "snapshot_age": dashboard_cache.age("widgets"),
+    }
@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, Query, UploadFile, File, status
 from typing import List, Optional
 import asyncio
 import json
+import os
+import shutil
+import uuid
 
+from app.core.config import settings
 from app.core.security import get_current_user
-from app.services.sip_debug import sip_debug_service
+from app.services.sip_debug import CAPTURE_BACKENDS, sip_debug_service
 
 router = APIRouter()
 
@@ -33,7 +37,7 @@ async def websocket_sip_monitor(websocket: WebSocket):
         # Iniciar captura se não estiver rodando
         if not sip_debug_service.capturing:
             asyncio.create_task(
-                sip_debug_service.capture_with_tcpdump("eth0", on_message)
+                sip_debug_service.capture("eth0", on_message)
             )
         
         # Manter conexão aberta
@@ -89,6 +93,7 @@ async def get_problems(current_user = Depends(get_current_user)):
 @router.post("/capture/start")
 async def start_capture(
     interface: str = "eth0",
+    backend: str = Query(settings.SIP_CAPTURE_BACKEND, pattern=f"^({'|'.join(CAPTURE_BACKENDS)})$"),
     current_user = Depends(get_current_user)
 ):
     """Inicia captura de pacotes"""
@@ -96,9 +101,9 @@ async def start_capture(
         return {"status": "already_running"}
     
     asyncio.create_task(
-        sip_debug_service.capture_with_tcpdump(interface)
+        sip_debug_service.capture(interface, backend=backend)
     )
-    return {"status": "started", "interface": interface}
+    return {"status": "started", "interface": interface, "backend": backend}
 
 @router.post("/capture/stop")
 async def stop_capture(current_user = Depends(get_current_user)):
@@ -110,7 +115,7 @@ async def stop_capture(current_user = Depends(get_current_user)):
 async def capture_status(current_user = Depends(get_current_user)):
     """Retorna status da captura"""
     return {
-        "capturing": sip_debug_service.capturing,
+        **sip_debug_service.capture_status(),
         "active_calls": len(sip_debug_service.active_calls),
         "message_count": len(sip_debug_service.message_history)
     }
@@ -130,3 +135,61 @@ async def clear_history(current_user = Depends(get_current_user)):
     """Limpa histórico de mensagens"""
     sip_debug_service.clear()
     return {"status": "cleared"}
+
+
+def _start_pcap(path: str, clear: bool, remove: bool = False):
+    try:
+        sip_debug_service.start_pcap(path, clear=clear, remove=remove)
+    except RuntimeError as e:
+        if remove:
+            os.unlink(path)
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/pcap/upload", status_code=status.HTTP_202_ACCEPTED)
+async def upload_pcap(
+    file: UploadFile = File(...),
+    clear: bool = False,
+    current_user = Depends(get_current_user)
+):
+    """Recebe um pcap/pcapng e o analisa em segundo plano (acompanhar em /pcap/status).
+
+    As chamadas e problemas encontrados aparecem em /call-flow/{call_id} e
+    /problems, como na captura ao vivo; clear limpa o histórico antes.
+    """
+    os.makedirs(settings.SIP_PCAP_DIR, exist_ok=True)
+    name = os.path.basename(file.filename or "capture.pcap")
+    path = os.path.join(settings.SIP_PCAP_DIR, f"upload_{uuid.uuid4().hex}_{name}")
+    with open(path, "wb") as out:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, out, 1024 * 1024)
+    _start_pcap(path, clear, remove=True)
+    return sip_debug_service.pcap_status()
+
+
+@router.post("/pcap/analyze", status_code=status.HTTP_202_ACCEPTED)
+async def analyze_pcap(
+    path: str,
+    clear: bool = False,
+    current_user = Depends(get_current_user)
+):
+    """Analisa um pcap/pcapng já no servidor, dentro de SIP_PCAP_DIR"""
+    base = os.path.realpath(settings.SIP_PCAP_DIR)
+    full = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, full]) != base:
+        raise HTTPException(status_code=400, detail="Arquivo fora do diretório de pcaps")
+    if not os.path.isfile(full):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    _start_pcap(full, clear)
+    return sip_debug_service.pcap_status()
+
+
+@router.get("/pcap/status")
+async def pcap_status(current_user = Depends(get_current_user)):
+    """Progresso e contadores da análise de pcap"""
+    return sip_debug_service.pcap_status()
+
+
+@router.post("/pcap/cancel")
+async def cancel_pcap(current_user = Depends(get_current_user)):
+    """Cancela a análise de pcap em andamento"""
+    return {"cancelled": sip_debug_service.cancel_pcap()}
@@ -10,50 +10,11 @@ from app.models import DID, CustomerDID, Customer, User
 from app.models.gateway import Gateway
 from app.models.gateway_group import GatewayGroup
 from app.schemas import DIDCreate, DIDUpdate, DIDResponse, DIDImport, CustomerDIDCreate, CustomerDIDResponse
-from app.services.asterisk import asterisk_service
+from app.services.provisioning import provisioning_queue
 
 router = APIRouter()
 
 
-async def sync_dids_to_asterisk(db: AsyncSession):
-    """Sincroniza DIDs com o Asterisk"""
-    dids_result = await db.execute(
-        select(DID, CustomerDID)
-        .outerjoin(CustomerDID, DID.id == CustomerDID.did_id)
-    )
-    dids_with_alloc = dids_result.all()
-
-    customers_result = await db.execute(select(Customer))
-    customers = customers_result.scalars().all()
-
-    dids_data = []
-    for did, alloc in dids_with_alloc:
-        dids_data.append({
-            "number": did.number,
-            "status": did.status,
-            "customer_id": str(alloc.customer_id) if alloc else None,
-            "destination": alloc.destination if alloc else None,
-            "destination_type": alloc.destination_type if alloc else None,
-        })
-
-    customers_data = [
-        {
-            "id": str(c.id),
-            "code": c.code,
-            "name": c.name,
-            "type": c.type,
-            "trunk_ip": c.trunk_ip,
-            "trunk_port": c.trunk_port,
-        }
-        for c in customers
-    ]
-
-    success = await asterisk_service.save_inbound_dids_config(dids_data, customers_data)
-    if success:
-        await asterisk_service.reload_dialplan()
-    return success
-
-
 @router.get("/", response_model=List[DIDResponse])
 async def list_dids(
     skip: int = 0,
@@ -222,7 +183,7 @@ async def update_did(
 
     await db.commit()
     await db.refresh(did)
-    await sync_dids_to_asterisk(db)
+    provisioning_queue.mark_dirty("dids")
     return did
 
 
@@ -239,7 +200,7 @@ async def delete_did(
         raise HTTPException(status_code=404, detail="DID não encontrado")
     await db.delete(did)
     await db.commit()
-    await sync_dids_to_asterisk(db)
+    provisioning_queue.mark_dirty("dids")
 
 
 @router.post("/{did_id}/allocate", response_model=CustomerDIDResponse)
@@ -268,7 +229,7 @@ async def allocate_did(
     db.add(customer_did)
     await db.commit()
     await db.refresh(customer_did)
-    await sync_dids_to_asterisk(db)
+    provisioning_queue.mark_dirty("dids")
     return customer_did
 
 
@@ -291,7 +252,7 @@ async def deallocate_did(
 
     await db.delete(customer_did)
     await db.commit()
-    await sync_dids_to_asterisk(db)
+    provisioning_queue.mark_dirty("dids")
 
 
 @router.post("/sync", status_code=status.HTTP_200_OK)
@@ -300,8 +261,9 @@ async def sync_dids(
     current_user: User = Depends(get_current_user)
 ):
     """Força sincronização dos DIDs com o Asterisk"""
-    success = await sync_dids_to_asterisk(db)
-    if success:
-        return {"message": "Sincronização realizada com sucesso"}
-    else:
+    results = await provisioning_queue.flush("dids", force=True)
+    if results.get("dids") == "error":
         raise HTTPException(status_code=500, detail="Erro na sincronização")
+    if results.get("dids") == "unchanged":
+        return {"message": "Configuração já sincronizada, nenhuma alteração aplicada", "result": "unchanged"}
+    return {"message": "Sincronização realizada com sucesso", "result": "updated"}
@@ -8,7 +8,8 @@ from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models.extension import Extension
 from app.schemas import ExtensionCreate, ExtensionUpdate, ExtensionResponse
-from app.services.asterisk_config import write_pjsip_extensions_async
+from app.services.provisioning import provisioning_queue
+from app.services.ami import get_extensions_status
 
 router = APIRouter()
 
@@ -20,6 +21,13 @@ async def list_extensions(
     result = await db.execute(select(Extension))
     return result.scalars().all()
 
+@router.get("/status")
+async def list_extensions_status(
+    current_user = Depends(get_current_user)
+):
+    """Retorna o DeviceState de cada ramal (via sessão AMI persistente)"""
+    return await get_extensions_status()
+
 @router.get("/{extension_id}", response_model=ExtensionResponse)
 async def get_extension(
     extension_id: UUID,
@@ -52,8 +60,8 @@ async def create_extension(
     await db.commit()
     await db.refresh(ext)
     
-    # Regenerar arquivo PJSIP
-    await write_pjsip_extensions_async(db)
+    # Agenda regeneração do arquivo PJSIP
+    provisioning_queue.mark_dirty("extensions")
     
     return ext
 
@@ -76,8 +84,8 @@ async def update_extension(
     await db.commit()
     await db.refresh(ext)
     
-    # Regenerar arquivo PJSIP
-    await write_pjsip_extensions_async(db)
+    # Agenda regeneração do arquivo PJSIP
+    provisioning_queue.mark_dirty("extensions")
     
     return ext
 
@@ -95,8 +103,8 @@ async def delete_extension(
     await db.delete(ext)
     await db.commit()
     
-    # Regenerar arquivo PJSIP
-    await write_pjsip_extensions_async(db)
+    # Agenda regeneração do arquivo PJSIP
+    provisioning_queue.mark_dirty("extensions")
     
     return {"message": "Ramal excluído com sucesso"}
 
@@ -106,8 +114,9 @@ async def regenerate_pjsip_config(
     current_user = Depends(get_current_user)
 ):
     """Força a regeneração do arquivo pjsip_extensions.conf"""
-    success = await write_pjsip_extensions_async(db)
-    if success:
-        return {"message": "Arquivo pjsip_extensions.conf regenerado com sucesso"}
-    else:
+    results = await provisioning_queue.flush("extensions", force=True)
+    if results.get("extensions") == "error":
         raise HTTPException(status_code=500, detail="Erro ao regenerar arquivo")
+    if results.get("extensions") == "unchanged":
+        return {"message": "Configuração já sincronizada, nenhuma alteração aplicada", "result": "unchanged"}
+    return {"message": "Arquivo pjsip_extensions.conf regenerado com sucesso", "result": "updated"}
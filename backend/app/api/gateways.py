@@ -9,7 +9,7 @@ from datetime import datetime
 from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models.gateway import Gateway
-from app.services.asterisk import AsteriskService
+from app.services.provisioning import provisioning_queue
 
 router = APIRouter()
 
@@ -80,11 +80,7 @@ async def create_gateway(gateway_data: GatewayCreate, db: AsyncSession = Depends
     db.add(gateway)
     await db.commit()
     await db.refresh(gateway)
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_gateways(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    provisioning_queue.mark_dirty("gateways", "routes")
     return gateway
 
 @router.put("/{gateway_id}", response_model=GatewayResponse)
@@ -99,11 +95,7 @@ async def update_gateway(gateway_id: UUID, gateway_data: GatewayUpdate, db: Asyn
         setattr(gateway, field, value)
     await db.commit()
     await db.refresh(gateway)
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_gateways(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    provisioning_queue.mark_dirty("gateways", "routes")
     return gateway
 
 @router.delete("/{gateway_id}")
@@ -115,9 +107,5 @@ async def delete_gateway(gateway_id: UUID, db: AsyncSession = Depends(get_db), c
         raise HTTPException(status_code=404, detail="Gateway não encontrado")
     await db.delete(gateway)
     await db.commit()
-    try:
-        asterisk = AsteriskService()
-        await asterisk.sync_gateways(db)
-    except Exception as e:
-        print(f"Erro ao sincronizar com Asterisk: {e}")
+    provisioning_queue.mark_dirty("gateways", "routes")
     return {"message": "Gateway excluído com sucesso"}
@@ -7,41 +7,11 @@ from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models import Provider, User
 from app.schemas import ProviderCreate, ProviderUpdate, ProviderResponse
-from app.services.asterisk import asterisk_service
+from app.services.provisioning import provisioning_queue
 
 router = APIRouter()
 
 
-async def sync_providers_to_asterisk(db: AsyncSession):
-    """Sincroniza todos os provedores ativos com o Asterisk"""
-    result = await db.execute(select(Provider).where(Provider.status == "active"))
-    providers = result.scalars().all()
-    
-    providers_data = [
-        {
-            "name": p.name,
-            "ip_address": p.ip_address,
-            "port": p.port,
-            "tech_prefix": p.tech_prefix,
-            "codecs": "alaw,ulaw",
-            "auth_type": p.auth_type,
-            "username": p.username,
-            "password": p.password,
-            "status": p.status
-        }
-        for p in providers
-    ]
-    
-    # Salva no arquivo
-    success = await asterisk_service.save_providers_config(providers_data)
-    
-    if success:
-        # Recarrega o Asterisk
-        await asterisk_service.reload_pjsip()
-    
-    return success
-
-
 @router.get("/", response_model=List[ProviderResponse])
 async def list_providers(
     skip: int = 0,
@@ -84,8 +54,8 @@ async def create_provider(
     await db.commit()
     await db.refresh(provider)
     
-    # Sincroniza com Asterisk
-    await sync_providers_to_asterisk(db)
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("providers")
     
     return provider
 
@@ -110,8 +80,8 @@ async def update_provider(
     await db.commit()
     await db.refresh(provider)
     
-    # Sincroniza com Asterisk
-    await sync_providers_to_asterisk(db)
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("providers")
     
     return provider
 
@@ -132,8 +102,8 @@ async def delete_provider(
     await db.delete(provider)
     await db.commit()
     
-    # Sincroniza com Asterisk
-    await sync_providers_to_asterisk(db)
+    # Agenda sincronização com Asterisk (gateways do provedor são removidos em cascata)
+    provisioning_queue.mark_dirty("providers", "gateways", "routes")
 
 
 @router.post("/sync", status_code=status.HTTP_200_OK)
@@ -142,9 +112,9 @@ async def sync_asterisk(
     current_user: User = Depends(get_current_user)
 ):
     """Força sincronização dos provedores com o Asterisk"""
-    success = await sync_providers_to_asterisk(db)
-    
-    if success:
-        return {"message": "Sincronização realizada com sucesso"}
-    else:
+    results = await provisioning_queue.flush("providers", force=True)
+    if results.get("providers") == "error":
         raise HTTPException(status_code=500, detail="Erro na sincronização")
+    if results.get("providers") == "unchanged":
+        return {"message": "Configuração já sincronizada, nenhuma alteração aplicada", "result": "unchanged"}
+    return {"message": "Sincronização realizada com sucesso", "result": "updated"}
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+
+from app.core.security import get_current_user
+from app.models import User
+from app.services.provisioning import provisioning_queue
+
+router = APIRouter()
+
+
+@router.get("/status")
+async def get_provisioning_status(
+    current_user: User = Depends(get_current_user)
+):
+    """Estado da fila de provisionamento por domínio"""
+    return {
+        "window_seconds": provisioning_queue.window,
+        "domains": provisioning_queue.status(),
+    }
+
+
+@router.post("/flush")
+async def flush_provisioning(
+    domain: Optional[str] = None,
+    force: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Aplica imediatamente as alterações pendentes (todas ou de um domínio)"""
+    if domain is not None and domain not in provisioning_queue.domains:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Domínio de provisionamento desconhecido: {domain}"
+        )
+
+    results = await provisioning_queue.flush(domain, force=force)
+    return {
+        "results": results,
+        "domains": provisioning_queue.status(),
+    }
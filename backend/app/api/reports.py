@@ -1,18 +1,156 @@
+import base64
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 from uuid import UUID
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from app.core.database import get_db
+from sqlalchemy import select, func, tuple_
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import async_session, get_db
 from app.core.security import get_current_user
-from app.models import CDR, DID, Provider, Customer, User
+from app.models import CDR, DID, Provider, Customer, User, cdr_hourly
+from app.services.cdr_archive import cdr_archive
+from app.services.cdr_partitions import cdr_period
+from app.services.cdr_rollups import floor_hour
+from app.services.cdr_search import SEARCH_MODES, cdr_search_filter
+from app.services.rating import from_micro
 import io
 import csv
+import json
+import zlib
 
 router = APIRouter()
 
+SEARCH_MODE_PATTERN = f"^({'|'.join(SEARCH_MODES)})$"
+
+# Totais do /reports/cdr por assinatura de filtro: a paginação não refaz a soma
+summary_cache = TTLCache("cdr_summary", settings.CDR_SUMMARY_CACHE_SECONDS, settings.CDR_SUMMARY_CACHE_ENTRIES)
+
+
+def _parse_uuid(value: Optional[str]) -> Optional[UUID]:
+    if value and value.strip():
+        try:
+            return UUID(value)
+        except ValueError:
+            pass
+    return None
+
+
+def _cdr_filters(
+    start: datetime,
+    end: datetime,
+    customer_id: Optional[str] = None,
+    call_type: Optional[str] = None,
+    search: Optional[str] = None,
+    search_mode: str = "auto",
+) -> list:
+    """Filtros comuns dos relatórios de CDR.
+
+    O período [start, end) é sempre limitado (ver cdr_period) para que a
+    consulta só leia as partições mensais do intervalo.
+    """
+    filters = [CDR.calldate >= start, CDR.calldate < end]
+    customer = _parse_uuid(customer_id)
+    if customer:
+        filters.append(CDR.customer_id == customer)
+    if call_type and call_type.strip():
+        filters.append(CDR.call_type == call_type)
+    search_filter = cdr_search_filter(search, search_mode)
+    if search_filter is not None:
+        filters.append(search_filter)
+    return filters
+
+
+def _archive_filters(
+    customer_id: Optional[str] = None,
+    call_type: Optional[str] = None,
+    search: Optional[str] = None,
+    search_mode: str = "auto",
+) -> Dict[str, Any]:
+    """Os mesmos filtros de _cdr_filters, no formato das consultas ao arquivo colunar"""
+    customer = _parse_uuid(customer_id)
+    return {
+        "customer_id": str(customer) if customer else None,
+        "call_type": call_type.strip() if call_type and call_type.strip() else None,
+        "search": search,
+        "search_mode": search_mode,
+    }
+
+
+def _encode_cursor(row, direction: str) -> str:
+    payload = json.dumps({"c": row.calldate.isoformat(), "i": str(row.id), "d": direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(token: str) -> Tuple[datetime, UUID, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        direction = payload["d"]
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return datetime.fromisoformat(payload["c"]), UUID(payload["i"]), direction
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor invalido")
+
+
+async def _load_summary(
+    start: datetime,
+    end: datetime,
+    customer_id: Optional[str],
+    call_type: Optional[str],
+) -> Dict[str, Any]:
+    """Totais do período; períodos longos sem filtro de tipo vêm dos agregados horários.
+
+    Os agregados continuam cobrindo os meses que saíram do banco (o
+    recálculo não apaga os agregados desses meses); nos demais casos, os
+    totais desses meses vêm do arquivo colunar.
+    """
+    customer = _parse_uuid(customer_id)
+    use_rollups = (
+        settings.CDR_SUMMARY_ROLLUP_DAYS > 0
+        and end - start > timedelta(days=settings.CDR_SUMMARY_ROLLUP_DAYS)
+        and not (call_type and call_type.strip())
+    )
+    if use_rollups:
+        query = select(
+            func.sum(cdr_hourly.c.calls).label('total_calls'),
+            func.sum(cdr_hourly.c.billsec).label('total_duration'),
+            func.sum(cdr_hourly.c.cost).label('total_cost'),
+            func.sum(cdr_hourly.c.price).label('total_price')
+        ).where(cdr_hourly.c.hour >= floor_hour(start), cdr_hourly.c.hour < end)
+        if customer:
+            query = query.where(cdr_hourly.c.customer_id == customer)
+    else:
+        query = select(
+            func.count(CDR.id).label('total_calls'),
+            func.sum(CDR.billsec).label('total_duration'),
+            func.sum(CDR.cost).label('total_cost'),
+            func.sum(CDR.price).label('total_price')
+        ).where(*_cdr_filters(start, end, customer_id, call_type))
+
+    async with async_session() as db:
+        row = (await db.execute(query)).one()
+    summary = {
+        "total_calls": row.total_calls or 0,
+        "total_duration": row.total_duration or 0,
+        "total_cost": float(row.total_cost or 0),
+        "total_price": float(row.total_price or 0),
+        "source": "rollup" if use_rollups else "cdr",
+    }
+    cold = [] if use_rollups else cdr_archive.cold_months(start, end)
+    if cold:
+        calls, billsec, cost, price = await cdr_archive.totals(
+            cold, start, end, **_archive_filters(customer_id, call_type)
+        )
+        summary["total_calls"] += calls
+        summary["total_duration"] += billsec
+        summary["total_cost"] += float(from_micro(cost))
+        summary["total_price"] += float(from_micro(price))
+        summary["source"] = "cdr+archive"
+    return summary
+
 
 @router.get("/cdr")
 async def get_cdr_report(
@@ -21,59 +159,80 @@ async def get_cdr_report(
     customer_id: Optional[str] = Query(None),
     call_type: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
+    search_mode: str = Query("auto", pattern=SEARCH_MODE_PATTERN),
+    cursor: Optional[str] = Query(None),
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    query = select(CDR)
-
-    if start_date:
-        query = query.where(CDR.calldate >= datetime.fromisoformat(start_date))
-    if end_date:
-        end = datetime.fromisoformat(end_date) + timedelta(days=1)
-        query = query.where(CDR.calldate < end)
-    if customer_id and customer_id.strip():
-        try:
-            query = query.where(CDR.customer_id == UUID(customer_id))
-        except:
-            pass
-    if call_type and call_type.strip():
-        query = query.where(CDR.call_type == call_type)
-    if search and search.strip():
-        query = query.where(
-            (CDR.src.ilike(f"%{search}%")) | (CDR.dst.ilike(f"%{search}%"))
-        )
+    """CDRs do período, paginados por cursor (keyset em calldate, id).
 
-    # Get records
-    result = await db.execute(
-        query.order_by(CDR.calldate.desc()).offset(skip).limit(limit)
-    )
-    records = result.scalars().all()
+    next_cursor/prev_cursor da resposta levam à página seguinte/anterior.
+    search_mode escolhe a busca em src/dst (ver cdr_search_filter); no
+    modo auto, '5511*' busca por prefixo e '*4321' por sufixo.
+    skip continua aceito sem cursor, mas percorre as linhas anteriores.
+    Meses já removidos do banco são lidos do arquivo colunar e intercalados
+    na mesma ordem.
+    """
+    start, end = cdr_period(start_date, end_date)
+    filters = _cdr_filters(start, end, customer_id, call_type, search, search_mode)
+    cold = cdr_archive.cold_months(start, end)
+    direction = "next"
+    decoded = None
+    fetch = limit + 1
+    query = select(CDR).where(*filters)
+    if cursor:
+        decoded = _decode_cursor(cursor)
+        calldate, cdr_id, direction = decoded
+        if direction == "next":
+            query = query.where(tuple_(CDR.calldate, CDR.id) < tuple_(calldate, cdr_id))
+        else:
+            query = query.where(tuple_(CDR.calldate, CDR.id) > tuple_(calldate, cdr_id))
+    elif skip:
+        if cold:
+            fetch += skip
+        else:
+            query = query.offset(skip)
 
-    # Get summary - build query with same filters
-    summary_query = select(
-        func.count(CDR.id).label('total_calls'),
-        func.sum(CDR.billsec).label('total_duration'),
-        func.sum(CDR.cost).label('total_cost'),
-        func.sum(CDR.price).label('total_price')
-    )
+    if direction == "next":
+        query = query.order_by(CDR.calldate.desc(), CDR.id.desc())
+    else:
+        query = query.order_by(CDR.calldate.asc(), CDR.id.asc())
 
-    if start_date:
-        summary_query = summary_query.where(CDR.calldate >= datetime.fromisoformat(start_date))
-    if end_date:
-        end = datetime.fromisoformat(end_date) + timedelta(days=1)
-        summary_query = summary_query.where(CDR.calldate < end)
-    if customer_id and customer_id.strip():
-        try:
-            summary_query = summary_query.where(CDR.customer_id == UUID(customer_id))
-        except:
-            pass
-    if call_type and call_type.strip():
-        summary_query = summary_query.where(CDR.call_type == call_type)
+    # Uma linha a mais indica se há outra página na mesma direção
+    result = await db.execute(query.limit(fetch))
+    records = result.scalars().all()
+    if cold:
+        archived = await cdr_archive.page(
+            cold, start, end, fetch, cursor=decoded,
+            **_archive_filters(customer_id, call_type, search, search_mode),
+        )
+        records = sorted(
+            [*records, *archived], key=lambda r: (r.calldate, r.id), reverse=direction == "next"
+        )[:fetch]
+        if not cursor:
+            records = records[skip:]
+    has_more = len(records) > limit
+    records = records[:limit]
+    if direction == "prev":
+        records.reverse()
 
-    summary_result = await db.execute(summary_query)
-    summary_row = summary_result.one()
+    next_cursor = prev_cursor = None
+    if records:
+        if has_more or direction == "prev":
+            next_cursor = _encode_cursor(records[-1], "next")
+        if (direction == "next" and (cursor or skip)) or (direction == "prev" and has_more):
+            prev_cursor = _encode_cursor(records[0], "prev")
+
+    # Summary - same filters (except search), cached per filter signature
+    customer = _parse_uuid(customer_id)
+    customer_key = str(customer) if customer else None
+    call_type_key = call_type.strip() if call_type and call_type.strip() else None
+    summary = await summary_cache.get(
+        (start, end, customer_key, call_type_key),
+        lambda: _load_summary(start, end, customer_key, call_type_key),
+    )
 
     return {
         "records": [
@@ -93,38 +252,25 @@ async def get_cdr_report(
             }
             for r in records
         ],
-        "summary": {
-            "total_calls": summary_row.total_calls or 0,
-            "total_duration": summary_row.total_duration or 0,
-            "total_cost": float(summary_row.total_cost or 0),
-            "total_price": float(summary_row.total_price or 0),
-        }
+        "summary": summary,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
     }
 
 
-@router.get("/cdr/export")
-async def export_cdr(
-    start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None),
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    query = select(CDR)
-
-    if start_date:
-        query = query.where(CDR.calldate >= datetime.fromisoformat(start_date))
-    if end_date:
-        end = datetime.fromisoformat(end_date) + timedelta(days=1)
-        query = query.where(CDR.calldate < end)
+# Colunas do export, na ordem do CSV
+_EXPORT_COLUMNS = (
+    CDR.calldate, CDR.src, CDR.dst, CDR.callerid, CDR.clid, CDR.call_type,
+    CDR.duration, CDR.billsec, CDR.disposition, CDR.cost, CDR.price,
+)
+_EXPORT_HEADER = ['Data/Hora', 'Origem', 'Destino', 'CallerID', 'Tipo', 'Duracao', 'Billsec', 'Status', 'Custo', 'Preco']
+EXPORT_CHUNK_ROWS = 2000
 
-    result = await db.execute(query.order_by(CDR.calldate.desc()))
-    records = result.scalars().all()
 
+def _export_csv(rows) -> str:
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow(['Data/Hora', 'Origem', 'Destino', 'CallerID', 'Tipo', 'Duracao', 'Billsec', 'Status', 'Custo', 'Preco'])
-
-    for r in records:
+    for r in rows:
         writer.writerow([
             r.calldate.isoformat() if r.calldate else '',
             r.src,
@@ -137,15 +283,100 @@ async def export_cdr(
             float(r.cost or 0),
             float(r.price or 0)
         ])
+    return output.getvalue()
 
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=cdr_{start_date}_{end_date}.csv"}
+
+def _export_ndjson(rows) -> str:
+    return "".join(
+        json.dumps({
+            "start_time": r.calldate.isoformat() if r.calldate else None,
+            "src": r.src,
+            "dst": r.dst,
+            "callerid": r.callerid or r.clid,
+            "call_type": r.call_type or "outbound",
+            "duration": r.duration,
+            "billsec": r.billsec,
+            "disposition": r.disposition,
+            "cost": float(r.cost or 0),
+            "price": float(r.price or 0),
+        }) + "\n"
+        for r in rows
     )
 
 
+async def _stream_export(
+    filters: list,
+    fmt: str,
+    compress: bool,
+    archive: Optional[Tuple[list, datetime, datetime, Dict[str, Any]]] = None,
+) -> AsyncIterator[bytes]:
+    """Gera o export em blocos conforme as linhas chegam do cursor no servidor.
+
+    Usa uma sessão própria: a sessão da requisição é encerrada antes de o
+    corpo da resposta ser enviado. archive traz os meses fora do banco
+    (meses, início, fim, filtros), exportados depois, por serem mais antigos.
+    """
+    encoder = zlib.compressobj(wbits=31) if compress else None
+    render = _export_csv if fmt == "csv" else _export_ndjson
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        # Z_SYNC_FLUSH: cada bloco sai comprimido na hora, sem esperar o buffer do zlib
+        return encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH) if encoder else data
+
+    if fmt == "csv":
+        header = io.StringIO()
+        csv.writer(header).writerow(_EXPORT_HEADER)
+        yield encode(header.getvalue())
+
+    async with async_session() as db:
+        result = await db.stream(
+            select(*_EXPORT_COLUMNS)
+            .where(*filters)
+            .order_by(CDR.calldate.desc())
+            .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+        )
+        async for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            chunk = encode(render(rows))
+            if chunk:
+                yield chunk
+
+    if archive:
+        months, start, end, archive_filters = archive
+        async for rows in cdr_archive.stream(months, start, end, EXPORT_CHUNK_ROWS, **archive_filters):
+            chunk = encode(render(rows))
+            if chunk:
+                yield chunk
+
+    if encoder:
+        yield encoder.flush()
+
+
+@router.get("/cdr/export")
+async def export_cdr(
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    customer_id: Optional[str] = Query(None),
+    call_type: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    search_mode: str = Query("auto", pattern=SEARCH_MODE_PATTERN),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Exporta os CDRs com os mesmos filtros de /reports/cdr, em streaming"""
+    start, end = cdr_period(start_date, end_date)
+    filters = _cdr_filters(start, end, customer_id, call_type, search, search_mode)
+    cold = cdr_archive.cold_months(start, end)
+    archive = (cold, start, end, _archive_filters(customer_id, call_type, search, search_mode)) if cold else None
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"cdr_{start_date}_{end_date}.{format}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}{'.gz' if gzip else ''}"}
+    if gzip:
+        media_type = "application/gzip"
+    return StreamingResponse(_stream_export(filters, format, gzip, archive), media_type=media_type, headers=headers)
+
+
 @router.get("/dids")
 async def get_did_report(
     db: AsyncSession = Depends(get_db),
@@ -0,0 +1,98 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.core.database import get_db
+from app.core.security import get_current_user
+from app.models import RerateJob, User
+from app.services.rerating import JOB_COMPLETED, JOB_PENDING, rerate_service
+
+router = APIRouter()
+
+
+class RerateJobCreate(BaseModel):
+    date_from: datetime
+    date_to: datetime
+    customer_id: Optional[UUID] = None
+    chunk_size: int = Field(50000, ge=1000, le=500000)
+
+
+async def _get_job(db: AsyncSession, job_id: UUID) -> RerateJob:
+    job = await db.get(RerateJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job de retarifacao nao encontrado")
+    return job
+
+
+@router.get("/")
+async def list_rerate_jobs(
+    limit: int = 50,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    result = await db.execute(select(RerateJob).order_by(RerateJob.created_at.desc()).limit(limit))
+    return [rerate_service.progress(job) for job in result.scalars()]
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def create_rerate_job(
+    data: RerateJobCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Cria e inicia um job de retarifação dos CDRs do período com as tarifas atuais"""
+    if data.date_to <= data.date_from:
+        raise HTTPException(status_code=400, detail="Periodo invalido")
+
+    job = RerateJob(**data.model_dump(), status=JOB_PENDING)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    rerate_service.start(job.id)
+    return rerate_service.progress(job)
+
+
+@router.get("/{job_id}")
+async def get_rerate_job(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Progresso do job (CDRs processados, alterados e taxa em CDRs/s)"""
+    return rerate_service.progress(await _get_job(db, job_id))
+
+
+@router.post("/{job_id}/resume")
+async def resume_rerate_job(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Retoma um job interrompido, cancelado ou com erro a partir do último bloco gravado"""
+    job = await _get_job(db, job_id)
+    if job.status == JOB_COMPLETED:
+        raise HTTPException(status_code=400, detail="Job ja concluido")
+    if rerate_service.is_running(str(job.id)):
+        raise HTTPException(status_code=409, detail="Job ja em execucao")
+
+    job.status = JOB_PENDING
+    await db.commit()
+    rerate_service.start(job.id)
+    return rerate_service.progress(job)
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_rerate_job(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Interrompe o job após o bloco atual (pode ser retomado depois)"""
+    await _get_job(db, job_id)
+    if not rerate_service.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job nao esta em execucao")
+    return {"message": "Cancelamento solicitado"}
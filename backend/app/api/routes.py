@@ -1,3 +1,4 @@
+import asyncio
 from typing import List
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, status
@@ -5,52 +6,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.database import get_db
 from app.core.security import get_current_user
-from app.models import Route, Gateway, User
-from app.schemas import RouteCreate, RouteUpdate, RouteResponse
-from app.services.asterisk import asterisk_service
+from app.models import Gateway, Route, User
+from app.schemas import RouteCreate, RouteUpdate, RouteResponse, RouteSimulationRequest
+from app.services.provisioning import provisioning_queue
+from app.services.route_matcher import RouteMatcher, gateway_data, route_data, route_matcher_cache, simulate
 
 router = APIRouter()
 
 
-async def sync_routes_to_asterisk(db: AsyncSession):
-    """Sincroniza rotas com o Asterisk"""
-    # Busca rotas
-    routes_result = await db.execute(select(Route))
-    routes = routes_result.scalars().all()
-    
-    # Busca gateways
-    gateways_result = await db.execute(select(Gateway))
-    gateways = gateways_result.scalars().all()
-    
-    routes_data = [
-        {
-            "id": str(r.id),
-            "name": r.name,
-            "pattern": r.pattern,
-            "gateway_id": str(r.gateway_id) if r.gateway_id else None,
-            "priority": r.priority,
-            "status": r.status,
-        }
-        for r in routes
-    ]
-    
-    gateways_data = [
-        {
-            "id": str(g.id),
-            "name": g.name,
-            "tech_prefix": g.tech_prefix,
-        }
-        for g in gateways
-    ]
-    
-    success = await asterisk_service.save_outbound_routes_config(routes_data, gateways_data)
-    
-    if success:
-        await asterisk_service.reload_dialplan()
-    
-    return success
-
-
 @router.get("/", response_model=List[RouteResponse])
 async def list_routes(
     skip: int = 0,
@@ -64,6 +27,54 @@ async def list_routes(
     return result.scalars().all()
 
 
+@router.get("/match")
+async def match_route(
+    number: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Rota e gateway que o número usaria com as rotas atuais"""
+    matcher = await route_matcher_cache.get(db)
+    route = matcher.match(number)
+    if not route:
+        raise HTTPException(status_code=404, detail="Nenhuma rota atende o numero")
+    return route
+
+
+@router.post("/simulate")
+async def simulate_routes(
+    data: RouteSimulationRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Roteia uma lista de números (até 100 mil) com as rotas atuais e, opcionalmente, com rotas propostas.
+
+    As rotas propostas substituem as atuais de mesmo id (ou todas, com
+    replace_all) e nada é gravado: o resultado mostra quantos números mudariam
+    de rota antes de aplicar a alteração.
+    """
+    current = await route_matcher_cache.get(db)
+
+    proposed = None
+    if data.proposed_routes is not None:
+        routes_result = await db.execute(select(Route))
+        gateways_result = await db.execute(select(Gateway))
+        routes = {} if data.replace_all else {r["id"]: r for r in map(route_data, routes_result.scalars())}
+        for index, route in enumerate(data.proposed_routes):
+            route_id = str(route.id) if route.id else f"proposed-{index + 1}"
+            routes[route_id] = {
+                "id": route_id,
+                "name": route.name,
+                "pattern": route.pattern,
+                "gateway_id": str(route.gateway_id) if route.gateway_id else None,
+                "priority": route.priority,
+                "status": route.status,
+            }
+        proposed = RouteMatcher(routes.values(), map(gateway_data, gateways_result.scalars()))
+
+    return await asyncio.to_thread(simulate, current, data.numbers, proposed)
+
+
 @router.get("/{route_id}", response_model=RouteResponse)
 async def get_route(
     route_id: UUID,
@@ -88,8 +99,8 @@ async def create_route(
     await db.commit()
     await db.refresh(route)
     
-    # Sincroniza com Asterisk
-    await sync_routes_to_asterisk(db)
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("routes")
     
     return route
 
@@ -112,8 +123,8 @@ async def update_route(
     await db.commit()
     await db.refresh(route)
     
-    # Sincroniza com Asterisk
-    await sync_routes_to_asterisk(db)
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("routes")
     
     return route
 
@@ -132,8 +143,8 @@ async def delete_route(
     await db.delete(route)
     await db.commit()
     
-    # Sincroniza com Asterisk
-    await sync_routes_to_asterisk(db)
+    # Agenda sincronização com Asterisk
+    provisioning_queue.mark_dirty("routes")
 
 
 @router.post("/sync", status_code=status.HTTP_200_OK)
@@ -142,9 +153,9 @@ async def sync_routes(
     current_user: User = Depends(get_current_user)
 ):
     """Força sincronização das rotas com o Asterisk"""
-    success = await sync_routes_to_asterisk(db)
-    
-    if success:
-        return {"message": "Sincronização realizada com sucesso"}
-    else:
+    results = await provisioning_queue.flush("routes", force=True)
+    if results.get("routes") == "error":
         raise HTTPException(status_code=500, detail="Erro na sincronização")
+    if results.get("routes") == "unchanged":
+        return {"message": "Configuração já sincronizada, nenhuma alteração aplicada", "result": "unchanged"}
+    return {"message": "Sincronização realizada com sucesso", "result": "updated"}
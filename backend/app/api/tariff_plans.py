@@ -12,6 +12,7 @@ from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models.tariff_plan import TariffPlan, tariff_plan_tariffs
 from app.models.tariff import Tariff
+from app.services.rating import rating_engine
 
 router = APIRouter()
 
@@ -101,6 +102,7 @@ async def create_tariff_plan(
             await db.execute(stmt)
 
     await db.commit()
+    rating_engine.invalidate()
 
     # Recarregar com tarifas
     query = select(TariffPlan).options(selectinload(TariffPlan.tariffs)).where(TariffPlan.id == plan.id)
@@ -133,12 +135,15 @@ async def update_tariff_plan(
     if plan_data.tariff_ids is not None:
         stmt = delete(tariff_plan_tariffs).where(tariff_plan_tariffs.c.tariff_plan_id == plan_id)
         await db.execute(stmt)
+        # Marca o plano como alterado mesmo que só as associações mudem
+        plan.updated_at = datetime.utcnow()
         
         for tariff_id in plan_data.tariff_ids:
             stmt = insert(tariff_plan_tariffs).values(tariff_plan_id=plan_id, tariff_id=tariff_id)
             await db.execute(stmt)
 
     await db.commit()
+    rating_engine.invalidate()
 
     # Recarregar com tarifas
     query = select(TariffPlan).options(selectinload(TariffPlan.tariffs)).where(TariffPlan.id == plan_id)
@@ -164,4 +169,5 @@ async def delete_tariff_plan(
 
     await db.delete(plan)
     await db.commit()
+    rating_engine.invalidate()
     return {"message": "Plano de tarifas excluído com sucesso"}
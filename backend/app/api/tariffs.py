@@ -8,6 +8,7 @@ from sqlalchemy import select
 from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models import Tariff, User
+from app.services.rating import rating_engine
 
 router = APIRouter()
 
@@ -43,6 +44,13 @@ class TariffUpdate(BaseModel):
     status: Optional[str] = None
 
 
+class RateRequest(BaseModel):
+    number: str
+    billsec: int = 60
+    customer_id: Optional[UUID] = None
+    direction: str = "outbound"
+
+
 class TariffResponse(TariffBase):
     id: UUID
     status: str
@@ -91,6 +99,25 @@ async def list_tariffs(
     ]
 
 
+@router.post("/rate")
+async def rate_call(
+    data: RateRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Tarifa uma chamada (número e duração) com as tarifas atuais do cliente"""
+    await rating_engine.ensure_fresh(db)
+    rating = rating_engine.rate(
+        str(data.customer_id) if data.customer_id else None,
+        data.number,
+        data.billsec,
+        data.direction,
+    )
+    if rating is None:
+        raise HTTPException(status_code=404, detail="Nenhuma tarifa atende o numero")
+    return rating.to_dict()
+
+
 @router.get("/{tariff_id}")
 async def get_tariff(
     tariff_id: UUID,
@@ -114,6 +141,7 @@ async def create_tariff(
     db.add(tariff)
     await db.commit()
     await db.refresh(tariff)
+    rating_engine.invalidate()
     
     return {
         "id": str(tariff.id),
@@ -150,6 +178,7 @@ async def update_tariff(
     
     await db.commit()
     await db.refresh(tariff)
+    rating_engine.invalidate()
     
     return {
         "id": str(tariff.id),
@@ -182,3 +211,4 @@ async def delete_tariff(
     
     await db.delete(tariff)
     await db.commit()
+    rating_engine.invalidate()
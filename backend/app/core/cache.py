@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from app.core.metrics import metrics
+
+
+class TTLCache:
+    """Cache assíncrono em memória com validade (TTL) e carga única.
+
+    Enquanto um valor está sendo carregado, as demais chamadas para a mesma
+    chave aguardam a mesma carga em vez de repetir a consulta (single-flight).
+    A carga roda numa tarefa própria: o cancelamento de quem pediu primeiro
+    não cancela a consulta para os demais.
+
+    Guarda no máximo max_entries chaves (LRU); entradas vencidas saem ao
+    serem consultadas ou quando chegam à frente da fila durante uma carga.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._values: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._values.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._values.move_to_end(key)
+                metrics.incr(f"cache.{self.name}.hit")
+                return entry[1]
+            del self._values[key]
+
+        task = self._loading.get(key)
+        if task is None:
+            metrics.incr(f"cache.{self.name}.miss")
+            task = self._loading[key] = asyncio.create_task(self._load(key, loader))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            start = time.perf_counter()
+            value = await loader()
+            metrics.observe(f"cache.{self.name}.load", time.perf_counter() - start)
+            self._store(key, value)
+            return value
+        finally:
+            self._loading.pop(key, None)
+
+    def _store(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        self._values[key] = (now + self.ttl, value)
+        self._values.move_to_end(key)
+        while self._values:
+            oldest = next(iter(self._values.values()))
+            if oldest[0] > now and len(self._values) <= self.max_entries:
+                break
+            self._values.popitem(last=False)
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """Segundos desde a última carga da chave (None se não está em cache)"""
+        entry = self._values.get(key)
+        return time.monotonic() - (entry[0] - self.ttl) if entry else None
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
@@ -22,6 +22,59 @@ class Settings(BaseSettings):
     AMI_PORT: int = 5038
     AMI_USERNAME: str = "admin"
     AMI_SECRET: str = "admin"
+    AMI_CONNECT_TIMEOUT: float = 5.0
+    AMI_ACTION_TIMEOUT: float = 10.0
+    AMI_RECONNECT_MAX_DELAY: float = 30.0
+    AMI_MAX_FRAME_SIZE: int = 1048576
+    
+    # Provisionamento (debounce de regeneração de configuração)
+    PROVISIONING_DEBOUNCE_SECONDS: float = 2.0
+    
+    # Tarifação: intervalo (s) entre conferências de alteração nas tarifas em cache
+    RATING_REFRESH_SECONDS: float = 5.0
+    
+    # Ingestão de CDRs: "ami" (eventos Cdr), "csv" (Master.csv) ou vazio (desativada)
+    CDR_INGEST_SOURCE: str = ""
+    CDR_INGEST_CSV_PATH: str = "/var/log/asterisk/cdr-csv/Master.csv"
+    CDR_INGEST_BATCH_SIZE: int = 5000
+    CDR_INGEST_FLUSH_SECONDS: float = 1.0
+    CDR_INGEST_QUEUE_SIZE: int = 50000
+    # Intervalo (s) entre conferências dos índices de atribuição (clientes, gateways, ramais, DIDs)
+    CDR_ATTRIBUTION_REFRESH_SECONDS: float = 10.0
+    # Partições mensais da tabela cdr: meses criados à frente e retenção (0 = manter tudo)
+    CDR_PARTITION_MONTHS_AHEAD: int = 3
+    CDR_RETENTION_MONTHS: int = 0
+    # Ação da retenção: "archive" (move para o schema cdr_archive), "drop", "detach"
+    # ou "columnar" (grava o mês em CDR_ARCHIVE_PATH e remove a partição)
+    CDR_RETENTION_ACTION: str = "archive"
+    CDR_PARTITION_MAINTENANCE_HOURS: float = 6.0
+    # Diretório do arquivo colunar de CDRs e linhas por grupo (.npz) de cada mês
+    CDR_ARCHIVE_PATH: str = "/var/lib/trunkflow/cdr-archive"
+    CDR_ARCHIVE_ROW_GROUP_ROWS: int = 100000
+    # Janela (dias) dos relatórios de CDR sem data inicial informada
+    CDR_REPORT_DEFAULT_DAYS: int = 31
+    # Validade (s) do snapshot de estatísticas do dashboard
+    DASHBOARD_CACHE_SECONDS: float = 5.0
+    # Totais do relatório de CDR: validade (s) e máximo de entradas do cache e período
+    # (dias) a partir do qual vêm dos agregados horários (0 = sempre dos CDRs)
+    CDR_SUMMARY_CACHE_SECONDS: float = 30.0
+    CDR_SUMMARY_CACHE_ENTRIES: int = 1000
+    CDR_SUMMARY_ROLLUP_DAYS: int = 7
+    
+    # Captura SIP (debug): backend "auto" (AF_PACKET, com tcpdump como alternativa),
+    # "af_packet" ou "tcpdump"; portas separadas por vírgula; lotes aguardando análise
+    SIP_CAPTURE_BACKEND: str = "auto"
+    SIP_CAPTURE_PORTS: str = "5060"
+    SIP_CAPTURE_SNAPLEN: int = 65535
+    SIP_CAPTURE_QUEUE_SIZE: int = 1000
+    # Chamadas mantidas pelo debug (as menos recentes saem primeiro) e mensagens por chamada
+    SIP_DEBUG_MAX_CALLS: int = 5000
+    SIP_DEBUG_MAX_CALL_MESSAGES: int = 200
+    # Análise de arquivos pcap/pcapng: diretório dos arquivos (uploads e caminhos aceitos),
+    # processos (0 = um por CPU) e tamanho (MB) dos trechos divididos entre eles
+    SIP_PCAP_DIR: str = "/var/lib/trunkflow/pcap"
+    SIP_PCAP_WORKERS: int = 0
+    SIP_PCAP_CHUNK_MB: int = 64
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
@@ -29,6 +82,11 @@ class Settings(BaseSettings):
     # Asterisk Paths
     ASTERISK_CONFIG_PATH: str = "/etc/asterisk"
     ASTERISK_SPOOL_PATH: str = "/var/spool/asterisk/outgoing"
+    # Diretório (relativo a ASTERISK_CONFIG_PATH) dos fragmentos por objeto
+    ASTERISK_FRAGMENTS_DIR: str = "trunkflow.d"
+    # Retenção dos backups comprimidos, por arquivo
+    ASTERISK_BACKUP_MAX_PER_FILE: int = 10
+    ASTERISK_BACKUP_MAX_AGE_DAYS: int = 30
     
     class Config:
         env_file = ".env"
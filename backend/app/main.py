@@ -1,8 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import auth, customers, providers, gateways, dids, routes, extensions, tariffs, dashboard, reports, conference, debug
-from app.api import route_plans, tariff_plans, gateway_groups, debug
+from app.api import route_plans, tariff_plans, gateway_groups, debug, provisioning, config_backups, config_snapshots, rerating, cdr_ingest, cdr_partitions, cdr_archive
+from app.core.metrics import metrics
+from app.core.security import get_current_user
+from app.models import User
+from app.services.ami import ami_manager
+from app.services.asterisk import asterisk_service
+from app.services.cdr_ingest import cdr_ingest_service
+from app.services.cdr_partitions import cdr_partition_manager
+from app.services.channels import channel_table
+from app.services.provisioning import provisioning_queue
+from app.services.rerating import rerate_service
 
 app = FastAPI(title="TrunkFlow API", version="1.0.0")
 
@@ -28,11 +39,46 @@ app.include_router(reports.router, prefix="/api/v1/reports", tags=["Reports"])
 app.include_router(conference.router, prefix="/api/v1/conference", tags=["Conference"])
 app.include_router(route_plans.router, prefix="/api/v1/route-plans", tags=["Route Plans"])
 app.include_router(tariff_plans.router, prefix="/api/v1/tariff-plans", tags=["Tariff Plans"])
+app.include_router(provisioning.router, prefix="/api/v1/provisioning", tags=["Provisioning"])
+app.include_router(config_backups.router, prefix="/api/v1/config-backups", tags=["Config Backups"])
+app.include_router(config_snapshots.router, prefix="/api/v1/config-snapshots", tags=["Config Snapshots"])
+app.include_router(rerating.router, prefix="/api/v1/rerating", tags=["Rerating"])
+app.include_router(cdr_ingest.router, prefix="/api/v1/cdr-ingest", tags=["CDR Ingest"])
+app.include_router(cdr_partitions.router, prefix="/api/v1/cdr-partitions", tags=["CDR Partitions"])
+app.include_router(cdr_archive.router, prefix="/api/v1/cdr-archive", tags=["CDR Archive"])
+
+@app.on_event("startup")
+async def startup():
+    channel_table.install(ami_manager)
+    cdr_ingest_service.start(ami_manager)
+    await ami_manager.start()
+    # Retenção dos backups (inclusive '.bak' antigos) sem atrasar o startup
+    asyncio.get_running_loop().run_in_executor(None, asterisk_service.backups.prune_all)
+    # Partições futuras da tabela cdr e retenção, em segundo plano
+    cdr_partition_manager.start()
+    # Jobs de retarifação interrompidos continuam do último bloco gravado
+    await rerate_service.resume_interrupted()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Aplica alterações ainda pendentes na janela de debounce
+    await provisioning_queue.flush()
+    # Grava os CDRs ainda na fila de ingestão
+    await cdr_ingest_service.stop()
+    await cdr_partition_manager.stop()
+    await ami_manager.stop()
+
 
 @app.get("/api/v1/health")
 async def health_check():
     return {"status": "healthy"}
 
+
+@app.get("/api/v1/metrics")
+async def get_metrics(current_user: User = Depends(get_current_user)):
+    return metrics.snapshot()
+
 # Debug routes
 from app.api import debug
 app.include_router(debug.router, prefix="/api/v1/debug", tags=["Debug"])
@@ -10,6 +10,8 @@ from app.models.tariff import Tariff
 from app.models.cdr import CDR
 from app.models.route_plan import RoutePlan, route_plan_routes
 from app.models.tariff_plan import TariffPlan, tariff_plan_tariffs
+from app.models.rerating_job import RerateJob
+from app.models.cdr_hourly import cdr_hourly
 
 # Importar associações se existirem
 try:
@@ -15,7 +15,7 @@ class CDR(Base):
     gateway_id = Column(UUID(as_uuid=True), ForeignKey("gateways.id", ondelete="SET NULL"))
     
     # Campos padrão do Asterisk CDR
-    calldate = Column(DateTime, index=True, default=datetime.utcnow)
+    calldate = Column(DateTime, nullable=False, index=True, default=datetime.utcnow)  # chave de partição mensal
     clid = Column(String(80))
     src = Column(String(50), index=True)
     dst = Column(String(50), index=True)
@@ -0,0 +1,34 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Numeric, String, Table, func, text
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.database import Base
+
+# Agregados horários de CDR (hora x cliente x gateway x prefixo x disposition),
+# mantidos pela ingestão e por app.services.cdr_rollups
+cdr_hourly = Table(
+    'cdr_hourly',
+    Base.metadata,
+    Column('hour', DateTime, nullable=False),
+    Column('customer_id', UUID(as_uuid=True)),
+    Column('gateway_id', UUID(as_uuid=True)),
+    Column('prefix', String(4), nullable=False, server_default=''),
+    Column('disposition', String(50), nullable=False, server_default=''),
+    Column('calls', BigInteger, nullable=False, server_default='0'),
+    Column('billsec', BigInteger, nullable=False, server_default='0'),
+    Column('cost', Numeric(16, 6), nullable=False, server_default='0'),
+    Column('price', Numeric(16, 6), nullable=False, server_default='0'),
+)
+
+_ZERO_UUID = text("'00000000-0000-0000-0000-000000000000'::uuid")
+
+Index(
+    'uq_cdr_hourly_key',
+    cdr_hourly.c.hour,
+    func.coalesce(cdr_hourly.c.customer_id, _ZERO_UUID),
+    func.coalesce(cdr_hourly.c.gateway_id, _ZERO_UUID),
+    cdr_hourly.c.prefix,
+    cdr_hourly.c.disposition,
+    unique=True,
+)
+Index('idx_cdr_hourly_customer', cdr_hourly.c.customer_id, cdr_hourly.c.hour)
+Index('idx_cdr_hourly_gateway', cdr_hourly.c.gateway_id, cdr_hourly.c.hour)
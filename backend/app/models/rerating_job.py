@@ -0,0 +1,31 @@
+import uuid
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, String, Integer, DateTime, Float, Text, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.database import Base
+
+class RerateJob(Base):
+    __tablename__ = "rerating_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    date_from = Column(DateTime, nullable=False)
+    date_to = Column(DateTime, nullable=False)
+    customer_id = Column(UUID(as_uuid=True), ForeignKey("customers.id", ondelete="CASCADE"), nullable=True)
+    chunk_size = Column(Integer, default=50000)
+    status = Column(String(20), default="pending")  # pending, running, completed, failed, cancelled
+
+    # Cursor do último bloco gravado (retomada)
+    last_calldate = Column(DateTime)
+    last_id = Column(UUID(as_uuid=True))
+
+    total_estimate = Column(BigInteger, default=0)
+    processed = Column(BigInteger, default=0)
+    updated_rows = Column(BigInteger, default=0)
+    unrated = Column(BigInteger, default=0)
+    elapsed_seconds = Column(Float, default=0)
+    error = Column(Text)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -181,6 +181,24 @@ class RouteResponse(RouteBase):
         from_attributes = True
 
 
+class RouteSimulationRoute(BaseModel):
+    """Rota proposta para simulação (id de rota existente para substituí-la)"""
+    id: Optional[UUID] = None
+    name: str
+    pattern: str
+    gateway_id: Optional[UUID] = None
+    priority: int = 1
+    status: str = "active"
+
+
+class RouteSimulationRequest(BaseModel):
+    numbers: List[str] = Field(..., max_length=100000)
+    # Sem proposed_routes só o roteamento atual é calculado
+    proposed_routes: Optional[List[RouteSimulationRoute]] = None
+    # Com replace_all as rotas propostas substituem todas as atuais
+    replace_all: bool = False
+
+
 # ============================================
 # CUSTOMER SCHEMAS
 # ============================================
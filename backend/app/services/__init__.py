@@ -1,2 +1,2 @@
 from app.services.asterisk import AsteriskService
-from app.services.ami import AMIClient, get_extensions_status, check_extension_online
+from app.services.ami import AMIManager, AMIError, ami_manager, get_extensions_status, check_extension_online
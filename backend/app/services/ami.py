@@ -1,107 +1,319 @@
-import socket
-from typing import Dict
+import asyncio
+import itertools
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from loguru import logger
+from app.core.config import settings
+from app.services.ami_parser import AMIFrameParser, EventListCollector
 
-class AMIClient:
-    def __init__(self, host: str = "127.0.0.1", port: int = 5038, username: str = "admin", secret: str = "admin123"):
+
+class AMIError(Exception):
+    """Erro de comunicação com o AMI"""
+
+
+EventHandler = Callable[[Dict[str, str]], Union[None, Awaitable[None]]]
+
+
+class _PendingAction:
+    """Ação enviada aguardando resposta (e, opcionalmente, a lista de eventos)"""
+
+    __slots__ = ("future", "collect_list", "response", "events")
+
+    def __init__(self, future: asyncio.Future, collect_list: bool):
+        self.future = future
+        self.collect_list = collect_list
+        self.response: Optional[Dict[str, str]] = None
+        self.events: List[Dict[str, str]] = []
+
+
+READ_CHUNK_SIZE = 65536
+
+
+class AMIManager:
+    """Sessão AMI persistente (asyncio) compartilhada por toda a aplicação.
+
+    Faz login uma única vez, reconecta com backoff exponencial e associa
+    respostas às ações pelo ActionID, permitindo que várias corrotinas
+    enviem ações ao mesmo tempo pela mesma conexão.
+    """
+
+    def __init__(
+        self,
+        host: str = settings.AMI_HOST,
+        port: int = settings.AMI_PORT,
+        username: str = settings.AMI_USERNAME,
+        secret: str = settings.AMI_SECRET,
+        connect_timeout: float = settings.AMI_CONNECT_TIMEOUT,
+        action_timeout: float = settings.AMI_ACTION_TIMEOUT,
+        reconnect_max_delay: float = settings.AMI_RECONNECT_MAX_DELAY,
+        max_frame_size: int = settings.AMI_MAX_FRAME_SIZE,
+    ):
         self.host = host
         self.port = port
         self.username = username
         self.secret = secret
-        self.sock = None
-    
-    def connect(self) -> bool:
+        self.connect_timeout = connect_timeout
+        self.action_timeout = action_timeout
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_frame_size = max_frame_size
+
+        self._parser: Optional[AMIFrameParser] = None
+        self._lists = EventListCollector()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, _PendingAction] = {}
+        self._action_ids = itertools.count(1)
+        self._event_handlers: List[EventHandler] = []
+        self._connect_handlers: List[Callable[[], Awaitable[None]]] = []
+
+    @property
+    def connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    # ==========================================
+    # CICLO DE VIDA
+    # ==========================================
+    async def start(self):
+        """Inicia a sessão em background (não bloqueia aguardando o login)"""
+        if self._task and not self._task.done():
+            return
+        self._write_lock = asyncio.Lock()
+        self._connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Encerra a sessão e cancela ações pendentes"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+
+    async def _run(self):
+        """Mantém a conexão viva, reconectando com backoff exponencial"""
+        delay = 1.0
+        while True:
+            try:
+                await self._connect()
+                delay = 1.0
+                await self._read_loop()
+                logger.warning("Conexão AMI encerrada pelo Asterisk")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro na sessão AMI: {e}")
+            finally:
+                await self._close()
+
+            wait = delay * random.uniform(0.8, 1.2)
+            logger.info(f"Reconectando ao AMI em {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            timeout=self.connect_timeout
+        )
+        # O banner ("Asterisk Call Manager/x.y.z") termina com uma única quebra de linha
+        self._parser = AMIFrameParser(self.max_frame_size, expect_banner=True)
+
+        action_id = self._next_action_id()
+        await self._write(
+            f"Action: Login\r\nActionID: {action_id}\r\n"
+            f"Username: {self.username}\r\nSecret: {self.secret}\r\nEvents: on\r\n\r\n"
+        )
+        message = None
+        while message is None:
+            data = await asyncio.wait_for(
+                self._reader.read(READ_CHUNK_SIZE), timeout=self.connect_timeout
+            )
+            if not data:
+                raise AMIError("Conexão AMI encerrada durante o login")
+            for frame in self._parser.feed(data):
+                if frame.get("ActionID") == action_id:
+                    message = frame
+        if message.get("Response") != "Success":
+            raise AMIError(f"Login AMI recusado: {message.get('Message', '')}")
+
+        logger.info(f"Sessão AMI estabelecida em {self.host}:{self.port}")
+        self._connected.set()
+        for handler in self._connect_handlers:
+            asyncio.create_task(self._run_connect_handler(handler))
+
+    async def _run_connect_handler(self, handler: Callable[[], Awaitable[None]]):
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(5)
-            self.sock.connect((self.host, self.port))
-            
-            # Ler banner
-            self.sock.recv(1024)
-            
-            # Login
-            login_cmd = f"Action: Login\r\nUsername: {self.username}\r\nSecret: {self.secret}\r\n\r\n"
-            self.sock.send(login_cmd.encode())
-            response = self.sock.recv(1024).decode()
-            
-            return "Success" in response
+            await handler()
         except Exception as e:
-            print(f"AMI connection error: {e}")
-            return False
-    
-    def disconnect(self):
-        if self.sock:
+            logger.error(f"Erro no handler de conexão AMI: {e}")
+
+    async def _close(self):
+        if self._connected:
+            self._connected.clear()
+        for pending in self._pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(AMIError("Conexão AMI perdida"))
+        self._pending.clear()
+        self._lists.clear()
+        if self._writer:
             try:
-                logoff_cmd = "Action: Logoff\r\n\r\n"
-                self.sock.send(logoff_cmd.encode())
-                self.sock.close()
-            except:
+                self._writer.close()
+                await self._writer.wait_closed()
+            except Exception:
                 pass
-            self.sock = None
-    
-    def get_pjsip_endpoints(self) -> Dict[str, str]:
-        """Retorna status de todos os endpoints PJSIP"""
-        endpoints = {}
-        
-        if not self.sock:
-            if not self.connect():
-                return endpoints
-        
-        try:
-            # Comando para listar endpoints PJSIP
-            cmd = "Action: PJSIPShowEndpoints\r\n\r\n"
-            self.sock.send(cmd.encode())
-            
-            # Ler resposta completa
-            response = ""
-            while True:
+        self._reader = None
+        self._writer = None
+
+    # ==========================================
+    # LEITURA / DESPACHO
+    # ==========================================
+    async def _read_loop(self):
+        while True:
+            data = await self._reader.read(READ_CHUNK_SIZE)
+            if not data:
+                return
+            for message in self._parser.feed(data):
+                await self._dispatch(message)
+
+    async def _dispatch(self, message: Dict[str, str]):
+        action_id = message.get("ActionID")
+
+        if "Event" in message and self._lists.is_collecting(action_id):
+            done = self._lists.add(message)
+            if done is not None:
+                pending = self._pending.get(action_id)
+                if pending is not None:
+                    pending.response, pending.events = done
+                    self._resolve(action_id, pending)
+            return
+
+        pending = self._pending.get(action_id) if action_id else None
+        if pending is not None and "Response" in message:
+            pending.response = message
+            is_list = message.get("EventList", "").lower() == "start"
+            if pending.collect_list and is_list and message["Response"] == "Success":
+                self._lists.start(action_id, message)
+            else:
+                self._resolve(action_id, pending)
+            return
+
+        if "Event" in message:
+            for handler in self._event_handlers:
                 try:
-                    chunk = self.sock.recv(4096).decode()
-                    response += chunk
-                    if "EventList: Complete" in chunk or not chunk:
-                        break
-                except socket.timeout:
-                    break
-            
-            # Parsear resposta
-            for block in response.split("\r\n\r\n"):
-                if "Event: EndpointList" in block:
-                    endpoint_name = ""
-                    device_state = "Unavailable"
-                    
-                    for line in block.split("\r\n"):
-                        if line.startswith("ObjectName:"):
-                            endpoint_name = line.split(":", 1)[1].strip()
-                        elif line.startswith("DeviceState:"):
-                            device_state = line.split(":", 1)[1].strip()
-                    
-                    if endpoint_name:
-                        # Filtrar apenas ramais numéricos
-                        if endpoint_name.isdigit():
-                            endpoints[endpoint_name] = device_state
-            
-        except Exception as e:
-            print(f"AMI error getting endpoints: {e}")
-        
-        return endpoints
+                    result = handler(message)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Erro no handler de evento AMI: {e}")
 
+    def _resolve(self, action_id: str, pending: _PendingAction):
+        self._pending.pop(action_id, None)
+        if not pending.future.done():
+            pending.future.set_result(pending)
 
-def get_extensions_status() -> Dict[str, str]:
-    """Função helper para obter status de todos os ramais"""
-    ami = AMIClient()
+    # ==========================================
+    # ESCRITA / AÇÕES
+    # ==========================================
+    def _next_action_id(self) -> str:
+        return f"trunkflow-{next(self._action_ids)}"
+
+    async def _write(self, data: str):
+        async with self._write_lock:
+            # A conexão pode cair entre _connected.wait() e a escrita
+            writer = self._writer
+            if writer is None:
+                raise AMIError("AMI indisponível")
+            try:
+                writer.write(data.encode())
+                await writer.drain()
+            except OSError as e:
+                raise AMIError("AMI indisponível") from e
+
+    async def _send(self, action: str, fields: Dict[str, Any], collect_list: bool) -> _PendingAction:
+        await self.start()
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=self.action_timeout)
+        except asyncio.TimeoutError:
+            raise AMIError("AMI indisponível")
+
+        action_id = self._next_action_id()
+        lines = [f"Action: {action}", f"ActionID: {action_id}"]
+        lines.extend(f"{key}: {value}" for key, value in fields.items() if value is not None)
+        payload = "\r\n".join(lines) + "\r\n\r\n"
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[action_id] = _PendingAction(future, collect_list)
+        try:
+            await self._write(payload)
+            return await asyncio.wait_for(future, timeout=self.action_timeout)
+        except asyncio.TimeoutError:
+            raise AMIError(f"Timeout aguardando resposta da ação {action}")
+        finally:
+            self._pending.pop(action_id, None)
+            self._lists.discard(action_id)
+
+    async def send_action(self, action: str, **fields) -> Dict[str, str]:
+        """Envia uma ação e retorna a resposta"""
+        pending = await self._send(action, fields, collect_list=False)
+        return pending.response
+
+    async def send_action_list(self, action: str, **fields) -> List[Dict[str, str]]:
+        """Envia uma ação que gera lista de eventos (EventList) e retorna os eventos"""
+        pending = await self._send(action, fields, collect_list=True)
+        if pending.response and pending.response.get("Response") == "Error":
+            raise AMIError(pending.response.get("Message", f"Erro na ação {action}"))
+        return pending.events
+
+    async def command(self, command: str) -> str:
+        """Executa um comando CLI via ação Command e retorna a saída"""
+        response = await self.send_action("Command", Command=command)
+        if response.get("Response") == "Error":
+            raise AMIError(response.get("Message", f"Erro ao executar '{command}'"))
+        return response.get("Output", "")
+
+    def add_event_handler(self, handler: EventHandler):
+        """Registra callback chamado para cada evento AMI não associado a uma ação"""
+        self._event_handlers.append(handler)
+
+    def add_connect_handler(self, handler: Callable[[], Awaitable[None]]):
+        """Registra corrotina executada a cada (re)conexão bem sucedida"""
+        self._connect_handlers.append(handler)
+
+
+# Instância global
+ami_manager = AMIManager()
+
+
+ONLINE_STATES = ["Not in use", "In use", "Ringing", "On hold"]
+
+
+async def get_extensions_status() -> Dict[str, str]:
+    """Retorna status (DeviceState) de todos os ramais PJSIP numéricos"""
+    endpoints = {}
     try:
-        if ami.connect():
-            endpoints = ami.get_pjsip_endpoints()
-            return endpoints
+        events = await ami_manager.send_action_list("PJSIPShowEndpoints")
     except Exception as e:
-        print(f"Error getting extensions status: {e}")
-    finally:
-        ami.disconnect()
-    return {}
+        logger.error(f"Erro ao obter status dos ramais: {e}")
+        return endpoints
+
+    for event in events:
+        if event.get("Event") != "EndpointList":
+            continue
+        endpoint_name = event.get("ObjectName", "")
+        # Filtrar apenas ramais numéricos
+        if endpoint_name.isdigit():
+            endpoints[endpoint_name] = event.get("DeviceState", "Unavailable")
+    return endpoints
 
 
-def check_extension_online(extension: str) -> bool:
+async def check_extension_online(extension: str) -> bool:
     """Verifica se um ramal específico está online"""
-    status = get_extensions_status()
-    ext_status = status.get(extension, "Unavailable")
+    status = await get_extensions_status()
     # "Not in use" ou "In use" significa online
-    return ext_status in ["Not in use", "In use", "Ringing", "On hold"]
+    return status.get(extension, "Unavailable") in ONLINE_STATES
@@ -0,0 +1,150 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class AMIProtocolError(Exception):
+    """Fluxo AMI inválido (ex.: mensagem maior que o limite do buffer)"""
+
+
+FRAME_END = b"\r\n\r\n"
+
+
+def parse_frame(text: str) -> Dict[str, str]:
+    """Converte um bloco AMI (linhas 'Chave: valor') em dicionário.
+
+    O Asterisk separa chave e valor com ': '; o valor é o restante da linha,
+    sem strip. Linhas fora desse formato (saída de Command, ':' sem espaço) e
+    chaves repetidas seguem para o caminho lento, que as trata e concatena
+    os valores repetidos com quebra de linha.
+    """
+    lines = text.split("\r\n")
+    message = {}
+    for line in lines:
+        key, sep, value = line.partition(": ")
+        if not sep:
+            return _parse_frame_slow(lines)
+        message[key] = value
+    if len(message) == len(lines):
+        return message
+    return _parse_frame_slow(lines)
+
+
+def _parse_frame_slow(lines: List[str]) -> Dict[str, str]:
+    message: Dict[str, str] = {}
+    for line in lines:
+        if not line:
+            continue
+        key, sep, value = line.partition(": ")
+        if not sep:
+            key, sep, value = line.partition(":")
+            if sep:
+                key, value = key.strip(), value.strip()
+            else:
+                # Saída de Command no formato legado (Response: Follows)
+                key, value = "Output", line
+        if key in message:
+            message[key] += "\n" + value
+        else:
+            message[key] = value
+    return message
+
+
+class AMIFrameParser:
+    """Parser incremental do protocolo AMI em nível de bytes.
+
+    Recebe pedaços arbitrários do socket via feed() e devolve cada mensagem
+    assim que a linha em branco que a termina chega. Cada byte é varrido uma
+    única vez (a busca recomeça de onde parou) e o buffer é limitado a
+    max_frame_size bytes por mensagem.
+    """
+
+    def __init__(self, max_frame_size: int = 1024 * 1024, expect_banner: bool = False):
+        self.max_frame_size = max_frame_size
+        self.banner: Optional[str] = None
+        self._expect_banner = expect_banner
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    def feed(self, data: bytes) -> List[Dict[str, str]]:
+        """Adiciona dados recebidos e retorna as mensagens completas"""
+        buffer = self._buffer
+        buffer += data
+
+        if self._expect_banner:
+            end = buffer.find(b"\r\n")
+            if end < 0:
+                self._check_size(len(buffer))
+                return []
+            self.banner = buffer[:end].decode("utf-8", errors="replace")
+            del buffer[:end + 2]
+            self._expect_banner = False
+
+        # Recua 3 bytes para detectar terminador dividido entre dois pedaços
+        end = buffer.rfind(FRAME_END, max(self._scan_from - 3, 0))
+        if end < 0:
+            self._scan_from = len(buffer)
+            self._check_size(len(buffer))
+            return []
+
+        # Todas as mensagens completas são decodificadas de uma vez
+        text = buffer[:end].decode("utf-8", errors="replace")
+        del buffer[:end + 4]
+        self._scan_from = len(buffer)
+        self._check_size(len(buffer))
+        return [parse_frame(frame) for frame in text.split("\r\n\r\n") if frame]
+
+    def _check_size(self, size: int):
+        if size > self.max_frame_size:
+            self.reset()
+            raise AMIProtocolError(
+                f"Mensagem AMI excede o limite de {self.max_frame_size} bytes"
+            )
+
+    @property
+    def buffered(self) -> int:
+        """Bytes recebidos aguardando o fim da mensagem"""
+        return len(self._buffer)
+
+    def reset(self):
+        self._buffer.clear()
+        self._scan_from = 0
+
+
+class EventListCollector:
+    """Agrupa respostas em lista (EventList: start ... Complete) por ActionID.
+
+    Ações como PJSIPShowEndpoints e CoreShowChannels respondem com
+    'EventList: start' seguido de um evento por item e um evento final com
+    'EventList: Complete'. add() devolve (resposta, eventos) quando a lista
+    da ação termina e None enquanto ela estiver em andamento.
+    """
+
+    def __init__(self, max_events: int = 1_000_000):
+        self.max_events = max_events
+        self._lists: Dict[str, Tuple[Dict[str, str], List[Dict[str, str]]]] = {}
+
+    def start(self, action_id: str, response: Dict[str, str]):
+        self._lists[action_id] = (response, [])
+
+    def is_collecting(self, action_id: Optional[str]) -> bool:
+        return action_id is not None and action_id in self._lists
+
+    def add(self, message: Dict[str, str]) -> Optional[Tuple[Dict[str, str], List[Dict[str, str]]]]:
+        action_id = message.get("ActionID")
+        entry = self._lists.get(action_id)
+        if entry is None:
+            return None
+        event_list = message.get("EventList")
+        if event_list and event_list.lower() == "complete":
+            return self._lists.pop(action_id)
+        events = entry[1]
+        if len(events) >= self.max_events:
+            del self._lists[action_id]
+            raise AMIProtocolError(f"Lista de eventos da ação {action_id} excede {self.max_events} itens")
+        events.append(message)
+        return None
+
+    def discard(self, action_id: str):
+        self._lists.pop(action_id, None)
+
+    def clear(self):
+        self._lists.clear()
@@ -1,10 +1,48 @@
+import asyncio
+import hashlib
 import os
+import re
 import subprocess
 import shutil
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import tempfile
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Set, Tuple
 from loguru import logger
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.channels import channel_table
+from app.services.config_backup import ConfigBackupStore
+from app.services.config_snapshots import ConfigSnapshotStore
+from app.services.config_render import (
+    ConfigWriter,
+    content_hash,
+    read_config_hash,
+    render_header,
+    render_section,
+    render_trunk,
+)
+from app.services.reload import reloader
+
+# Resultado da gravação de um arquivo de configuração
+CONFIG_UPDATED = "updated"
+CONFIG_UNCHANGED = "unchanged"
+CONFIG_ERROR = "error"
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9_.-]")
+# Tipos de objeto gravados como fragmentos (subdiretórios de ASTERISK_FRAGMENTS_DIR)
+FRAGMENT_KINDS = ("gateways", "trunks", "extensions")
+# Buffer de escrita dos arquivos gerados em streaming
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+def _fsync_dir(directory: str):
+    """Garante que o rename dentro do diretório chegou ao disco"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class AsteriskService:
@@ -16,509 +54,661 @@ class AsteriskService:
         self.providers_file = os.path.join(self.config_path, "pjsip_providers.conf")
         self.gateways_file = os.path.join(self.config_path, "pjsip_gateways.conf")
         self.customer_trunks_file = os.path.join(self.config_path, "pjsip_customer_trunks.conf")
+        self.extensions_pjsip_file = os.path.join(self.config_path, "pjsip_extensions.conf")
         self.extensions_file = os.path.join(self.config_path, "extensions_custom.conf")
+        self.routes_file = os.path.join(self.config_path, "extensions_routes.conf")
+        self.dids_file = os.path.join(self.config_path, "extensions_dids.conf")
         self.backup_path = os.path.join(self.config_path, "backups")
+        self.fragments_path = os.path.join(self.config_path, settings.ASTERISK_FRAGMENTS_DIR)
+        # Hash conhecido de cada fragmento em disco, por tipo de objeto
+        self._fragment_index: Dict[str, Dict[str, str]] = {}
+        # Os lotes de fragmentos rodam em threads; um lote por vez mexe no índice
+        self._fragment_lock = threading.Lock()
         
         os.makedirs(self.backup_path, exist_ok=True)
+        self.backups = ConfigBackupStore(self.config_path, self.backup_path)
+        self.snapshots = ConfigSnapshotStore(self.config_path, os.path.join(self.config_path, "snapshots"))
     
     def _backup_file(self, filepath: str) -> Optional[str]:
-        """Faz backup de um arquivo antes de modificar"""
-        if not os.path.exists(filepath):
-            return None
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.basename(filepath)
-        backup_name = f"{filename}.{timestamp}.bak"
-        backup_filepath = os.path.join(self.backup_path, backup_name)
-        
-        try:
-            shutil.copy2(filepath, backup_filepath)
-            logger.info(f"Backup criado: {backup_filepath}")
-            return backup_filepath
-        except Exception as e:
-            logger.error(f"Erro ao criar backup: {e}")
-            return None
+        """Faz backup comprimido de um arquivo antes de modificar (retorna o id do backup)"""
+        return self.backups.backup(filepath)
     
-    async def reload_pjsip(self) -> bool:
-        """Recarrega configuração PJSIP no Asterisk"""
+    def _temp_file(self, filepath: str) -> Tuple[int, str]:
+        """Cria um temporário no mesmo diretório do arquivo (para rename atômico)"""
+        directory = os.path.dirname(filepath)
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix=".tmp")
+
+    def _install_file(self, filepath: str, tmp_path: str, sync_dir: bool = True):
+        """Substitui o arquivo pelo temporário já gravado e sincronizado (com backup do anterior).
+
+        O rename é atômico: um reload concorrente do Asterisk lê o arquivo
+        antigo ou o novo, nunca um arquivo pela metade. Com sync_dir=False o
+        fsync do diretório fica a cargo do chamador (gravações em lote).
+        """
+        self._backup_file(filepath)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+        if sync_dir:
+            _fsync_dir(os.path.dirname(filepath))
+
+    def _discard_temp(self, tmp_path: str):
         try:
-            result = subprocess.run(
-                ['/usr/sbin/asterisk', '-rx', 'pjsip reload'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if result.returncode == 0:
-                logger.info(f"PJSIP recarregado com sucesso")
-                return True
-            else:
-                logger.error(f"Erro ao recarregar PJSIP: {result.stderr}")
-                return False
-        except Exception as e:
-            logger.error(f"Erro ao executar comando Asterisk: {e}")
-            return False
-    
-    async def reload_dialplan(self) -> bool:
-        """Recarrega dialplan no Asterisk"""
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def _write_atomic(self, filepath: str, data: bytes, sync_dir: bool = True):
+        """Grava num temporário, sincroniza (fsync) e substitui o arquivo via rename"""
+        fd, tmp_path = self._temp_file(filepath)
         try:
-            result = subprocess.run(
-                ['/usr/sbin/asterisk', '-rx', 'dialplan reload'],
-                capture_output=True,
-                text=True,
-                timeout=30
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._install_file(filepath, tmp_path, sync_dir)
+        except BaseException:
+            self._discard_temp(tmp_path)
+            raise
+
+    def _write_config(
+        self, filepath: str, config: str, current_hash: Optional[str] = None, sync_dir: bool = True,
+    ) -> str:
+        """Grava um arquivo gerado com o hash do conteúdo no cabeçalho.
+
+        Se o hash coincide com o do arquivo em disco, não há backup nem
+        escrita e retorna CONFIG_UNCHANGED (o chamador não precisa recarregar).
+        current_hash evita reler o cabeçalho quando o hash em disco já é conhecido.
+        """
+        digest = content_hash(config)
+        if current_hash is None:
+            current_hash = read_config_hash(filepath)
+        if current_hash == digest:
+            logger.debug(f"{filepath} sem alterações (hash {digest[:12]})")
+            metrics.incr("asterisk.config.unchanged")
+            return CONFIG_UNCHANGED
+
+        hash_line = f"; Hash: {digest}\n"
+        data_line = re.search(r"^; Data: [^\n]*\n", config, re.MULTILINE)
+        if data_line:
+            config = config[:data_line.end()] + hash_line + config[data_line.end():]
+        else:
+            config = hash_line + config
+
+        self._write_atomic(filepath, config.encode(), sync_dir)
+        metrics.incr("asterisk.config.updated")
+        return CONFIG_UPDATED
+
+    def _stream_config(self, filepath: str, title: str, chunks: Iterable[str]) -> str:
+        """Grava um arquivo gerado bloco a bloco num temporário, sem montar o texto completo.
+
+        O hash é calculado durante a escrita; se coincidir com o do arquivo em
+        disco o temporário é descartado (sem fsync), senão é sincronizado e
+        substitui o arquivo via rename. Bloqueante: use _stream_config_async.
+        """
+        fd, tmp_path = self._temp_file(filepath)
+        try:
+            with os.fdopen(fd, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                writer = ConfigWriter(f)
+                writer.write_header(title)
+                writer.writelines(chunks)
+                digest = writer.finish()
+                f.flush()
+
+                unchanged = read_config_hash(filepath) == digest
+                if not unchanged:
+                    os.fsync(f.fileno())
+
+            if unchanged:
+                self._discard_temp(tmp_path)
+                logger.debug(f"{filepath} sem alterações (hash {digest[:12]})")
+                metrics.incr("asterisk.config.unchanged")
+                return CONFIG_UNCHANGED
+
+            self._install_file(filepath, tmp_path)
+        except BaseException:
+            self._discard_temp(tmp_path)
+            raise
+        metrics.incr("asterisk.config.updated")
+        return CONFIG_UPDATED
+
+    async def _stream_config_async(self, filepath: str, title: str, chunks: Iterable[str]) -> str:
+        """_stream_config numa thread: escrita, backup e fsync fora do event loop"""
+        return await asyncio.to_thread(self._stream_config, filepath, title, chunks)
+
+    # ==========================================
+    # FRAGMENTOS (um arquivo por objeto)
+    # ==========================================
+    def _fragment_dir(self, kind: str) -> str:
+        return os.path.join(self.fragments_path, kind)
+
+    def _fragment_filename(self, name: str) -> str:
+        """Nome do fragmento: nome saneado + hash curto do nome original.
+
+        O hash evita que nomes distintos que saneiam igual ("GW A" e "GW_A")
+        disputem o mesmo arquivo.
+        """
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        return f"{_UNSAFE_FILENAME.sub('_', name)}-{digest}.conf"
+
+    def _load_fragment_index(self, kind: str) -> Dict[str, str]:
+        """Sincroniza o índice de hashes com os fragmentos presentes em disco.
+
+        Apenas fragmentos ainda não conhecidos têm o cabeçalho lido.
+        """
+        directory = self._fragment_dir(kind)
+        os.makedirs(directory, exist_ok=True)
+        on_disk = {name for name in os.listdir(directory) if name.endswith(".conf")}
+
+        index = self._fragment_index.setdefault(kind, {})
+        for filename in list(index):
+            if filename not in on_disk:
+                del index[filename]
+        for filename in on_disk - index.keys():
+            index[filename] = read_config_hash(os.path.join(directory, filename)) or ""
+        return index
+
+    async def _save_fragments_async(
+        self, kind: str, stub_file: str, title: str, fragments: Iterable[Tuple[str, str]],
+    ) -> str:
+        """_save_fragments numa thread: escrita, backups e fsync fora do event loop"""
+        return await asyncio.to_thread(self._save_fragments, kind, stub_file, title, fragments)
+
+    def _save_fragments(self, kind: str, stub_file: str, title: str, fragments: Iterable[Tuple[str, str]]) -> str:
+        """Grava um fragmento por objeto e o arquivo-stub que os inclui.
+
+        fragments produz pares (nome, bloco); blocos vazios (objeto inativo)
+        são ignorados. Só os fragmentos cujo hash mudou são reescritos (com
+        backup); fragmentos de objetos que não existem mais são removidos
+        (varredura de órfãos). Cada diretório recebe um único fsync no fim
+        do lote, não um por fragmento.
+        """
+        with self._fragment_lock:
+            return self._save_fragments_locked(kind, stub_file, title, fragments)
+
+    def _save_fragments_locked(self, kind: str, stub_file: str, title: str, fragments: Iterable[Tuple[str, str]]) -> str:
+        directory = self._fragment_dir(kind)
+        index = self._load_fragment_index(kind)
+
+        include = os.path.relpath(directory, self.config_path)
+        stub = render_header(title) + f"#tryinclude {include}/*.conf\n"
+        changed = self._write_config(stub_file, stub, sync_dir=False) == CONFIG_UPDATED
+
+        written = 0
+        wanted = set()
+        for name, block in fragments:
+            if not block:
+                continue
+            filename = self._fragment_filename(name)
+            wanted.add(filename)
+            digest = content_hash(block)
+            if index.get(filename) == digest:
+                continue
+            self._write_config(
+                os.path.join(directory, filename), block, current_hash=index.get(filename), sync_dir=False,
             )
-            
-            if result.returncode == 0:
-                logger.info("Dialplan recarregado com sucesso")
-                return True
-            else:
-                logger.error(f"Erro ao recarregar dialplan: {result.stderr}")
-                return False
-        except Exception as e:
-            logger.error(f"Erro ao executar comando Asterisk: {e}")
-            return False
+            index[filename] = digest
+            written += 1
+
+        removed = self._sweep_fragments(kind, index, wanted)
+
+        if written or removed:
+            _fsync_dir(directory)
+        if changed:
+            _fsync_dir(os.path.dirname(stub_file))
+
+        if written or removed:
+            logger.info(f"Fragmentos {kind}: {written} gravados, {removed} removidos")
+        metrics.incr(f"asterisk.fragments.{kind}.written", written)
+        metrics.incr(f"asterisk.fragments.{kind}.removed", removed)
+        return CONFIG_UPDATED if changed or written or removed else CONFIG_UNCHANGED
+
+    def _sweep_fragments(self, kind: str, index: Dict[str, str], wanted: Set[str]) -> int:
+        """Remove (com backup) fragmentos de objetos que não existem mais"""
+        directory = self._fragment_dir(kind)
+        removed = 0
+        for filename in list(index.keys() - wanted):
+            filepath = os.path.join(directory, filename)
+            self._backup_file(filepath)
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            del index[filename]
+            removed += 1
+        return removed
+
+    async def reload_pjsip(self) -> bool:
+        """Recarrega configuração PJSIP no Asterisk (via AMI, com reloads concorrentes agrupados)"""
+        return await reloader.reload("pjsip")
+
+    async def reload_dialplan(self) -> bool:
+        """Recarrega dialplan no Asterisk (via AMI, com reloads concorrentes agrupados)"""
+        return await reloader.reload("dialplan")
+
+    # ==========================================
+    # BACKUPS
+    # ==========================================
+    def _restore_file(self, key: str, backup_id: str) -> str:
+        """Grava o conteúdo do backup sobre o arquivo (bloqueante, usar em thread)"""
+        filepath = self.backups.path_for(key)
+        content = self.backups.read(key, backup_id)
+        self._write_atomic(filepath, content)
+
+        # Mantém o índice de fragmentos coerente com o arquivo restaurado
+        kind = os.path.basename(os.path.dirname(filepath))
+        with self._fragment_lock:
+            index = self._fragment_index.get(kind)
+            if index is not None and os.path.dirname(filepath) == self._fragment_dir(kind):
+                index[os.path.basename(filepath)] = read_config_hash(filepath) or ""
+        return filepath
+
+    async def restore_backup(self, key: str, backup_id: str) -> str:
+        """Restaura um backup sobre o arquivo atual e recarrega o módulo correspondente.
+
+        O arquivo atual também ganha um backup antes de ser substituído.
+        Levanta BackupError se a chave ou o backup não existem. Chamar via
+        provisioning_queue.restore_backup, que não concorre com as aplicações.
+        """
+        filepath = await asyncio.to_thread(self._restore_file, key, backup_id)
+        logger.info(f"Backup {backup_id} restaurado em {filepath}")
+
+        if os.path.basename(filepath).startswith("extensions"):
+            success = await self.reload_dialplan()
+        else:
+            success = await self.reload_pjsip()
+        return CONFIG_UPDATED if success else CONFIG_ERROR
+
+    # ==========================================
+    # SNAPSHOTS
+    # ==========================================
+    def _managed_files(self) -> List[str]:
+        return [
+            self.providers_file,
+            self.gateways_file,
+            self.customer_trunks_file,
+            self.extensions_pjsip_file,
+            self.routes_file,
+            self.dids_file,
+        ]
+
+    def _managed_directories(self) -> List[str]:
+        return [self._fragment_dir(kind) for kind in FRAGMENT_KINDS]
+
+    def record_snapshot(self, reason: str) -> Dict[str, Any]:
+        """Registra um snapshot de todos os arquivos gerenciados (bloqueante, usar em thread)"""
+        return self.snapshots.record(self._managed_files(), self._managed_directories(), reason)
+
+    def _apply_snapshot(self, snapshot_id: int) -> List[str]:
+        """Grava os arquivos do snapshot que diferem do disco e remove fragmentos que ele não tem"""
+        target = self.snapshots.files(snapshot_id)
+        changed = []
+        for rel, digest in target.items():
+            filepath = os.path.join(self.config_path, rel)
+            if self.snapshots.file_hash(filepath) != digest:
+                self._write_atomic(filepath, self.snapshots.get_object(digest))
+                changed.append(rel)
+
+        for rel_dir in self.snapshots.directories(snapshot_id):
+            directory = os.path.join(self.config_path, rel_dir)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(".conf") and rel_dir + name not in target:
+                    filepath = os.path.join(directory, name)
+                    self._backup_file(filepath)
+                    os.remove(filepath)
+                    changed.append(rel_dir + name)
+
+        # Os hashes de fragmentos são relidos do disco na próxima sincronização
+        with self._fragment_lock:
+            self._fragment_index.clear()
+        return changed
+
+    async def rollback_snapshot(self, snapshot_id: int) -> Dict[str, Any]:
+        """Volta todos os arquivos gerenciados ao estado de um snapshot e recarrega uma vez.
+
+        Apenas arquivos que diferem do snapshot são reescritos (rename atômico,
+        com backup); o Asterisk só é recarregado depois que todos estão no lugar.
+        A próxima sincronização de um domínio volta a gerar seus arquivos do banco.
+        Levanta SnapshotError se o snapshot não existe.
+        """
+        start = time.perf_counter()
+        changed = await asyncio.to_thread(self._apply_snapshot, snapshot_id)
+
+        modules = {
+            "dialplan" if os.path.basename(rel).startswith("extensions") else "pjsip"
+            for rel in changed
+        }
+        success = True
+        for module in sorted(modules):
+            success = await reloader.reload(module) and success
+
+        entry = await asyncio.to_thread(self.record_snapshot, f"rollback:{snapshot_id}")
+        metrics.observe("asterisk.snapshot.rollback_duration", time.perf_counter() - start)
+        logger.info(f"Rollback para o snapshot {snapshot_id}: {len(changed)} arquivos alterados")
+        return {
+            "result": CONFIG_ERROR if not success else (CONFIG_UPDATED if changed else CONFIG_UNCHANGED),
+            "changed_files": len(changed),
+            "reloaded": sorted(modules),
+            "snapshot": entry,
+        }
 
     # ==========================================
     # GATEWAYS
     # ==========================================
-    async def generate_gateways_config(self, gateways: List[Dict[str, Any]]) -> str:
-        """Gera configuração PJSIP para todos os gateways"""
-        
-        config = "; =============================================\n"
-        config += "; GATEWAYS - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
+    def _render_gateway(self, gateway: Dict[str, Any]) -> str:
+        """Bloco PJSIP de um gateway (vazio se inativo ou sem IP)"""
+        if gateway.get('status') != 'active':
+            return ""
+
+        if not gateway.get('ip_address'):
+            return ""
+
+        name = gateway['name']
+        return render_trunk(
+            comment=f"Gateway: {name}",
+            name=name,
+            ip=gateway['ip_address'],
+            port=gateway.get('port', 5060),
+            codecs=gateway.get('codecs', 'alaw,ulaw'),
+            context=gateway.get('context', 'from-trunk'),
+            auth_type=gateway.get('auth_type', 'ip'),
+            username=gateway.get('username'),
+            password=gateway.get('password'),
+        )
+
+    def iter_gateways_config(self, gateways: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, a configuração PJSIP dos gateways (sem cabeçalho)"""
         for gateway in gateways:
-            if gateway.get('status') != 'active':
-                continue
-            
-            if not gateway.get('ip_address'):
-                continue
-                
-            name = gateway['name']
-            ip = gateway['ip_address']
-            port = gateway.get('port', 5060)
-            codecs = gateway.get('codecs', 'alaw,ulaw')
-            context = gateway.get('context', 'from-trunk')
-            auth_type = gateway.get('auth_type', 'ip')
-            username = gateway.get('username')
-            password = gateway.get('password')
-            
-            config += f"; === Gateway: {name} ===\n"
-            config += f"[{name}]\n"
-            config += f"type=endpoint\n"
-            config += f"context={context}\n"
-            config += f"disallow=all\n"
-            config += f"allow={codecs}\n"
-            config += f"aors={name}\n"
-            
-            if auth_type in ['credentials', 'both'] and username:
-                config += f"auth={name}\n"
-            
-            config += f"\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=aor\n"
-            config += f"contact=sip:{ip}:{port}\n\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=identify\n"
-            config += f"endpoint={name}\n"
-            config += f"match={ip}\n\n"
-            
-            if auth_type in ['credentials', 'both'] and username and password:
-                config += f"[{name}]\n"
-                config += f"type=auth\n"
-                config += f"auth_type=userpass\n"
-                config += f"username={username}\n"
-                config += f"password={password}\n\n"
-        
-        return config
-    
-    async def save_gateways_config(self, gateways: List[Dict[str, Any]]) -> bool:
-        """Salva configuração de gateways no arquivo"""
+            yield self._render_gateway(gateway)
+
+    async def generate_gateways_config(self, gateways: Iterable[Dict[str, Any]]) -> str:
+        """Gera configuração PJSIP para todos os gateways (arquivo único)"""
+        return render_header("GATEWAYS") + "".join(self.iter_gateways_config(gateways))
+
+    async def save_gateways_config(self, gateways: Iterable[Dict[str, Any]]) -> str:
+        """Salva configuração de gateways (um fragmento por gateway)"""
         try:
-            self._backup_file(self.gateways_file)
-            config = await self.generate_gateways_config(gateways)
-            
-            with open(self.gateways_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Configuração de gateways salva em {self.gateways_file}")
-            return True
+            fragments = (
+                (gateway['name'], self._render_gateway(gateway))
+                for gateway in gateways
+            )
+            result = await self._save_fragments_async("gateways", self.gateways_file, "GATEWAYS", fragments)
+            if result == CONFIG_UPDATED:
+                logger.info(f"Configuração de gateways salva em {self._fragment_dir('gateways')}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar configuração de gateways: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # CUSTOMER TRUNKS
     # ==========================================
-    async def generate_customer_trunks_config(self, customers: List[Dict[str, Any]]) -> str:
-        """Gera configuração PJSIP para clientes trunk"""
-        
-        config = "; =============================================\n"
-        config += "; CLIENTES TRUNK - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
+    def _render_customer_trunk(self, customer: Dict[str, Any]) -> str:
+        """Bloco PJSIP de um cliente trunk (vazio se inativo ou sem IP)"""
+        if customer.get('type') != 'trunk' or customer.get('status') != 'active':
+            return ""
+
+        if not customer.get('trunk_ip'):
+            return ""
+
+        return render_trunk(
+            comment=f"Cliente: {customer['name']} ({customer['code']})",
+            name=f"CLI_{customer['code']}",
+            ip=customer['trunk_ip'],
+            port=customer.get('trunk_port', 5060),
+            codecs=customer.get('trunk_codecs', 'alaw,ulaw'),
+            context=customer.get('trunk_context', 'from-trunk'),
+            auth_type=customer.get('trunk_auth_type', 'ip'),
+            username=customer.get('trunk_username'),
+            password=customer.get('trunk_password'),
+        )
+
+    def iter_customer_trunks_config(self, customers: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, a configuração PJSIP dos clientes trunk (sem cabeçalho)"""
         for customer in customers:
-            if customer.get('type') != 'trunk' or customer.get('status') != 'active':
-                continue
-            
-            if not customer.get('trunk_ip'):
-                continue
-            
-            name = f"CLI_{customer['code']}"
-            ip = customer['trunk_ip']
-            port = customer.get('trunk_port', 5060)
-            codecs = customer.get('trunk_codecs', 'alaw,ulaw')
-            auth_type = customer.get('trunk_auth_type', 'ip')
-            username = customer.get('trunk_username')
-            password = customer.get('trunk_password')
-            context = customer.get('trunk_context', 'from-trunk')
-            
-            config += f"; === Cliente: {customer['name']} ({customer['code']}) ===\n"
-            config += f"[{name}]\n"
-            config += f"type=endpoint\n"
-            config += f"context={context}\n"
-            config += f"disallow=all\n"
-            config += f"allow={codecs}\n"
-            config += f"aors={name}\n"
-            
-            if auth_type in ['credentials', 'both'] and username:
-                config += f"auth={name}\n"
-            
-            config += f"\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=aor\n"
-            config += f"contact=sip:{ip}:{port}\n\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=identify\n"
-            config += f"endpoint={name}\n"
-            config += f"match={ip}\n\n"
-            
-            if auth_type in ['credentials', 'both'] and username and password:
-                config += f"[{name}]\n"
-                config += f"type=auth\n"
-                config += f"auth_type=userpass\n"
-                config += f"username={username}\n"
-                config += f"password={password}\n\n"
-        
-        return config
-    
-    async def save_customer_trunks_config(self, customers: List[Dict[str, Any]]) -> bool:
-        """Salva configuração de clientes trunk no arquivo"""
+            yield self._render_customer_trunk(customer)
+
+    async def generate_customer_trunks_config(self, customers: Iterable[Dict[str, Any]]) -> str:
+        return render_header("CLIENTES TRUNK") + "".join(self.iter_customer_trunks_config(customers))
+
+    async def save_customer_trunks_config(self, customers: Iterable[Dict[str, Any]]) -> str:
+        """Salva configuração de clientes trunk (um fragmento por cliente)"""
         try:
-            self._backup_file(self.customer_trunks_file)
-            config = await self.generate_customer_trunks_config(customers)
-            
-            with open(self.customer_trunks_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Configuração de clientes trunk salva em {self.customer_trunks_file}")
-            return True
+            fragments = (
+                (f"CLI_{customer['code']}", self._render_customer_trunk(customer))
+                for customer in customers
+            )
+            result = await self._save_fragments_async("trunks", self.customer_trunks_file, "CLIENTES TRUNK", fragments)
+            if result == CONFIG_UPDATED:
+                logger.info(f"Configuração de clientes trunk salva em {self._fragment_dir('trunks')}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar configuração de clientes trunk: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # PROVIDERS (legado, não usado atualmente)
     # ==========================================
-    async def generate_providers_config(self, providers: List[Dict[str, Any]]) -> str:
-        """Gera configuração PJSIP para todos os provedores"""
-        
-        config = "; =============================================\n"
-        config += "; PROVEDORES - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
+    def iter_providers_config(self, providers: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, a configuração PJSIP dos provedores (sem cabeçalho)"""
         for provider in providers:
             if provider.get('status') != 'active':
                 continue
-            
+
             if not provider.get('ip_address'):
                 continue
-                
-            name = provider['name']
-            ip = provider['ip_address']
-            port = provider.get('port', 5060)
-            codecs = provider.get('codecs', 'alaw,ulaw')
-            auth_type = provider.get('auth_type', 'ip')
-            username = provider.get('username')
-            password = provider.get('password')
-            
-            config += f"; === {name} ===\n"
-            config += f"[{name}]\n"
-            config += f"type=endpoint\n"
-            config += f"context=from-trunk\n"
-            config += f"disallow=all\n"
-            config += f"allow={codecs}\n"
-            config += f"aors={name}\n"
-            
-            if auth_type in ['credentials', 'both'] and username:
-                config += f"auth={name}\n"
-            
-            config += f"\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=aor\n"
-            config += f"contact=sip:{ip}:{port}\n\n"
-            
-            config += f"[{name}]\n"
-            config += f"type=identify\n"
-            config += f"endpoint={name}\n"
-            config += f"match={ip}\n\n"
-            
-            if auth_type in ['credentials', 'both'] and username and password:
-                config += f"[{name}]\n"
-                config += f"type=auth\n"
-                config += f"auth_type=userpass\n"
-                config += f"username={username}\n"
-                config += f"password={password}\n\n"
-        
-        return config
-    
-    async def save_providers_config(self, providers: List[Dict[str, Any]]) -> bool:
+
+            yield render_trunk(
+                comment=provider['name'],
+                name=provider['name'],
+                ip=provider['ip_address'],
+                port=provider.get('port', 5060),
+                codecs=provider.get('codecs', 'alaw,ulaw'),
+                context='from-trunk',
+                auth_type=provider.get('auth_type', 'ip'),
+                username=provider.get('username'),
+                password=provider.get('password'),
+            )
+
+    async def generate_providers_config(self, providers: Iterable[Dict[str, Any]]) -> str:
+        """Gera configuração PJSIP para todos os provedores"""
+        return render_header("PROVEDORES") + "".join(self.iter_providers_config(providers))
+
+    async def save_providers_config(self, providers: Iterable[Dict[str, Any]]) -> str:
         """Salva configuração de provedores no arquivo"""
         try:
-            self._backup_file(self.providers_file)
-            config = await self.generate_providers_config(providers)
-            
-            with open(self.providers_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Configuração de provedores salva em {self.providers_file}")
-            return True
+            result = await self._stream_config_async(self.providers_file, "PROVEDORES", self.iter_providers_config(providers))
+            if result == CONFIG_UPDATED:
+                logger.info(f"Configuração de provedores salva em {self.providers_file}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar configuração de provedores: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # EXTENSIONS (RAMAIS)
     # ==========================================
-    async def generate_extensions_pjsip_config(self, extensions: List[Dict[str, Any]]) -> str:
-        """Gera configuração PJSIP para ramais"""
-        
-        config = "; =============================================\n"
-        config += "; RAMAIS - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
+    def _render_extension(self, ext: Dict[str, Any]) -> str:
+        """Bloco PJSIP de um ramal (vazio se inativo)"""
+        if ext.get('status') != 'active':
+            return ""
+
+        exten = ext['extension']
+        name = ext.get('name') or exten
+        customer_name = ext.get('customer_name')
+        nat = 'yes' if ext.get('nat_enabled') else None
+
+        if customer_name:
+            comment = f"; === Ramal: {exten} - {name} ({customer_name}) ===\n"
+        else:
+            comment = f"; === Ramal: {exten} - {name} ===\n"
+        endpoint = render_section(exten, (
+            ("type", "endpoint"),
+            ("context", ext.get('context') or 'from-internal'),
+            ("disallow", "all"),
+            ("allow", ext.get('codecs') or 'alaw,ulaw'),
+            ("auth", exten),
+            ("aors", exten),
+            ("callerid", ext.get('callerid') or None),
+            ("direct_media", 'no' if nat else None),
+            ("rtp_symmetric", nat),
+            ("force_rport", nat),
+            ("rewrite_contact", nat),
+        ))
+        # Seções de formato fixo montadas direto, sem passar por render_section
+        return (
+            f"{comment}{endpoint}"
+            f"[{exten}]\ntype=auth\nauth_type=userpass\nusername={exten}\npassword={ext.get('secret') or ''}\n\n"
+            f"[{exten}]\ntype=aor\nmax_contacts={ext.get('max_contacts') or 1}\n\n"
+        )
+
+    def iter_extensions_pjsip_config(self, extensions: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, a configuração PJSIP dos ramais (sem cabeçalho)"""
         for ext in extensions:
-            if ext.get('status') != 'active':
-                continue
-            
-            exten = ext['extension']
-            name = ext.get('name', exten)
-            secret = ext.get('secret', '')
-            context = ext.get('context', 'from-internal')
-            codecs = ext.get('codecs', 'alaw,ulaw')
-            max_contacts = ext.get('max_contacts', 1)
-            callerid = ext.get('callerid', f'"{name}" <{exten}>')
-            
-            config += f"; === Ramal: {exten} - {name} ===\n"
-            config += f"[{exten}]\n"
-            config += f"type=endpoint\n"
-            config += f"context={context}\n"
-            config += f"disallow=all\n"
-            config += f"allow={codecs}\n"
-            config += f"auth={exten}\n"
-            config += f"aors={exten}\n"
-            config += f"callerid={callerid}\n"
-            config += f"\n"
-            
-            config += f"[{exten}]\n"
-            config += f"type=auth\n"
-            config += f"auth_type=userpass\n"
-            config += f"username={exten}\n"
-            config += f"password={secret}\n\n"
-            
-            config += f"[{exten}]\n"
-            config += f"type=aor\n"
-            config += f"max_contacts={max_contacts}\n\n"
-        
-        return config
-    
-    async def save_extensions_pjsip_config(self, extensions: List[Dict[str, Any]]) -> bool:
-        """Salva configuração PJSIP de ramais no arquivo"""
-        extensions_pjsip_file = os.path.join(self.config_path, "pjsip_extensions.conf")
+            yield self._render_extension(ext)
+
+    async def generate_extensions_pjsip_config(self, extensions: Iterable[Dict[str, Any]]) -> str:
+        """Gera configuração PJSIP para ramais (arquivo único)"""
+        return render_header("RAMAIS") + "".join(self.iter_extensions_pjsip_config(extensions))
+
+    async def save_extensions_pjsip_config(self, extensions: Iterable[Dict[str, Any]]) -> str:
+        """Salva configuração PJSIP de ramais (um fragmento por ramal)"""
         try:
-            self._backup_file(extensions_pjsip_file)
-            config = await self.generate_extensions_pjsip_config(extensions)
-            
-            with open(extensions_pjsip_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Configuração PJSIP de ramais salva em {extensions_pjsip_file}")
-            return True
+            fragments = (
+                (ext['extension'], self._render_extension(ext))
+                for ext in extensions
+            )
+            result = await self._save_fragments_async("extensions", self.extensions_pjsip_file, "RAMAIS", fragments)
+            if result == CONFIG_UPDATED:
+                logger.info(f"Configuração PJSIP de ramais salva em {self._fragment_dir('extensions')}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar configuração de ramais: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # ROUTES (DIALPLAN SAÍDA)
     # ==========================================
-    async def generate_outbound_routes_config(self, routes: List[Dict[str, Any]], gateways: List[Dict[str, Any]]) -> str:
-        """Gera dialplan para rotas de saída"""
-        
-        config = "; =============================================\n"
-        config += "; ROTAS DE SAIDA - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
-        config += "[from-internal]\n"
-        config += "; Rotas de saída\n\n"
-        
+    def iter_outbound_routes_config(self, routes: Iterable[Dict[str, Any]], gateways: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, o dialplan de rotas de saída (sem cabeçalho)"""
+        gateways_by_id = {str(gw.get('id')): gw for gw in gateways}
+
+        yield "[from-internal]\n"
+        yield "; Rotas de saída\n\n"
+
         # Ordena por prioridade
-        sorted_routes = sorted(routes, key=lambda x: x.get('priority', 99))
-        
-        for route in sorted_routes:
+        for route in sorted(routes, key=lambda x: x.get('priority', 99)):
             if route.get('status') != 'active':
                 continue
-            
+
             pattern = route.get('pattern', '_X.')
-            gateway_id = route.get('gateway_id')
             route_name = route.get('name', 'Rota')
-            
-            # Encontra o gateway
-            gateway = None
-            for gw in gateways:
-                if str(gw.get('id')) == str(gateway_id):
-                    gateway = gw
-                    break
-            
+
+            gateway = gateways_by_id.get(str(route.get('gateway_id')))
             if not gateway:
                 continue
-            
+
             gateway_name = gateway.get('name')
-            tech_prefix = gateway.get('tech_prefix', '')
-            
-            config += f"; {route_name}\n"
-            if tech_prefix:
-                config += f"exten => {pattern},1,NoOp(Rota: {route_name})\n"
-                config += f" same => n,Dial(PJSIP/{tech_prefix}${{EXTEN}}@{gateway_name},60,tT)\n"
-            else:
-                config += f"exten => {pattern},1,NoOp(Rota: {route_name})\n"
-                config += f" same => n,Dial(PJSIP/${{EXTEN}}@{gateway_name},60,tT)\n"
-            config += f" same => n,Hangup()\n\n"
-        
-        return config
-    
-    async def save_outbound_routes_config(self, routes: List[Dict[str, Any]], gateways: List[Dict[str, Any]]) -> bool:
+            tech_prefix = gateway.get('tech_prefix') or ''
+
+            yield (
+                f"; {route_name}\n"
+                f"exten => {pattern},1,NoOp(Rota: {route_name})\n"
+                f" same => n,Dial(PJSIP/{tech_prefix}${{EXTEN}}@{gateway_name},60,tT)\n"
+                f" same => n,Hangup()\n\n"
+            )
+
+    async def generate_outbound_routes_config(self, routes: Iterable[Dict[str, Any]], gateways: Iterable[Dict[str, Any]]) -> str:
+        """Gera dialplan para rotas de saída"""
+        return render_header("ROTAS DE SAIDA") + "".join(self.iter_outbound_routes_config(routes, gateways))
+
+    async def save_outbound_routes_config(self, routes: Iterable[Dict[str, Any]], gateways: Iterable[Dict[str, Any]]) -> str:
         """Salva dialplan de rotas de saída"""
-        routes_file = os.path.join(self.config_path, "extensions_routes.conf")
+        routes_file = self.routes_file
         try:
-            self._backup_file(routes_file)
-            config = await self.generate_outbound_routes_config(routes, gateways)
-            
-            with open(routes_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Dialplan de rotas salvo em {routes_file}")
-            return True
+            result = await self._stream_config_async(routes_file, "ROTAS DE SAIDA", self.iter_outbound_routes_config(routes, gateways))
+            if result == CONFIG_UPDATED:
+                logger.info(f"Dialplan de rotas salvo em {routes_file}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar dialplan de rotas: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # DIDS (DIALPLAN ENTRADA)
     # ==========================================
-    async def generate_inbound_dids_config(self, dids: List[Dict[str, Any]], customers: List[Dict[str, Any]]) -> str:
-        """Gera dialplan para DIDs de entrada"""
-        
-        config = "; =============================================\n"
-        config += "; DIDS ENTRADA - Gerado automaticamente pelo Painel\n"
-        config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
-        config += "; =============================================\n\n"
-        
-        config += "[from-trunk]\n"
-        config += "; Roteamento de DIDs\n\n"
-        
+    def iter_inbound_dids_config(self, dids: Iterable[Dict[str, Any]], customers: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Gera, bloco a bloco, o dialplan de DIDs de entrada (sem cabeçalho)"""
+        customers_by_id = {str(c.get('id')): c for c in customers}
+
+        yield "[from-trunk]\n"
+        yield "; Roteamento de DIDs\n\n"
+
         for did in dids:
             if did.get('status') != 'allocated':
                 continue
-            
+
             number = did.get('number', '')
             customer_id = did.get('customer_id')
             destination = did.get('destination')
-            destination_type = did.get('destination_type', 'extension')
-            
+
             if not customer_id:
                 continue
-            
-            # Encontra o cliente
-            customer = None
-            for c in customers:
-                if str(c.get('id')) == str(customer_id):
-                    customer = c
-                    break
-            
+
+            customer = customers_by_id.get(str(customer_id))
             if not customer:
                 continue
-            
+
             customer_name = customer.get('name', '')
             customer_type = customer.get('type', 'extension')
-            
-            config += f"; DID {number} -> {customer_name}\n"
-            
+
             if customer_type == 'trunk':
-                # Cliente trunk - encaminha para o IP do cliente
-                trunk_ip = customer.get('trunk_ip')
-                trunk_port = customer.get('trunk_port', 5060)
+                # Cliente trunk - encaminha para o destino específico ou mantém o número original
                 trunk_name = f"CLI_{customer.get('code')}"
-                
-                if destination:
-                    # Encaminha para destino específico
-                    config += f"exten => {number},1,NoOp(DID {number} -> Cliente Trunk {customer_name})\n"
-                    config += f" same => n,Dial(PJSIP/{destination}@{trunk_name},60,tT)\n"
-                else:
-                    # Encaminha mantendo o número original
-                    config += f"exten => {number},1,NoOp(DID {number} -> Cliente Trunk {customer_name})\n"
-                    config += f" same => n,Dial(PJSIP/${{EXTEN}}@{trunk_name},60,tT)\n"
-            else:
+                target = destination or "${EXTEN}"
+                body = (
+                    f"exten => {number},1,NoOp(DID {number} -> Cliente Trunk {customer_name})\n"
+                    f" same => n,Dial(PJSIP/{target}@{trunk_name},60,tT)\n"
+                )
+            elif destination:
                 # Cliente ramal - encaminha para ramal interno
-                if destination:
-                    config += f"exten => {number},1,NoOp(DID {number} -> Ramal {destination})\n"
-                    config += f" same => n,Dial(PJSIP/{destination},60,tT)\n"
-                else:
-                    config += f"exten => {number},1,NoOp(DID {number} -> Cliente {customer_name})\n"
-                    config += f" same => n,Playback(invalid)\n"
-            
-            config += f" same => n,Hangup()\n\n"
-        
+                body = (
+                    f"exten => {number},1,NoOp(DID {number} -> Ramal {destination})\n"
+                    f" same => n,Dial(PJSIP/{destination},60,tT)\n"
+                )
+            else:
+                body = (
+                    f"exten => {number},1,NoOp(DID {number} -> Cliente {customer_name})\n"
+                    f" same => n,Playback(invalid)\n"
+                )
+
+            yield f"; DID {number} -> {customer_name}\n{body} same => n,Hangup()\n\n"
+
         # Fallback para DIDs não configurados
-        config += "; Fallback\n"
-        config += "exten => _X.,1,NoOp(DID nao configurado: ${EXTEN})\n"
-        config += " same => n,Playback(invalid)\n"
-        config += " same => n,Hangup()\n"
-        
-        return config
-    
-    async def save_inbound_dids_config(self, dids: List[Dict[str, Any]], customers: List[Dict[str, Any]]) -> bool:
+        yield (
+            "; Fallback\n"
+            "exten => _X.,1,NoOp(DID nao configurado: ${EXTEN})\n"
+            " same => n,Playback(invalid)\n"
+            " same => n,Hangup()\n"
+        )
+
+    async def generate_inbound_dids_config(self, dids: Iterable[Dict[str, Any]], customers: Iterable[Dict[str, Any]]) -> str:
+        """Gera dialplan para DIDs de entrada"""
+        return render_header("DIDS ENTRADA") + "".join(self.iter_inbound_dids_config(dids, customers))
+
+    async def save_inbound_dids_config(self, dids: Iterable[Dict[str, Any]], customers: Iterable[Dict[str, Any]]) -> str:
         """Salva dialplan de DIDs de entrada"""
-        dids_file = os.path.join(self.config_path, "extensions_dids.conf")
+        dids_file = self.dids_file
         try:
-            self._backup_file(dids_file)
-            config = await self.generate_inbound_dids_config(dids, customers)
-            
-            with open(dids_file, 'w') as f:
-                f.write(config)
-            
-            logger.info(f"Dialplan de DIDs salvo em {dids_file}")
-            return True
+            result = await self._stream_config_async(dids_file, "DIDS ENTRADA", self.iter_inbound_dids_config(dids, customers))
+            if result == CONFIG_UPDATED:
+                logger.info(f"Dialplan de DIDs salvo em {dids_file}")
+            return result
         except Exception as e:
             logger.error(f"Erro ao salvar dialplan de DIDs: {e}")
-            return False
+            return CONFIG_ERROR
 
     # ==========================================
     # CONFERENCE
@@ -629,35 +819,20 @@ Setvar: CONFID={conference_id}
     # CHANNELS
     # ==========================================
     async def get_active_channels(self) -> List[Dict[str, Any]]:
-        """Obtém canais ativos no Asterisk"""
-        try:
-            result = subprocess.run(
-                ['/usr/sbin/asterisk', '-rx', 'core show channels concise'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            channels = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split('!')
-                    if len(parts) >= 7:
-                        channels.append({
-                            'channel': parts[0],
-                            'context': parts[1],
-                            'extension': parts[2],
-                            'priority': parts[3],
-                            'state': parts[4],
-                            'application': parts[5],
-                            'data': parts[6] if len(parts) > 6 else ''
-                        })
-            
-            return channels
-            
-        except Exception as e:
-            logger.error(f"Erro ao obter canais ativos: {e}")
-            return []
+        """Obtém canais ativos no Asterisk (tabela mantida por eventos AMI)"""
+        return [
+            {
+                'channel': ch.channel,
+                'context': ch.context,
+                'extension': ch.extension,
+                'priority': ch.priority,
+                'state': ch.state,
+                'application': ch.application,
+                'data': ch.data,
+                'duration': ch.duration,
+            }
+            for ch in channel_table.list()
+        ]
     
     async def get_pjsip_endpoints(self) -> List[Dict[str, Any]]:
         """Obtém endpoints PJSIP"""
@@ -1,80 +1,50 @@
-import os
+from typing import Any, Dict, Iterator
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.extension import Extension
 from app.models.customer import Customer
+from app.services.asterisk import CONFIG_ERROR, CONFIG_UPDATED, asterisk_service
 
-PJSIP_EXTENSIONS_PATH = "/etc/asterisk/pjsip_extensions.conf"
 
-async def generate_pjsip_extensions(db: AsyncSession) -> str:
-    """Gera o arquivo pjsip_extensions.conf baseado no banco de dados"""
-    
+async def load_pjsip_extensions(db: AsyncSession) -> Iterator[Dict[str, Any]]:
+    """Carrega os ramais ativos de clientes ativos para geração do pjsip_extensions.conf.
+
+    Os dicts são montados sob demanda, à medida que o gerador é consumido.
+    """
     query = select(Extension, Customer).join(Customer).where(
         Extension.status == 'active',
         Customer.status == 'active'
     )
     result = await db.execute(query)
-    results = result.all()
-    
-    lines = [
-        "; =============================================",
-        "; PJSIP Extensions - Gerado automaticamente",
-        "; NÃO EDITE MANUALMENTE - Use o painel web",
-        "; =============================================",
-        ""
-    ]
-    
-    for ext, customer in results:
-        lines.append(f"; === Ramal: {ext.extension} - {ext.name} ({customer.name}) ===")
-        lines.append(f"[{ext.extension}]")
-        lines.append("type=endpoint")
-        lines.append(f"context={ext.context or 'from-internal'}")
-        lines.append("disallow=all")
-        lines.append(f"allow={ext.codecs or 'alaw,ulaw'}")
-        lines.append(f"auth={ext.extension}")
-        lines.append(f"aors={ext.extension}")
-        
-        if ext.callerid:
-            lines.append(f"callerid={ext.callerid}")
-        
-        if ext.nat_enabled:
-            lines.append("direct_media=no")
-            lines.append("rtp_symmetric=yes")
-            lines.append("force_rport=yes")
-            lines.append("rewrite_contact=yes")
-        
-        lines.append("")
-        lines.append(f"[{ext.extension}]")
-        lines.append("type=auth")
-        lines.append("auth_type=userpass")
-        lines.append(f"username={ext.extension}")
-        lines.append(f"password={ext.secret}")
-        lines.append("")
-        lines.append(f"[{ext.extension}]")
-        lines.append("type=aor")
-        lines.append(f"max_contacts={ext.max_contacts or 1}")
-        lines.append("")
-    
-    return "\n".join(lines)
+
+    return (
+        {
+            "extension": ext.extension,
+            "name": ext.name,
+            "secret": ext.secret,
+            "context": ext.context,
+            "codecs": ext.codecs,
+            "callerid": ext.callerid,
+            "max_contacts": ext.max_contacts,
+            "nat_enabled": ext.nat_enabled,
+            "customer_name": customer.name,
+            "status": ext.status,
+        }
+        for ext, customer in result
+    )
+
+
+async def generate_pjsip_extensions(db: AsyncSession) -> str:
+    """Gera o arquivo pjsip_extensions.conf baseado no banco de dados"""
+    extensions = await load_pjsip_extensions(db)
+    return await asterisk_service.generate_extensions_pjsip_config(extensions)
 
 
-async def write_pjsip_extensions_async(db: AsyncSession) -> bool:
-    """Escreve o arquivo e recarrega o Asterisk"""
-    try:
-        config = await generate_pjsip_extensions(db)
-        
-        if os.path.exists(PJSIP_EXTENSIONS_PATH):
-            backup_path = f"{PJSIP_EXTENSIONS_PATH}.bak"
-            with open(PJSIP_EXTENSIONS_PATH, 'r') as f:
-                with open(backup_path, 'w') as fb:
-                    fb.write(f.read())
-        
-        with open(PJSIP_EXTENSIONS_PATH, 'w') as f:
-            f.write(config)
-        
-        os.system('asterisk -rx "pjsip reload" > /dev/null 2>&1')
-        
-        return True
-    except Exception as e:
-        print(f"Erro ao gerar pjsip_extensions.conf: {e}")
-        return False
+async def write_pjsip_extensions_async(db: AsyncSession) -> str:
+    """Escreve o arquivo e recarrega o Asterisk (apenas se o conteúdo mudou)"""
+    # Dicts montados ainda na sessão: a gravação roda numa thread
+    extensions = list(await load_pjsip_extensions(db))
+    result = await asterisk_service.save_extensions_pjsip_config(extensions)
+    if result == CONFIG_UPDATED and not await asterisk_service.reload_pjsip():
+        return CONFIG_ERROR
+    return result
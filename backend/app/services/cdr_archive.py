@@ -0,0 +1,517 @@
+import asyncio
+import bisect
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import select
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.core.metrics import metrics
+from app.models import CDR
+from app.services.cdr_search import resolve_mode
+from app.services.rating import from_micro, to_micro
+
+# Tipos das colunas no arquivo; as demais (texto e UUIDs) são codificadas por dicionário
+TIMESTAMP_COLUMNS = ("calldate", "start_time", "answer_time", "end_time", "created_at")
+INTEGER_COLUMNS = ("duration", "billsec", "amaflags", "sequence")
+MONEY_COLUMNS = ("cost", "price")
+BOOLEAN_COLUMNS = ("recorded",)
+DICTIONARY_COLUMNS = tuple(
+    c.name for c in CDR.__table__.columns
+    if c.name not in TIMESTAMP_COLUMNS + INTEGER_COLUMNS + MONEY_COLUMNS + BOOLEAN_COLUMNS + ("id",)
+)
+
+# Linha devolvida pelas consultas ao arquivo (atributos usados por relatórios e export)
+ArchivedCDR = namedtuple("ArchivedCDR", (
+    "id", "call_id", "calldate", "clid", "src", "dst", "callerid", "call_type",
+    "duration", "billsec", "disposition", "cost", "price",
+))
+
+_MANIFEST = "manifest.json"
+_OPEN_MONTHS = 3
+
+
+def _next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _month_name(month: date) -> str:
+    return f"cdr_{month:%Y_%m}"
+
+
+def _datetime64(value: Optional[datetime]) -> np.datetime64:
+    return np.datetime64(value, "us") if value is not None else np.datetime64("NaT", "us")
+
+
+def _uuid_halves(value: uuid.UUID) -> Tuple[int, int]:
+    """UUID como dois inteiros big-endian: a ordem dos pares é a ordem de uuid do PostgreSQL"""
+    return value.int >> 64, value.int & 0xFFFFFFFFFFFFFFFF
+
+
+def _row_group_arrays(rows: List[Any]) -> Dict[str, np.ndarray]:
+    """Colunas de um grupo de linhas.
+
+    Cada coluna de texto vira um dicionário próprio do grupo (valores
+    distintos ordenados, gravados como bytes UTF-8 concatenados + offsets,
+    sem largura fixa) e os códigos das linhas (-1 para NULL).
+    """
+    count = len(rows)
+    arrays: Dict[str, np.ndarray] = {}
+
+    def values(name: str) -> List[Any]:
+        return [getattr(row, name) for row in rows]
+
+    ids = [_uuid_halves(value) for value in values("id")]
+    arrays["id.hi"] = np.fromiter((hi for hi, _ in ids), dtype=np.uint64, count=count)
+    arrays["id.lo"] = np.fromiter((lo for _, lo in ids), dtype=np.uint64, count=count)
+    for name in TIMESTAMP_COLUMNS:
+        arrays[name] = np.array([_datetime64(v) for v in values(name)], dtype="datetime64[us]")
+    for name in INTEGER_COLUMNS:
+        arrays[name] = np.fromiter((v or 0 for v in values(name)), dtype=np.int32, count=count)
+    for name in MONEY_COLUMNS:
+        arrays[name] = np.fromiter((to_micro(v) for v in values(name)), dtype=np.int64, count=count)
+    for name in BOOLEAN_COLUMNS:
+        arrays[name] = np.fromiter((bool(v) for v in values(name)), dtype=bool, count=count)
+    for name in DICTIONARY_COLUMNS:
+        column = [None if v is None else str(v) for v in values(name)]
+        distinct = sorted({v for v in column if v is not None})
+        index = {value: code for code, value in enumerate(distinct)}
+        encoded = [value.encode() for value in distinct]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        arrays[f"{name}.data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        arrays[f"{name}.offsets"] = offsets
+        arrays[f"{name}.codes"] = np.fromiter(
+            (-1 if v is None else index[v] for v in column), dtype=np.int32, count=count
+        )
+    return arrays
+
+
+def _write_row_group(directory: str, number: int, rows: List[Any]) -> Dict[str, Any]:
+    filename = f"{number:05d}.npz"
+    np.savez_compressed(os.path.join(directory, filename), **_row_group_arrays(rows))
+    return {
+        "file": filename,
+        "rows": len(rows),
+        "first": rows[0].calldate.isoformat(),
+        "last": rows[-1].calldate.isoformat(),
+    }
+
+
+async def _export_rows(
+    month: date, directory: str, chunk_size: int, row_group_rows: int,
+) -> List[Dict[str, Any]]:
+    period_start = datetime.combine(month, datetime.min.time())
+    period_end = datetime.combine(_next_month(month), datetime.min.time())
+    groups: List[Dict[str, Any]] = []
+    pending: List[Any] = []
+    try:
+        async with async_session() as db:
+            result = await db.stream(
+                select(CDR.__table__)
+                .where(CDR.calldate >= period_start, CDR.calldate < period_end)
+                .order_by(CDR.calldate, CDR.id)
+                .execution_options(yield_per=chunk_size)
+            )
+            async for rows in result.partitions(chunk_size):
+                pending.extend(rows)
+                while len(pending) >= row_group_rows:
+                    groups.append(_write_row_group(directory, len(groups), pending[:row_group_rows]))
+                    del pending[:row_group_rows]
+        if pending:
+            groups.append(_write_row_group(directory, len(groups), pending))
+    finally:
+        await engine.dispose()
+    return groups
+
+
+def export_month(month: date, directory: str, chunk_size: int, row_group_rows: int) -> List[Dict[str, Any]]:
+    """Lê o mês do banco e grava os grupos de linhas em directory (roda no processo do pool).
+
+    Só um grupo (até row_group_rows linhas) fica na memória por vez.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return asyncio.run(_export_rows(month, directory, chunk_size, row_group_rows))
+
+
+class ArchiveRowGroup:
+    """Um grupo de linhas de um mês (arquivo .npz), com as colunas descomprimidas sob demanda.
+
+    As linhas estão ordenadas por (calldate, id), então o período vira um
+    intervalo contíguo via searchsorted; filtros de texto são avaliados uma
+    vez por valor distinto do dicionário e aplicados aos códigos.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._npz = np.load(path, allow_pickle=False)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._dictionaries: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def column(self, name: str) -> np.ndarray:
+        array = self._columns.get(name)
+        if array is None:
+            with self._lock:
+                array = self._columns.get(name)
+                if array is None:
+                    array = self._columns[name] = self._npz[name]
+        return array
+
+    def dictionary(self, name: str) -> List[str]:
+        """Valores distintos (ordenados) da coluna de texto"""
+        values = self._dictionaries.get(name)
+        if values is None:
+            data = self.column(f"{name}.data").tobytes()
+            offsets = self.column(f"{name}.offsets").tolist()
+            values = [data[a:b].decode() for a, b in zip(offsets, offsets[1:])]
+            self._dictionaries[name] = values
+        return values
+
+    def __len__(self) -> int:
+        return len(self.column("calldate"))
+
+    def _code_of(self, name: str, value: str) -> Optional[int]:
+        values = self.dictionary(name)
+        position = bisect.bisect_left(values, value)
+        return position if position < len(values) and values[position] == value else None
+
+    def _text_match(self, name: str, term: str, mode: str) -> np.ndarray:
+        """Códigos do dicionário cujo valor casa com a busca"""
+        values = self.dictionary(name)
+        if mode == "exact":
+            code = self._code_of(name, term)
+            return np.array([] if code is None else [code], dtype=np.int64)
+        if mode == "prefix":
+            # Dicionário ordenado: os valores com o prefixo são um intervalo contíguo
+            lo = bisect.bisect_left(values, term)
+            hi = bisect.bisect_left(values, term + "\U0010ffff", lo)
+            return np.arange(lo, hi, dtype=np.int64)
+        if mode == "suffix":
+            matched = [code for code, value in enumerate(values) if value.endswith(term)]
+        else:
+            term = term.lower()
+            matched = [code for code, value in enumerate(values) if term in value.lower()]
+        return np.array(matched, dtype=np.int64)
+
+    def select(
+        self,
+        start: datetime,
+        end: datetime,
+        customer_id: Optional[str] = None,
+        call_type: Optional[str] = None,
+        search: Optional[str] = None,
+        search_mode: str = "auto",
+        cursor: Optional[Tuple[datetime, uuid.UUID, str]] = None,
+    ) -> np.ndarray:
+        """Posições (em ordem crescente de calldate, id) das linhas que atendem aos filtros"""
+        calldate = self.column("calldate")
+        lo = int(np.searchsorted(calldate, _datetime64(start), "left"))
+        hi = int(np.searchsorted(calldate, _datetime64(end), "left"))
+        mask = np.ones(hi - lo, dtype=bool)
+
+        for name, value in (("customer_id", customer_id), ("call_type", call_type)):
+            if value:
+                code = self._code_of(name, value)
+                if code is None:
+                    return np.empty(0, dtype=np.int64)
+                mask &= self.column(f"{name}.codes")[lo:hi] == code
+
+        term = (search or "").strip()
+        if term:
+            mode, term = resolve_mode(term, search_mode)
+            if term:
+                found = np.zeros(hi - lo, dtype=bool)
+                for name in ("src", "dst"):
+                    found |= np.isin(self.column(f"{name}.codes")[lo:hi], self._text_match(name, term, mode))
+                mask &= found
+
+        if cursor is not None:
+            cursor_date, cursor_id, direction = cursor
+            dates = calldate[lo:hi]
+            key = _datetime64(cursor_date)
+            id_hi, id_lo = _uuid_halves(cursor_id)
+            ids_hi, ids_lo = self.column("id.hi")[lo:hi], self.column("id.lo")[lo:hi]
+            if direction == "next":
+                same_id = (ids_hi < id_hi) | ((ids_hi == id_hi) & (ids_lo < id_lo))
+                mask &= (dates < key) | ((dates == key) & same_id)
+            else:
+                same_id = (ids_hi > id_hi) | ((ids_hi == id_hi) & (ids_lo > id_lo))
+                mask &= (dates > key) | ((dates == key) & same_id)
+
+        return np.flatnonzero(mask) + lo
+
+    def rows(self, positions: np.ndarray) -> List[ArchivedCDR]:
+        def text(name: str) -> List[Optional[str]]:
+            values = self.dictionary(name)
+            return [values[c] if c >= 0 else None for c in self.column(f"{name}.codes")[positions].tolist()]
+
+        ids = [
+            uuid.UUID(int=(int(h) << 64) | int(l))
+            for h, l in zip(self.column("id.hi")[positions].tolist(), self.column("id.lo")[positions].tolist())
+        ]
+        calldates = self.column("calldate")[positions].astype("datetime64[us]").tolist()
+        return [
+            ArchivedCDR(*fields)
+            for fields in zip(
+                ids, text("call_id"), calldates, text("clid"), text("src"), text("dst"),
+                text("callerid"), text("call_type"),
+                self.column("duration")[positions].tolist(), self.column("billsec")[positions].tolist(),
+                text("disposition"),
+                [from_micro(v) for v in self.column("cost")[positions].tolist()],
+                [from_micro(v) for v in self.column("price")[positions].tolist()],
+            )
+        ]
+
+    def totals(self, positions: np.ndarray) -> Tuple[int, int, int, int]:
+        """(chamadas, billsec, custo, preço em micro-unidades) das linhas"""
+        return (
+            len(positions),
+            int(self.column("billsec")[positions].sum(dtype=np.int64)),
+            int(self.column("cost")[positions].sum()),
+            int(self.column("price")[positions].sum()),
+        )
+
+
+class ArchiveMonth:
+    """Um mês arquivado: grupos de linhas consecutivos, abertos sob demanda.
+
+    O manifesto guarda o primeiro e o último calldate de cada grupo, então
+    grupos fora do período nem chegam a ser abertos.
+    """
+
+    def __init__(self, directory: str, groups: List[Dict[str, Any]]):
+        self.directory = directory
+        self._groups = groups
+        self._bounds = [(datetime.fromisoformat(g["first"]), datetime.fromisoformat(g["last"])) for g in groups]
+        self._open: Dict[int, ArchiveRowGroup] = {}
+        self._lock = threading.Lock()
+
+    def _group(self, number: int) -> ArchiveRowGroup:
+        with self._lock:
+            group = self._open.get(number)
+            if group is None:
+                group = self._open[number] = ArchiveRowGroup(
+                    os.path.join(self.directory, self._groups[number]["file"])
+                )
+            return group
+
+    def groups(self, start: datetime, end: datetime, reverse: bool = False) -> Iterator[ArchiveRowGroup]:
+        """Grupos que cruzam [start, end), em ordem de calldate (ou inversa)"""
+        numbers = range(len(self._groups))
+        for number in (reversed(numbers) if reverse else numbers):
+            first, last = self._bounds[number]
+            if last < start or first >= end:
+                continue
+            yield self._group(number)
+
+
+class CDRArchive:
+    """Arquivo colunar dos meses fechados de CDR, em disco local.
+
+    Cada mês vira um diretório de grupos de linhas .npz comprimidos (colunas
+    NumPy, textos codificados por dicionário em cada grupo) e uma entrada no
+    manifest.json. A gravação roda num processo separado e mantém só um
+    grupo na memória. Meses marcados como removidos do banco (dropped)
+    passam a ser lidos do arquivo pelos relatórios, com o período, cliente,
+    tipo e busca em src/dst aplicados nas colunas antes de montar as linhas.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.CDR_ARCHIVE_PATH,
+        chunk_size: int = 50000,
+        row_group_rows: int = settings.CDR_ARCHIVE_ROW_GROUP_ROWS,
+    ):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.row_group_rows = row_group_rows
+        self._manifest: Optional[Dict[str, Dict[str, Any]]] = None
+        self._open: "OrderedDict[str, ArchiveMonth]" = OrderedDict()
+        self._open_lock = threading.Lock()
+        self._archive_lock = asyncio.Lock()
+
+    # ==========================================
+    # MANIFESTO
+    # ==========================================
+    @property
+    def manifest(self) -> Dict[str, Dict[str, Any]]:
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.path, _MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except FileNotFoundError:
+                self._manifest = {}
+        return self._manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        temp = os.path.join(self.path, _MANIFEST + ".tmp")
+        with open(temp, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(temp, os.path.join(self.path, _MANIFEST))
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": name, **{key: value for key, value in entry.items() if key != "groups"},
+             "row_groups": len(entry["groups"])}
+            for name, entry in sorted(self.manifest.items())
+        ]
+
+    def is_archived(self, month: date) -> bool:
+        return _month_name(month) in self.manifest
+
+    def mark_dropped(self, month: date):
+        """Registra que o mês saiu do banco: consultas do período passam a usar o arquivo"""
+        entry = self.manifest.get(_month_name(month))
+        if entry is not None:
+            entry["dropped"] = True
+            self._save_manifest()
+
+    def cold_months(self, start: datetime, end: datetime) -> List[date]:
+        """Meses removidos do banco que cruzam [start, end), do mais recente ao mais antigo"""
+        months = []
+        for entry in self.manifest.values():
+            if not entry.get("dropped"):
+                continue
+            month = date.fromisoformat(entry["month"])
+            if datetime.combine(month, datetime.min.time()) < end and \
+                    datetime.combine(_next_month(month), datetime.min.time()) > start:
+                months.append(month)
+        return sorted(months, reverse=True)
+
+    def _month(self, month: date) -> ArchiveMonth:
+        name = _month_name(month)
+        with self._open_lock:
+            archive = self._open.get(name)
+            if archive is None:
+                entry = self.manifest[name]
+                archive = self._open[name] = ArchiveMonth(
+                    os.path.join(self.path, entry["directory"]), entry["groups"]
+                )
+                # Sem close(): um leitor em outra thread pode estar carregando colunas do
+                # mês removido; o arquivo fecha quando a última referência sai (GC)
+                while len(self._open) > _OPEN_MONTHS:
+                    self._open.popitem(last=False)
+            self._open.move_to_end(name)
+            return archive
+
+    # ==========================================
+    # ARQUIVAMENTO
+    # ==========================================
+    async def archive_month(self, month: date) -> Dict[str, Any]:
+        """Grava o mês (já fechado) em arquivo colunar; não remove nada do banco.
+
+        A leitura do banco e a codificação rodam num processo separado, fora
+        do processo da API; o mês só passa a valer quando o manifesto aponta
+        para o novo diretório.
+        """
+        month = month.replace(day=1)
+        if _next_month(month) > datetime.utcnow().date().replace(day=1):
+            raise ValueError(f"Mês {month:%Y-%m} ainda não está fechado")
+        async with self._archive_lock:
+            start = time.perf_counter()
+            name = _month_name(month)
+            archived_at = datetime.utcnow()
+            directory = f"{name}.{archived_at:%Y%m%d%H%M%S}"
+            target = os.path.join(self.path, directory)
+
+            pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                groups = await asyncio.get_running_loop().run_in_executor(
+                    pool, export_month, month, target, self.chunk_size, self.row_group_rows,
+                )
+            except BaseException:
+                await asyncio.to_thread(shutil.rmtree, target, True)
+                raise
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+            previous = self.manifest.get(name, {})
+            entry = self.manifest[name] = {
+                "month": month.isoformat(),
+                "directory": directory,
+                "groups": groups,
+                "rows": sum(group["rows"] for group in groups),
+                "size_bytes": sum(os.path.getsize(os.path.join(target, group["file"])) for group in groups),
+                "archived_at": archived_at.isoformat(),
+                "dropped": previous.get("dropped", False),
+            }
+            self._save_manifest()
+            with self._open_lock:
+                self._open.pop(name, None)
+            # Leitores ainda com a versão anterior aberta seguem lendo os arquivos já desvinculados
+            if "directory" in previous:
+                await asyncio.to_thread(shutil.rmtree, os.path.join(self.path, previous["directory"]), True)
+
+            metrics.observe("cdr.archive.month", time.perf_counter() - start)
+            logger.info(
+                f"CDRs de {month:%Y-%m} arquivados: {entry['rows']} linhas em {len(groups)} grupos, "
+                f"{entry['size_bytes']} bytes"
+            )
+            return {"name": name, **entry}
+
+    # ==========================================
+    # CONSULTAS
+    # ==========================================
+    async def page(
+        self,
+        months: List[date],
+        start: datetime,
+        end: datetime,
+        limit: int,
+        cursor: Optional[Tuple[datetime, uuid.UUID, str]] = None,
+        **filters,
+    ) -> List[ArchivedCDR]:
+        """Até limit linhas a partir do cursor, na ordem da direção (next: decrescente)"""
+        def run() -> List[ArchivedCDR]:
+            direction = cursor[2] if cursor else "next"
+            ordered = months if direction == "next" else list(reversed(months))
+            found: List[ArchivedCDR] = []
+            for month in ordered:
+                for group in self._month(month).groups(start, end, reverse=direction == "next"):
+                    positions = group.select(start, end, cursor=cursor, **filters)
+                    if direction == "next":
+                        positions = positions[::-1]
+                    found.extend(group.rows(positions[:limit - len(found)]))
+                    if len(found) >= limit:
+                        return found
+            return found
+
+        return await asyncio.to_thread(run)
+
+    async def totals(self, months: List[date], start: datetime, end: datetime, **filters) -> Tuple[int, int, int, int]:
+        def run() -> Tuple[int, int, int, int]:
+            sums = np.zeros(4, dtype=np.int64)
+            for month in months:
+                for group in self._month(month).groups(start, end):
+                    sums += np.array(group.totals(group.select(start, end, **filters)), dtype=np.int64)
+            return tuple(int(v) for v in sums)
+
+        return await asyncio.to_thread(run)
+
+    async def stream(
+        self, months: List[date], start: datetime, end: datetime, chunk_size: int = 2000, **filters
+    ) -> AsyncIterator[List[ArchivedCDR]]:
+        """Linhas dos meses em ordem decrescente de calldate, em blocos"""
+        for month in months:
+            archive = await asyncio.to_thread(self._month, month)
+            groups = await asyncio.to_thread(lambda: list(archive.groups(start, end, reverse=True)))
+            for group in groups:
+                positions = (await asyncio.to_thread(group.select, start, end, **filters))[::-1]
+                for offset in range(0, len(positions), chunk_size):
+                    yield await asyncio.to_thread(group.rows, positions[offset:offset + chunk_size])
+
+
+cdr_archive = CDRArchive()
@@ -0,0 +1,327 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from loguru import logger
+from sqlalchemy import bindparam, func, select, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, TIMESTAMP, VARCHAR
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models import CDR, Customer, DID, Extension, Gateway
+from app.models.associations import CustomerDID
+from app.services.cdr_rollups import cdr_rollups
+from app.services.route_matcher import RouteMatcher, route_matcher_cache
+
+TRUNK_PREFIX = "CLI_"
+
+# Preenche só o que ainda está vazio: a backfill pode ser repetida ou retomada sem efeito colateral
+_UPDATE_ATTRIBUTION = text("""
+    UPDATE cdr
+    SET customer_id = COALESCE(cdr.customer_id, v.customer_id),
+        extension_id = COALESCE(cdr.extension_id, v.extension_id),
+        gateway_id = COALESCE(cdr.gateway_id, v.gateway_id),
+        route_id = COALESCE(cdr.route_id, v.route_id),
+        call_type = COALESCE(cdr.call_type, v.call_type)
+    FROM unnest(:ids, :calldates, :customer_ids, :extension_ids, :gateway_ids, :route_ids, :call_types)
+        AS v(id, calldate, customer_id, extension_id, gateway_id, route_id, call_type)
+    WHERE cdr.id = v.id AND cdr.calldate = v.calldate
+""").bindparams(
+    bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("calldates", type_=ARRAY(TIMESTAMP)),
+    bindparam("customer_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("extension_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("gateway_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("route_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("call_types", type_=ARRAY(VARCHAR)),
+)
+
+
+def channel_endpoint(channel: Optional[str]) -> Optional[str]:
+    """Endpoint PJSIP de um canal ('PJSIP/CLI_0001-0000002a' -> 'CLI_0001')"""
+    if not channel or not channel.startswith("PJSIP/"):
+        return None
+    name = channel[6:]
+    return name.rsplit("-", 1)[0] if "-" in name else name
+
+
+class Attribution:
+    __slots__ = ("customer_id", "extension_id", "gateway_id", "route_id", "call_type")
+
+    def __init__(self):
+        self.customer_id: Optional[UUID] = None
+        self.extension_id: Optional[UUID] = None
+        self.gateway_id: Optional[UUID] = None
+        self.route_id: Optional[UUID] = None
+        self.call_type: Optional[str] = None
+
+
+class CDRAttributor:
+    """Identifica cliente, ramal, gateway e rota de um CDR.
+
+    Mantém em memória índices dos nomes usados na configuração gerada:
+    troncos de cliente (CLI_<code>), gateways e ramais (endpoints PJSIP) e
+    DIDs alocados. O endpoint de origem (channel) e o de destino
+    (dstchannel) definem a direção da chamada; a rota de saída é a que o
+    dialplan escolheria para o destino (RouteMatcher). Os índices são
+    conferidos a cada CDR_ATTRIBUTION_REFRESH_SECONDS.
+    """
+
+    def __init__(self, refresh_seconds: float = settings.CDR_ATTRIBUTION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = asyncio.Lock()
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self.trunks: Dict[str, UUID] = {}
+        self.gateways: Dict[str, UUID] = {}
+        self.extensions: Dict[str, Tuple[UUID, Optional[UUID]]] = {}
+        self.dids: Dict[str, Tuple[Optional[UUID], Optional[UUID]]] = {}
+        self.routes: Optional[RouteMatcher] = None
+
+    # ==========================================
+    # ÍNDICES
+    # ==========================================
+    def invalidate(self):
+        self._signature = None
+        self._checked_at = 0.0
+
+    async def _current_signature(self, db: AsyncSession) -> Tuple:
+        result = await db.execute(select(
+            select(func.count(Customer.id)).scalar_subquery(),
+            select(func.max(Customer.updated_at)).scalar_subquery(),
+            select(func.count(Gateway.id)).scalar_subquery(),
+            select(func.max(Gateway.updated_at)).scalar_subquery(),
+            select(func.count(Extension.id)).scalar_subquery(),
+            select(func.max(Extension.updated_at)).scalar_subquery(),
+            select(func.count(DID.id)).scalar_subquery(),
+            select(func.max(DID.updated_at)).scalar_subquery(),
+            select(func.count(CustomerDID.id)).scalar_subquery(),
+            select(func.max(CustomerDID.allocated_at)).scalar_subquery(),
+        ))
+        return tuple(result.one())
+
+    async def ensure_fresh(self, db: AsyncSession):
+        self.routes = await route_matcher_cache.get(db)
+        if self._signature is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+            return
+        async with self._lock:
+            if self._signature is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return
+            signature = await self._current_signature(db)
+            if signature != self._signature:
+                await self._load(db)
+                self._signature = signature
+            self._checked_at = time.monotonic()
+
+    async def _load(self, db: AsyncSession):
+        customers = await db.execute(select(Customer.id, Customer.code).where(Customer.type == "trunk"))
+        trunks = {f"{TRUNK_PREFIX}{code}": customer_id for customer_id, code in customers}
+
+        gateways = await db.execute(select(Gateway.id, Gateway.name))
+        gateways_by_name = {name: gateway_id for gateway_id, name in gateways}
+
+        extensions = await db.execute(select(Extension.id, Extension.extension, Extension.customer_id))
+        extensions_by_number = {number: (ext_id, customer_id) for ext_id, number, customer_id in extensions}
+
+        dids = await db.execute(
+            select(DID.number, CustomerDID.customer_id, DID.gateway_id)
+            .outerjoin(CustomerDID, DID.id == CustomerDID.did_id)
+        )
+        dids_by_number = {number: (customer_id, gateway_id) for number, customer_id, gateway_id in dids}
+
+        self.trunks = trunks
+        self.gateways = gateways_by_name
+        self.extensions = extensions_by_number
+        self.dids = dids_by_number
+        logger.info(
+            f"Índices de atribuição carregados: {len(trunks)} troncos, {len(gateways_by_name)} gateways, "
+            f"{len(extensions_by_number)} ramais, {len(dids_by_number)} DIDs"
+        )
+
+    # ==========================================
+    # ATRIBUIÇÃO
+    # ==========================================
+    def _endpoint(self, endpoint: Optional[str], attribution: Attribution) -> Optional[str]:
+        """Preenche o que o endpoint identifica e retorna o tipo ('trunk', 'gateway', 'extension')"""
+        if not endpoint:
+            return None
+        customer_id = self.trunks.get(endpoint)
+        if customer_id is not None:
+            attribution.customer_id = attribution.customer_id or customer_id
+            return "trunk"
+        gateway_id = self.gateways.get(endpoint)
+        if gateway_id is not None:
+            attribution.gateway_id = attribution.gateway_id or gateway_id
+            return "gateway"
+        extension = self.extensions.get(endpoint)
+        if extension is not None:
+            attribution.extension_id = attribution.extension_id or extension[0]
+            attribution.customer_id = attribution.customer_id or extension[1]
+            return "extension"
+        return None
+
+    def attribute(self, channel: Optional[str], dstchannel: Optional[str], dst: Optional[str]) -> Attribution:
+        attribution = Attribution()
+        source = self._endpoint(channel_endpoint(channel), attribution)
+        destination = self._endpoint(channel_endpoint(dstchannel), attribution)
+        number = (dst or "").lstrip("+")
+
+        if source == "gateway" or (source is None and number in self.dids):
+            # Entrada: o DID identifica o cliente quando o destino não identificou
+            attribution.call_type = "inbound"
+            did = self.dids.get(number)
+            if did is not None:
+                attribution.customer_id = attribution.customer_id or did[0]
+                attribution.gateway_id = attribution.gateway_id or did[1]
+        elif destination == "gateway" or (source in ("trunk", "extension") and destination != "extension"):
+            attribution.call_type = "outbound"
+            if self.routes is not None and number:
+                route = self.routes.match(number)
+                if route is not None:
+                    attribution.route_id = UUID(route["route_id"])
+                    if attribution.gateway_id is None:
+                        attribution.gateway_id = UUID(route["gateway_id"])
+        elif source == "extension" and destination == "extension":
+            attribution.call_type = "internal"
+        return attribution
+
+    async def stamp(self, records: List[Any]):
+        """Preenche customer_id, extension_id, gateway_id, route_id e call_type dos CDRs recebidos"""
+        async with async_session() as db:
+            await self.ensure_fresh(db)
+        attributed = 0
+        for record in records:
+            attribution = self.attribute(record.data.get("channel"), record.data.get("dstchannel"), record.data.get("dst"))
+            record.customer_id = attribution.customer_id
+            record.extension_id = attribution.extension_id
+            record.gateway_id = attribution.gateway_id
+            record.route_id = attribution.route_id
+            record.call_type = attribution.call_type
+            if attribution.customer_id or attribution.gateway_id:
+                attributed += 1
+        metrics.incr("cdr.attribution.attributed", attributed)
+        metrics.incr("cdr.attribution.unattributed", len(records) - attributed)
+
+
+class AttributionBackfill:
+    """Atribuição em lote dos CDRs já gravados sem cliente e gateway.
+
+    Percorre o período em blocos ordenados por (calldate, id) e grava com um
+    UPDATE ... FROM unnest() por bloco, preenchendo apenas colunas vazias;
+    repetir a backfill no mesmo período continua de onde parou na prática,
+    já que os CDRs atribuídos deixam de ser selecionados.
+    """
+
+    def __init__(self, attributor: CDRAttributor):
+        self.attributor = attributor
+        self._task: Optional[asyncio.Task] = None
+        self.state: Dict[str, Any] = {"status": "idle"}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, date_from: datetime, date_to: datetime, chunk_size: int = 20000) -> bool:
+        if self.running:
+            return False
+        self.state = {
+            "status": "running",
+            "date_from": date_from,
+            "date_to": date_to,
+            "processed": 0,
+            "attributed": 0,
+            "rows_per_second": 0.0,
+            "last_calldate": None,
+            "error": None,
+            "started_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        self._task = asyncio.create_task(self._run(date_from, date_to, chunk_size))
+        return True
+
+    def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self._task.cancel()
+        return True
+
+    async def _run(self, date_from: datetime, date_to: datetime, chunk_size: int):
+        start = time.perf_counter()
+        try:
+            await self._process(date_from, date_to, chunk_size, start)
+            self.state["status"] = "completed"
+        except asyncio.CancelledError:
+            self.state["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Erro na atribuição de CDRs: {e}")
+            self.state["status"] = "failed"
+            self.state["error"] = str(e)
+        finally:
+            self.state["finished_at"] = datetime.utcnow()
+            logger.info(
+                f"Atribuição de CDRs {self.state['status']}: {self.state['processed']} CDRs, "
+                f"{self.state['attributed']} atribuídos"
+            )
+            if self.state["attributed"]:
+                # Cliente e gateway mudaram: agregados do dashboard do período
+                cdr_rollups.rebuild(date_from, date_to)
+
+    async def _process(self, date_from: datetime, date_to: datetime, chunk_size: int, start: float):
+        cursor: Optional[Tuple[datetime, UUID]] = None
+        async with async_session() as db:
+            while True:
+                await self.attributor.ensure_fresh(db)
+                query = (
+                    select(CDR.id, CDR.calldate, CDR.channel, CDR.dstchannel, CDR.dst)
+                    .where(
+                        CDR.calldate >= date_from,
+                        CDR.calldate < date_to,
+                        CDR.customer_id.is_(None),
+                        CDR.gateway_id.is_(None),
+                    )
+                    .order_by(CDR.calldate, CDR.id)
+                    .limit(chunk_size)
+                )
+                if cursor is not None:
+                    query = query.where(tuple_(CDR.calldate, CDR.id) > tuple_(*cursor))
+                rows = (await db.execute(query)).all()
+                if not rows:
+                    break
+
+                values: Dict[str, List[Any]] = {
+                    "ids": [], "calldates": [], "customer_ids": [], "extension_ids": [],
+                    "gateway_ids": [], "route_ids": [], "call_types": [],
+                }
+                for row in rows:
+                    attribution = self.attributor.attribute(row.channel, row.dstchannel, row.dst)
+                    if not (attribution.customer_id or attribution.gateway_id or attribution.call_type):
+                        continue
+                    values["ids"].append(row.id)
+                    values["calldates"].append(row.calldate)
+                    values["customer_ids"].append(attribution.customer_id)
+                    values["extension_ids"].append(attribution.extension_id)
+                    values["gateway_ids"].append(attribution.gateway_id)
+                    values["route_ids"].append(attribution.route_id)
+                    values["call_types"].append(attribution.call_type)
+
+                if values["ids"]:
+                    await db.execute(_UPDATE_ATTRIBUTION, values)
+                await db.commit()
+
+                cursor = (rows[-1].calldate, rows[-1].id)
+                self.state["processed"] += len(rows)
+                self.state["attributed"] += len(values["ids"])
+                self.state["last_calldate"] = rows[-1].calldate
+                self.state["rows_per_second"] = round(self.state["processed"] / (time.perf_counter() - start), 1)
+                metrics.incr("cdr.attribution.backfilled", len(values["ids"]))
+                if len(rows) < chunk_size:
+                    break
+
+
+cdr_attributor = CDRAttributor()
+attribution_backfill = AttributionBackfill(cdr_attributor)
@@ -0,0 +1,516 @@
+import asyncio
+import csv
+import os
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import asyncpg
+from loguru import logger
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.core.metrics import metrics
+from app.services.ami import AMIManager, ami_manager
+from app.services.cdr_attribution import CDRAttributor, cdr_attributor
+from app.services.cdr_rollups import rollup_insert
+from app.services.rating import RatingEngine, from_micro, rating_engine
+from app.services.rerating import rate_chunk
+
+# Colunas gravadas pelo COPY (mesma ordem das tuplas de _to_row)
+COPY_COLUMNS = (
+    "id", "call_id", "calldate", "clid", "src", "dst", "dcontext", "channel", "dstchannel",
+    "lastapp", "lastdata", "duration", "billsec", "disposition", "amaflags", "accountcode",
+    "uniqueid", "userfield", "peeraccount", "linkedid", "sequence", "callerid", "call_type",
+    "start_time", "answer_time", "end_time", "cost", "price",
+    "customer_id", "extension_id", "route_id", "gateway_id", "created_at",
+)
+
+# Tamanho das colunas texto do cdr: valores maiores são truncados em vez de derrubar o lote
+_COLUMN_LIMITS = {
+    "call_id": 100, "clid": 80, "src": 50, "dst": 50, "dcontext": 80, "channel": 80,
+    "dstchannel": 80, "lastapp": 80, "lastdata": 80, "disposition": 50, "accountcode": 20,
+    "uniqueid": 150, "userfield": 255, "peeraccount": 20, "linkedid": 150, "callerid": 100,
+}
+
+_AMA_FLAGS = {"OMIT": 1, "BILLING": 2, "DOCUMENTATION": 3}
+
+# Colunas do Master.csv (cdr_csv); com newcdrcolumns=yes vêm também peeraccount, linkedid e sequence
+CSV_COLUMNS = (
+    "accountcode", "src", "dst", "dcontext", "clid", "channel", "dstchannel", "lastapp",
+    "lastdata", "start", "answer", "end", "duration", "billsec", "disposition", "amaflags",
+    "uniqueid", "userfield", "peeraccount", "linkedid", "sequence",
+)
+
+# Campos do evento Cdr (cdr_manager) -> campos do registro. LinkedID e Sequence só
+# vêm com o [mappings] do cdr_manager.conf (linkedid => LinkedID, sequence => Sequence)
+AMI_FIELDS = {
+    "AccountCode": "accountcode", "Source": "src", "Destination": "dst",
+    "DestinationContext": "dcontext", "CallerID": "clid", "Channel": "channel",
+    "DestinationChannel": "dstchannel", "LastApplication": "lastapp", "LastData": "lastdata",
+    "StartTime": "start", "AnswerTime": "answer", "EndTime": "end", "Duration": "duration",
+    "BillableSeconds": "billsec", "Disposition": "disposition", "AMAFlags": "amaflags",
+    "UniqueID": "uniqueid", "UserField": "userfield", "PeerAccount": "peeraccount",
+    "LinkedID": "linkedid", "Sequence": "sequence",
+}
+
+# Insere o lote e soma só os CDRs realmente inseridos aos agregados horários,
+# na mesma transação; retorna a quantidade inserida
+_INSERT_FROM_STAGING = f"""
+    WITH inserted AS (
+        INSERT INTO cdr ({', '.join(COPY_COLUMNS)})
+        SELECT {', '.join(COPY_COLUMNS)} FROM cdr_ingest_staging
+        ON CONFLICT DO NOTHING
+        RETURNING calldate, customer_id, gateway_id, dst, disposition, billsec, cost, price
+    ), rollup AS ({rollup_insert("inserted")})
+    SELECT count(*) FROM inserted
+"""
+
+# Erros do próprio lote (dados inválidos): o lote é dividido para descartar só as linhas ruins
+_DATA_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+_MAX_RETRY_DELAY = 30.0
+_RECENT_KEYS = 100000
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _parse_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _fallback_sequence(data: Dict[str, str]) -> int:
+    """Sequência derivada para CDRs sem o campo sequence (cdr_manager sem [mappings],
+    Master.csv sem newcdrcolumns).
+
+    Transferências e forks geram vários CDRs com o mesmo uniqueid; sem a
+    sequência real eles se distinguem pelo início, canal de destino, destino
+    e fim. O valor é determinístico (reenvios do mesmo CDR continuam
+    duplicados) e negativo, para não colidir com sequências do Asterisk.
+    """
+    fields = (data.get(name, "") for name in ("start", "dstchannel", "dst", "end"))
+    return -1 - (zlib.crc32("\x1f".join(fields).encode()) & 0x7FFFFFFF)
+
+
+def parse_csv_row(row: List[str]) -> Optional[Dict[str, str]]:
+    """Converte uma linha do Master.csv em registro (None se incompleta)"""
+    if len(row) < 17:
+        return None
+    return dict(zip(CSV_COLUMNS, row))
+
+
+def parse_ami_event(event: Dict[str, str]) -> Dict[str, str]:
+    """Converte um evento AMI Cdr em registro"""
+    return {field: event[key] for key, field in AMI_FIELDS.items() if key in event}
+
+
+class CDRRecord:
+    """CDR recebido, normalizado para os tipos das colunas do cdr"""
+
+    __slots__ = (
+        "data", "start", "answer", "end", "duration", "billsec", "sequence",
+        "call_type", "customer_id", "extension_id", "route_id", "gateway_id", "cost", "price",
+    )
+
+    def __init__(self, data: Dict[str, str]):
+        self.data = data
+        self.start = _parse_time(data.get("start"))
+        self.answer = _parse_time(data.get("answer"))
+        self.end = _parse_time(data.get("end"))
+        self.duration = _parse_int(data.get("duration"))
+        self.billsec = _parse_int(data.get("billsec"))
+        sequence = data.get("sequence")
+        self.sequence = _parse_int(sequence) if sequence else _fallback_sequence(data)
+        self.call_type: Optional[str] = None
+        self.customer_id: Optional[uuid.UUID] = None
+        self.extension_id: Optional[uuid.UUID] = None
+        self.route_id: Optional[uuid.UUID] = None
+        self.gateway_id: Optional[uuid.UUID] = None
+        self.cost = None
+        self.price = None
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        return self.data.get("uniqueid", ""), self.sequence
+
+    def text(self, column: str, field: Optional[str] = None) -> Optional[str]:
+        value = self.data.get(field or column)
+        if value is None or value == "":
+            return None
+        return value[:_COLUMN_LIMITS[column]]
+
+    def to_row(self, now: datetime) -> Tuple:
+        amaflags = self.data.get("amaflags", "")
+        return (
+            uuid.uuid4(),
+            self.text("call_id", "uniqueid"),
+            self.start or now,
+            self.text("clid"),
+            self.text("src"),
+            self.text("dst"),
+            self.text("dcontext"),
+            self.text("channel"),
+            self.text("dstchannel"),
+            self.text("lastapp"),
+            self.text("lastdata"),
+            self.duration,
+            self.billsec,
+            self.text("disposition"),
+            _AMA_FLAGS.get(amaflags.upper(), _parse_int(amaflags)),
+            self.text("accountcode"),
+            self.text("uniqueid"),
+            self.text("userfield"),
+            self.text("peeraccount"),
+            self.text("linkedid"),
+            self.sequence,
+            self.text("callerid", "clid"),
+            self.call_type,
+            self.start,
+            self.answer,
+            self.end,
+            self.cost if self.cost is not None else from_micro(0),
+            self.price if self.price is not None else from_micro(0),
+            self.customer_id,
+            self.extension_id,
+            self.route_id,
+            self.gateway_id,
+            now,
+        )
+
+
+class CDRIngestService:
+    """Ingestão de CDRs do Asterisk em lote.
+
+    Os registros chegam por eventos AMI Cdr (cdr_manager) ou pela leitura
+    contínua do Master.csv (cdr_csv, útil para testes offline) e entram numa
+    fila limitada. Um único flusher agrupa até batch_size registros ou
+    flush_seconds, atribui cliente, gateway e rota, tarifa o lote e grava
+    com COPY numa tabela temporária seguido de INSERT ... ON CONFLICT DO
+    NOTHING (chave uniqueid+sequence; sem sequence, ver _fallback_sequence),
+    somando os CDRs inseridos aos agregados horários (cdr_hourly) na mesma
+    transação.
+
+    Com o banco lento a fila enche: o leitor do Master.csv pausa até o
+    flusher liberar espaço, mas eventos AMI nunca aguardam (o handler roda
+    dentro do loop de leitura da sessão AMI) e, com a fila cheia, são
+    descartados e contados em stats["dropped"] (recuperáveis do Master.csv).
+    """
+
+    def __init__(
+        self,
+        source: str = settings.CDR_INGEST_SOURCE,
+        csv_path: str = settings.CDR_INGEST_CSV_PATH,
+        batch_size: int = settings.CDR_INGEST_BATCH_SIZE,
+        flush_seconds: float = settings.CDR_INGEST_FLUSH_SECONDS,
+        queue_size: int = settings.CDR_INGEST_QUEUE_SIZE,
+        rating: RatingEngine = rating_engine,
+        attributor: CDRAttributor = cdr_attributor,
+    ):
+        self.source = source
+        self.csv_path = csv_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.rating = rating
+        self.attributor = attributor
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+        self._recent: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self._flushes: Deque[Tuple[float, int]] = deque()
+        self._last_rejected = 0
+        self.stats = {
+            "received": 0,
+            "inserted": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "batches": 0,
+            "retries": 0,
+            "backpressure_waits": 0,
+            "dropped": 0,
+            "last_flush_at": None,
+            "last_lag_seconds": None,
+        }
+
+    # ==========================================
+    # CICLO DE VIDA
+    # ==========================================
+    def start(self, manager: AMIManager = ami_manager):
+        """Inicia o flusher e a fonte configurada (nada a fazer se desativada)"""
+        if not self.source or self._running:
+            return
+        if self.source not in ("ami", "csv"):
+            logger.error(f"Fonte de CDR desconhecida: {self.source}")
+            return
+
+        self._running = True
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        if self.source == "ami":
+            manager.add_event_handler(self.handle_event)
+        else:
+            self._tasks.append(asyncio.create_task(self._tail_csv(self.csv_path)))
+        logger.info(f"Ingestão de CDRs iniciada (fonte: {self.source})")
+
+    async def stop(self):
+        """Para as fontes e grava os registros ainda na fila"""
+        if not self._running:
+            return
+        self._running = False
+        for task in self._tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*self._tasks[1:], return_exceptions=True)
+        flusher = self._tasks[0]
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(flusher, timeout=30)
+        except asyncio.TimeoutError:
+            logger.error(f"Ingestão de CDRs encerrada com {self._queue.qsize()} registros na fila")
+        self._tasks.clear()
+
+    # ==========================================
+    # FONTES
+    # ==========================================
+    def _accept(self, data: Dict[str, str]) -> Optional[CDRRecord]:
+        """Normaliza o CDR (None se já recebido recentemente)"""
+        record = CDRRecord(data)
+        if record.key[0] and record.key in self._recent:
+            self.stats["duplicates"] += 1
+            return None
+        return record
+
+    def _remember(self, record: CDRRecord):
+        key = record.key
+        if key[0]:
+            self._recent[key] = None
+            if len(self._recent) > _RECENT_KEYS:
+                self._recent.popitem(last=False)
+        self.stats["received"] += 1
+
+    async def submit(self, data: Dict[str, str]):
+        """Enfileira um CDR, aguardando espaço na fila (backpressure)"""
+        record = self._accept(data)
+        if record is None:
+            return
+        self._remember(record)
+        if self._queue.full():
+            self.stats["backpressure_waits"] += 1
+            metrics.incr("cdr.ingest.backpressure")
+        await self._queue.put(record)
+
+    def submit_nowait(self, data: Dict[str, str]) -> bool:
+        """Enfileira um CDR sem aguardar; com a fila cheia o CDR é descartado (retorna False)"""
+        record = self._accept(data)
+        if record is None:
+            return True
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            metrics.incr("cdr.ingest.dropped")
+            logger.error(f"Fila de CDRs cheia, CDR descartado (uniqueid {data.get('uniqueid')})")
+            return False
+        self._remember(record)
+        return True
+
+    def handle_event(self, event: Dict[str, str]):
+        # Síncrono: não pode bloquear o dispatcher de eventos AMI
+        if self._running and event.get("Event") == "Cdr":
+            self.submit_nowait(parse_ami_event(event))
+
+    async def _tail_csv(self, path: str):
+        """Lê o Master.csv do início e acompanha novas linhas (inclusive após rotação)"""
+        f = None
+        inode = None
+        partial = ""
+        try:
+            while self._running:
+                if f is None:
+                    try:
+                        f = open(path, 'r', newline='')
+                        inode = os.fstat(f.fileno()).st_ino
+                        partial = ""
+                        logger.info(f"Lendo CDRs de {path}")
+                    except FileNotFoundError:
+                        await asyncio.sleep(5)
+                        continue
+
+                chunk = await asyncio.to_thread(f.read, 1024 * 1024)
+                if not chunk:
+                    try:
+                        stat = os.stat(path)
+                        rotated = stat.st_ino != inode or stat.st_size < f.tell()
+                    except FileNotFoundError:
+                        rotated = True
+                    if rotated:
+                        f.close()
+                        f = None
+                    else:
+                        await asyncio.sleep(1)
+                    continue
+
+                lines = (partial + chunk).split("\n")
+                partial = lines.pop()
+                for row in csv.reader(lines):
+                    record = parse_csv_row(row)
+                    if record is not None:
+                        await self.submit(record)
+        finally:
+            if f is not None:
+                f.close()
+
+    # ==========================================
+    # GRAVAÇÃO
+    # ==========================================
+    async def _next_batch(self) -> Tuple[List[CDRRecord], bool]:
+        """Próximo lote (até batch_size registros ou flush_seconds após o primeiro)"""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            try:
+                record = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if record is None:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    async def _flush_loop(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def _rate(self, batch: List[CDRRecord]):
+        async with async_session() as db:
+            await self.rating.ensure_fresh(db)
+        rated, cost, price = await asyncio.to_thread(
+            rate_chunk,
+            self.rating,
+            [str(r.customer_id) if r.customer_id else None for r in batch],
+            [(r.data.get("dst") or "").lstrip("+") for r in batch],
+            [r.call_type or "outbound" for r in batch],
+            [r.billsec for r in batch],
+        )
+        for record, is_rated, record_cost, record_price in zip(batch, rated.tolist(), cost.tolist(), price.tolist()):
+            if is_rated:
+                record.cost = from_micro(record_cost)
+                record.price = from_micro(record_price)
+
+    async def _flush(self, batch: List[CDRRecord]):
+        start = time.perf_counter()
+        try:
+            await self.attributor.stamp(batch)
+        except Exception as e:
+            # CDRs sem atribuição podem ser completados depois pela backfill
+            logger.error(f"Erro ao atribuir lote de CDRs: {e}")
+        try:
+            await self._rate(batch)
+        except Exception as e:
+            # Sem tarifação o CDR ainda é gravado (pode ser retarifado depois)
+            logger.error(f"Erro ao tarifar lote de CDRs: {e}")
+
+        now = datetime.now()
+        rows = [record.to_row(now) for record in batch]
+        delay = 1.0
+        while True:
+            try:
+                inserted = await self._write(rows)
+                break
+            except Exception as e:
+                self.stats["retries"] += 1
+                metrics.incr("cdr.ingest.retries")
+                logger.error(f"Erro ao gravar lote de {len(rows)} CDRs, nova tentativa em {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+        elapsed = time.perf_counter() - start
+        ends = [record.end for record in batch if record.end]
+        lag = max((datetime.now() - min(ends)).total_seconds(), 0.0) if ends else None
+
+        self.stats["inserted"] += inserted
+        self.stats["duplicates"] += len(rows) - inserted - self._last_rejected
+        self.stats["batches"] += 1
+        self.stats["last_flush_at"] = datetime.utcnow()
+        self.stats["last_lag_seconds"] = lag
+        self._flushes.append((time.monotonic(), inserted))
+        metrics.incr("cdr.ingest.inserted", inserted)
+        metrics.observe("cdr.ingest.flush", elapsed)
+        if lag is not None:
+            metrics.observe("cdr.ingest.lag", lag)
+        logger.debug(f"Lote de CDRs gravado: {inserted}/{len(rows)} em {elapsed * 1000:.0f} ms")
+
+    async def _write(self, rows: List[Tuple]) -> int:
+        """Grava as linhas e retorna quantas foram inseridas (duplicatas são ignoradas)"""
+        self._last_rejected = 0
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            return await self._copy(raw.driver_connection, rows)
+
+    async def _copy(self, pg: asyncpg.Connection, rows: List[Tuple]) -> int:
+        try:
+            async with pg.transaction():
+                await pg.execute(
+                    "CREATE TEMP TABLE cdr_ingest_staging (LIKE cdr INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                await pg.copy_records_to_table("cdr_ingest_staging", records=rows, columns=COPY_COLUMNS)
+                return await pg.fetchval(_INSERT_FROM_STAGING)
+        except _DATA_ERRORS as e:
+            if len(rows) == 1:
+                logger.warning(f"CDR rejeitado ({rows[0][COPY_COLUMNS.index('uniqueid')]}): {e}")
+                self._last_rejected += 1
+                self.stats["rejected"] += 1
+                metrics.incr("cdr.ingest.rejected")
+                return 0
+            middle = len(rows) // 2
+            return await self._copy(pg, rows[:middle]) + await self._copy(pg, rows[middle:])
+
+    # ==========================================
+    # STATUS
+    # ==========================================
+    def rows_per_second(self, window: float = 60.0) -> float:
+        now = time.monotonic()
+        while self._flushes and now - self._flushes[0][0] > window:
+            self._flushes.popleft()
+        if not self._flushes:
+            return 0.0
+        span = max(now - self._flushes[0][0], 1.0)
+        return sum(count for _, count in self._flushes) / span
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "source": self.source or None,
+            "running": self._running,
+            "batch_size": self.batch_size,
+            "flush_seconds": self.flush_seconds,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "rows_per_second": round(self.rows_per_second(), 1),
+            **self.stats,
+        }
+
+
+cdr_ingest_service = CDRIngestService()
@@ -0,0 +1,208 @@
+import asyncio
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.services.cdr_archive import cdr_archive
+
+RETENTION_ACTIONS = ("archive", "drop", "detach", "columnar")
+ARCHIVE_SCHEMA = "cdr_archive"
+
+_PARTITION_NAME = re.compile(r"^cdr_\d{4}_\d{2}$")
+_PARTITION_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+_LIST_PARTITIONS = text("""
+    SELECT c.relname AS name,
+           pg_get_expr(c.relpartbound, c.oid) AS bounds,
+           c.reltuples::bigint AS estimated_rows,
+           pg_total_relation_size(c.oid) AS size_bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'cdr'::regclass
+    ORDER BY c.relname
+""")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def cdr_period(
+    start_date: Optional[str],
+    end_date: Optional[str],
+    default_days: int = settings.CDR_REPORT_DEFAULT_DAYS,
+) -> Tuple[datetime, datetime]:
+    """Intervalo [início, fim) de calldate para consultas de CDR.
+
+    Sempre retorna os dois limites, para que o PostgreSQL descarte as
+    partições fora do período: sem data final, vale até amanhã; sem data
+    inicial, os últimos default_days dias antes do fim.
+    """
+    if end_date:
+        end = datetime.fromisoformat(end_date) + timedelta(days=1)
+    else:
+        end = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.min.time())
+    if start_date:
+        start = datetime.fromisoformat(start_date)
+    else:
+        start = end - timedelta(days=default_days)
+    return start, end
+
+
+class CDRPartitionManager:
+    """Manutenção das partições mensais da tabela cdr.
+
+    Cria com antecedência as partições dos próximos meses (evitando que os
+    CDRs caiam na partição default) e aplica a retenção removendo partições
+    inteiras: DETACH seguido de DROP, ou de mudança para o schema
+    cdr_archive, no lugar de DELETEs em massa. Na ação columnar, o mês é
+    gravado antes no arquivo colunar (ver CDRArchive) e a partição removida.
+    """
+
+    def __init__(
+        self,
+        months_ahead: int = settings.CDR_PARTITION_MONTHS_AHEAD,
+        retention_months: int = settings.CDR_RETENTION_MONTHS,
+        retention_action: str = settings.CDR_RETENTION_ACTION,
+        interval_hours: float = settings.CDR_PARTITION_MAINTENANCE_HOURS,
+    ):
+        if retention_action not in RETENTION_ACTIONS:
+            logger.warning(f"CDR_RETENTION_ACTION invalida: {retention_action}, usando 'archive'")
+            retention_action = "archive"
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.retention_action = retention_action
+        self.interval = interval_hours * 3600
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ==========================================
+    # PARTIÇÕES
+    # ==========================================
+    async def list_partitions(self, db: AsyncSession) -> List[Dict[str, Any]]:
+        partitions = []
+        for row in await db.execute(_LIST_PARTITIONS):
+            bounds = _PARTITION_BOUNDS.search(row.bounds or "")
+            partitions.append({
+                "name": row.name,
+                "default": bounds is None,
+                "from": datetime.fromisoformat(bounds.group(1)) if bounds else None,
+                "to": datetime.fromisoformat(bounds.group(2)) if bounds else None,
+                "estimated_rows": max(row.estimated_rows or 0, 0),
+                "size_bytes": row.size_bytes,
+            })
+        return partitions
+
+    async def oldest_month(self, db: AsyncSession) -> Optional[datetime]:
+        """Início da partição mensal mais antiga ainda anexada (None se não houver).
+
+        A retenção remove sempre os meses mais antigos, então tudo antes
+        dessa data já saiu da tabela cdr.
+        """
+        starts = [
+            partition["from"] for partition in await self.list_partitions(db)
+            if not partition["default"] and _PARTITION_NAME.match(partition["name"])
+        ]
+        return min(starts, default=None)
+
+    async def ensure_partitions(self, db: AsyncSession, today: Optional[date] = None) -> List[str]:
+        """Cria as partições do mês atual e dos próximos months_ahead meses"""
+        existing = {p["name"] for p in await self.list_partitions(db)}
+        current = month_start(today or datetime.utcnow().date())
+        created = []
+        for offset in range(self.months_ahead + 1):
+            month = add_months(current, offset)
+            name = f"cdr_{month:%Y_%m}"
+            if name in existing:
+                continue
+            try:
+                await db.execute(text("SELECT cdr_create_partition(:month)"), {"month": month})
+                await db.commit()
+                created.append(name)
+                logger.info(f"Partição {name} criada")
+            except Exception as e:
+                # Ex.: a partição default já tem CDRs desse mês
+                await db.rollback()
+                logger.error(f"Erro ao criar partição {name}: {e}")
+        return created
+
+    async def apply_retention(self, db: AsyncSession, today: Optional[date] = None) -> List[str]:
+        """Remove as partições inteiramente anteriores à janela de retenção"""
+        if self.retention_months <= 0:
+            return []
+        cutoff = add_months(month_start(today or datetime.utcnow().date()), -self.retention_months)
+        removed = []
+        for partition in await self.list_partitions(db):
+            name = partition["name"]
+            if partition["default"] or not _PARTITION_NAME.match(name) or partition["to"].date() > cutoff:
+                continue
+            month = partition["from"].date()
+            try:
+                if self.retention_action == "columnar":
+                    # Grava o mês a partir da partição ainda anexada; em erro nada é removido
+                    await cdr_archive.archive_month(month)
+                # Tudo na mesma transação: em erro a partição continua anexada
+                await db.execute(text(f'ALTER TABLE cdr DETACH PARTITION "{name}"'))
+                if self.retention_action in ("drop", "columnar"):
+                    await db.execute(text(f'DROP TABLE "{name}"'))
+                elif self.retention_action == "archive":
+                    await db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                    await db.execute(text(f'ALTER TABLE "{name}" SET SCHEMA {ARCHIVE_SCHEMA}'))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Erro ao remover partição {name}: {e}")
+                continue
+            if self.retention_action == "columnar":
+                cdr_archive.mark_dropped(month)
+            removed.append(name)
+            metrics.incr("cdr.partitions.retired")
+            logger.info(f"Partição {name} removida da tabela cdr ({self.retention_action})")
+        return removed
+
+    async def run_maintenance(self) -> Dict[str, Any]:
+        async with self._lock:
+            async with async_session() as db:
+                created = await self.ensure_partitions(db)
+                retired = await self.apply_retention(db)
+            self.last_run = {"at": datetime.utcnow(), "created": created, "retired": retired}
+            return self.last_run
+
+    # ==========================================
+    # CICLO DE VIDA
+    # ==========================================
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_maintenance()
+            except Exception as e:
+                logger.error(f"Erro na manutenção das partições de CDR: {e}")
+            await asyncio.sleep(self.interval)
+
+
+cdr_partition_manager = CDRPartitionManager()
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.services.cdr_partitions import cdr_partition_manager
+
+PREFIX_LENGTH = 4
+
+_ZERO_UUID = "'00000000-0000-0000-0000-000000000000'::uuid"
+_ROLLUP_KEY = (
+    f"(hour, COALESCE(customer_id, {_ZERO_UUID}), COALESCE(gateway_id, {_ZERO_UUID}), prefix, disposition)"
+)
+_ROLLUP_VALUES = ("calls", "billsec", "cost", "price")
+
+
+def rollup_insert(source: str, where: str = "", accumulate: bool = True) -> str:
+    """INSERT em cdr_hourly agregando as linhas de source (tabela ou CTE com as colunas de cdr).
+
+    Com accumulate, os valores são somados aos agregados existentes (ingestão
+    incremental); sem, os substituem (recálculo de período).
+    """
+    if accumulate:
+        update = ", ".join(f"{column} = cdr_hourly.{column} + EXCLUDED.{column}" for column in _ROLLUP_VALUES)
+    else:
+        update = ", ".join(f"{column} = EXCLUDED.{column}" for column in _ROLLUP_VALUES)
+    return f"""
+        INSERT INTO cdr_hourly (hour, customer_id, gateway_id, prefix, disposition, calls, billsec, cost, price)
+        SELECT date_trunc('hour', calldate), customer_id, gateway_id,
+               COALESCE(substr(dst, 1, {PREFIX_LENGTH}), ''), COALESCE(disposition, ''),
+               count(*), COALESCE(sum(billsec), 0), COALESCE(sum(cost), 0), COALESCE(sum(price), 0)
+        FROM {source} {where}
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT {_ROLLUP_KEY} DO UPDATE SET {update}
+    """
+
+
+_DELETE_RANGE = text("DELETE FROM cdr_hourly WHERE hour >= :start AND hour < :end")
+_REBUILD_RANGE = text(rollup_insert("cdr", "WHERE calldate >= :start AND calldate < :end", accumulate=False))
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(value: datetime) -> datetime:
+    floor = floor_hour(value)
+    return floor if floor == value else floor + timedelta(hours=1)
+
+
+class CDRRollupService:
+    """Recálculo dos agregados horários de CDR (tabela cdr_hourly).
+
+    A ingestão atualiza os agregados na mesma transação em que grava os CDRs;
+    alterações feitas depois (retarifação, atribuição em lote, correções
+    manuais) pedem o recálculo do período afetado. Os pedidos entram numa
+    fila atendida por uma única tarefa, um dia por transação.
+
+    O recálculo não desce abaixo da partição mensal mais antiga: os meses
+    já removidos pela retenção não têm mais linhas em cdr, e apagar seus
+    agregados os perderia de vez.
+    """
+
+    def __init__(self):
+        self._pending: List[Tuple[datetime, datetime]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.state: Dict[str, Any] = {"status": "idle"}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def rebuild(self, date_from: datetime, date_to: datetime):
+        """Agenda o recálculo de [date_from, date_to), alinhado a horas cheias"""
+        self._pending.append((floor_hour(date_from), ceil_hour(date_to)))
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self._pending.clear()
+        self._task.cancel()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.state, "pending": [{"date_from": s, "date_to": e} for s, e in self._pending]}
+
+    async def _run(self):
+        while self._pending:
+            date_from, date_to = self._pending.pop(0)
+            self.state = {
+                "status": "running",
+                "date_from": date_from,
+                "date_to": date_to,
+                "hours": 0,
+                "rows": 0,
+                "error": None,
+                "started_at": datetime.utcnow(),
+                "finished_at": None,
+            }
+            try:
+                await self._process(date_from, date_to)
+                self.state["status"] = "completed"
+            except asyncio.CancelledError:
+                self.state["status"] = "cancelled"
+                raise
+            except Exception as e:
+                logger.error(f"Erro no recálculo dos agregados de CDR: {e}")
+                self.state["status"] = "failed"
+                self.state["error"] = str(e)
+            finally:
+                self.state["finished_at"] = datetime.utcnow()
+            logger.info(
+                f"Agregados de CDR {date_from} a {date_to}: {self.state['status']}, "
+                f"{self.state['rows']} linhas"
+            )
+
+    async def _process(self, date_from: datetime, date_to: datetime):
+        async with async_session() as db:
+            oldest = await cdr_partition_manager.oldest_month(db)
+            if oldest is not None and date_from < oldest:
+                logger.warning(
+                    f"Recálculo dos agregados limitado a partir de {oldest}: "
+                    f"meses anteriores já saíram da tabela cdr"
+                )
+                date_from = oldest
+                self.state["date_from"] = date_from
+            start = date_from
+            while start < date_to:
+                end = min(start + timedelta(days=1), date_to)
+                chunk_start = time.perf_counter()
+                await db.execute(_DELETE_RANGE, {"start": start, "end": end})
+                result = await db.execute(_REBUILD_RANGE, {"start": start, "end": end})
+                await db.commit()
+                self.state["hours"] += int((end - start).total_seconds() // 3600)
+                self.state["rows"] += result.rowcount
+                metrics.observe("cdr.rollups.rebuild", time.perf_counter() - chunk_start)
+                start = end
+
+
+cdr_rollups = CDRRollupService()
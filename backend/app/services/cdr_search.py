@@ -0,0 +1,56 @@
+from typing import Optional, Sequence, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.sql.elements import ColumnElement
+from app.models import CDR
+
+SEARCH_MODES = ("auto", "contains", "prefix", "suffix", "exact")
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def resolve_mode(term: str, mode: str = "auto") -> Tuple[str, str]:
+    """(modo, termo) efetivos da busca.
+
+    No modo auto, '*' no fim ('5511*') busca por prefixo e no início
+    ('*4321') por sufixo; sem '*', por trecho em qualquer posição.
+    """
+    if mode != "auto":
+        return mode, term.strip("*")
+    if term.endswith("*") and not term.startswith("*"):
+        return "prefix", term.rstrip("*")
+    if term.startswith("*") and not term.endswith("*"):
+        return "suffix", term.lstrip("*")
+    return "contains", term.strip("*")
+
+
+def search_predicate(columns: Sequence[ColumnElement], term: str, mode: str) -> ColumnElement:
+    """Predicado de busca (já resolvido por resolve_mode) sobre as colunas informadas"""
+    if mode == "exact":
+        return or_(*(c == term for c in columns))
+    if mode == "prefix":
+        pattern = _escape_like(term) + "%"
+        return or_(*(c.like(pattern) for c in columns))
+    if mode == "suffix":
+        pattern = _escape_like(term[::-1]) + "%"
+        return or_(*(func.reverse(c).like(pattern) for c in columns))
+    pattern = "%" + _escape_like(term) + "%"
+    return or_(*(c.ilike(pattern) for c in columns))
+
+
+def cdr_search_filter(search: Optional[str], mode: str = "auto") -> Optional[ColumnElement]:
+    """Filtro de busca em src/dst que usa os índices da migration 014.
+
+    exact e prefix usam o B-tree text_pattern_ops, suffix o índice em
+    reverse(src/dst) e contains o GIN pg_trgm (ILIKE, termos de 3+
+    caracteres).
+    """
+    term = (search or "").strip()
+    if not term:
+        return None
+    mode, term = resolve_mode(term, mode)
+    if not term:
+        return None
+    return search_predicate((CDR.src, CDR.dst), term, mode)
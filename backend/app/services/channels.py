@@ -0,0 +1,220 @@
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Set
+from loguru import logger
+from app.services.ami import AMIManager, ami_manager
+
+
+@dataclass
+class Channel:
+    channel: str
+    uniqueid: str
+    linkedid: str = ""
+    context: str = ""
+    extension: str = ""
+    priority: str = ""
+    state: str = ""
+    application: str = ""
+    data: str = ""
+    callerid_num: str = ""
+    connected_num: str = ""
+    bridge_id: str = ""
+    peer: str = ""
+    created_at: float = 0.0
+    answered_at: Optional[float] = None
+
+    @property
+    def duration(self) -> int:
+        return int(time.time() - self.created_at) if self.created_at else 0
+
+    def to_dict(self):
+        data = asdict(self)
+        data["duration"] = self.duration
+        return data
+
+
+def _parse_duration(value: str) -> int:
+    """Converte 'HH:MM:SS' (CoreShowChannel) em segundos"""
+    try:
+        hours, minutes, seconds = (int(part) for part in value.split(":"))
+        return hours * 3600 + minutes * 60 + seconds
+    except (ValueError, AttributeError):
+        return 0
+
+
+class ChannelTable:
+    """Tabela em memória dos canais ativos no Asterisk.
+
+    Mantida pelos eventos AMI (Newchannel, Newstate, Newexten, DialBegin,
+    BridgeEnter/BridgeLeave, Rename, Hangup) e semeada com CoreShowChannels a
+    cada (re)conexão, substituindo o fork de 'core show channels concise' a
+    cada consulta.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, Channel] = {}
+        self.seeded = False
+        self._seeding = False
+        self._hung_up_while_seeding: Set[str] = set()
+        self._created_while_seeding: Set[str] = set()
+        self._manager: Optional[AMIManager] = None
+        self._handlers = {
+            "Newchannel": self._on_newchannel,
+            "Newstate": self._on_newstate,
+            "Newexten": self._on_newexten,
+            "DialBegin": self._on_dial_begin,
+            "BridgeEnter": self._on_bridge_enter,
+            "BridgeLeave": self._on_bridge_leave,
+            "Rename": self._on_rename,
+            "Hangup": self._on_hangup,
+        }
+
+    def install(self, manager: AMIManager = ami_manager):
+        """Conecta a tabela aos eventos e às (re)conexões da sessão AMI"""
+        self._manager = manager
+        manager.add_event_handler(self.handle_event)
+        manager.add_connect_handler(self.seed)
+
+    @property
+    def ready(self) -> bool:
+        return self.seeded and self._manager is not None and self._manager.connected
+
+    # ==========================================
+    # SEED (CoreShowChannels)
+    # ==========================================
+    async def seed(self):
+        """Recarrega a tabela a partir de CoreShowChannels"""
+        self._seeding = True
+        self.seeded = False
+        self._hung_up_while_seeding.clear()
+        self._created_while_seeding.clear()
+        try:
+            events = await self._manager.send_action_list("CoreShowChannels")
+        finally:
+            self._seeding = False
+
+        now = time.time()
+        channels = {}
+        for event in events:
+            uniqueid = event.get("Uniqueid", "")
+            if not uniqueid or uniqueid in self._hung_up_while_seeding:
+                continue
+            channel = Channel(
+                channel=event.get("Channel", ""),
+                uniqueid=uniqueid,
+                linkedid=event.get("Linkedid", ""),
+                context=event.get("Context", ""),
+                extension=event.get("Exten", ""),
+                priority=event.get("Priority", ""),
+                state=event.get("ChannelStateDesc", ""),
+                application=event.get("Application", ""),
+                data=event.get("ApplicationData", ""),
+                callerid_num=event.get("CallerIDNum", ""),
+                connected_num=event.get("ConnectedLineNum", ""),
+                bridge_id=event.get("BridgeId", ""),
+                created_at=now - _parse_duration(event.get("Duration", "")),
+            )
+            if channel.state == "Up":
+                channel.answered_at = channel.created_at
+            channels[uniqueid] = channel
+
+        # Canais criados durante o seed já chegaram por Newchannel
+        for uniqueid in self._created_while_seeding:
+            if uniqueid in self.channels:
+                channels.setdefault(uniqueid, self.channels[uniqueid])
+
+        self.channels = channels
+        self._hung_up_while_seeding.clear()
+        self._created_while_seeding.clear()
+        self.seeded = True
+        logger.info(f"Tabela de canais carregada: {len(channels)} canais ativos")
+
+    # ==========================================
+    # EVENTOS
+    # ==========================================
+    def handle_event(self, event: Dict[str, str]):
+        handler = self._handlers.get(event.get("Event", ""))
+        if handler:
+            handler(event)
+
+    def _get(self, event: Dict[str, str], key: str = "Uniqueid") -> Optional[Channel]:
+        return self.channels.get(event.get(key, ""))
+
+    def _on_newchannel(self, event: Dict[str, str]):
+        uniqueid = event.get("Uniqueid", "")
+        if not uniqueid:
+            return
+        self.channels[uniqueid] = Channel(
+            channel=event.get("Channel", ""),
+            uniqueid=uniqueid,
+            linkedid=event.get("Linkedid", ""),
+            context=event.get("Context", ""),
+            extension=event.get("Exten", ""),
+            priority=event.get("Priority", ""),
+            state=event.get("ChannelStateDesc", ""),
+            callerid_num=event.get("CallerIDNum", ""),
+            connected_num=event.get("ConnectedLineNum", ""),
+            created_at=time.time(),
+        )
+        if self._seeding:
+            self._created_while_seeding.add(uniqueid)
+
+    def _on_newstate(self, event: Dict[str, str]):
+        channel = self._get(event)
+        if not channel:
+            return
+        channel.state = event.get("ChannelStateDesc", channel.state)
+        channel.connected_num = event.get("ConnectedLineNum", channel.connected_num)
+        if channel.state == "Up" and channel.answered_at is None:
+            channel.answered_at = time.time()
+
+    def _on_newexten(self, event: Dict[str, str]):
+        channel = self._get(event)
+        if not channel:
+            return
+        channel.context = event.get("Context", channel.context)
+        channel.extension = event.get("Exten", channel.extension)
+        channel.priority = event.get("Priority", channel.priority)
+        channel.application = event.get("Application", channel.application)
+        channel.data = event.get("AppData", channel.data)
+
+    def _on_dial_begin(self, event: Dict[str, str]):
+        caller = self._get(event)
+        callee = self._get(event, "DestUniqueid")
+        if caller and callee:
+            caller.peer = callee.channel
+            callee.peer = caller.channel
+
+    def _on_bridge_enter(self, event: Dict[str, str]):
+        channel = self._get(event)
+        if channel:
+            channel.bridge_id = event.get("BridgeUniqueid", "")
+
+    def _on_bridge_leave(self, event: Dict[str, str]):
+        channel = self._get(event)
+        if channel:
+            channel.bridge_id = ""
+
+    def _on_rename(self, event: Dict[str, str]):
+        channel = self._get(event)
+        if channel:
+            channel.channel = event.get("Newname", channel.channel)
+
+    def _on_hangup(self, event: Dict[str, str]):
+        uniqueid = event.get("Uniqueid", "")
+        self.channels.pop(uniqueid, None)
+        if self._seeding:
+            self._hung_up_while_seeding.add(uniqueid)
+
+    # ==========================================
+    # CONSULTA
+    # ==========================================
+    def list(self) -> List[Channel]:
+        """Retorna os canais ativos (vazio se a sessão AMI não está pronta)"""
+        if not self.ready:
+            return []
+        return list(self.channels.values())
+
+
+# Instância global
+channel_table = ChannelTable()
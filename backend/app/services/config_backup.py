@@ -0,0 +1,208 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Backups antigos (planos): <arquivo>.<YYYYmmdd_HHMMSS>.bak
+_LEGACY_BACKUP = re.compile(r"^(?P<key>.+)\.(?P<ts>\d{8}_\d{6})\.bak$")
+# Backups atuais: <chave>/<YYYYmmdd_HHMMSS_ffffff>.gz
+_BACKUP_ID = re.compile(r"^\d{8}_\d{6}_\d{6}$")
+_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S_%f"
+KEY_SEPARATOR = "+"
+
+
+class BackupError(Exception):
+    """Backup inexistente ou chave inválida"""
+
+
+class ConfigBackupStore:
+    """Backups comprimidos (gzip) dos arquivos de configuração do Asterisk.
+
+    Cada arquivo tem um subdiretório próprio em backup_path, nomeado pela
+    chave (caminho relativo ao diretório do Asterisk com '/' trocado por
+    '+', que não aparece nos nomes gerados), com no máximo max_per_file
+    backups e nenhum mais antigo que max_age_days.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        backup_path: str,
+        max_per_file: int = settings.ASTERISK_BACKUP_MAX_PER_FILE,
+        max_age_days: int = settings.ASTERISK_BACKUP_MAX_AGE_DAYS,
+    ):
+        self.config_path = config_path
+        self.backup_path = backup_path
+        self.max_per_file = max_per_file
+        self.max_age_days = max_age_days
+
+    # ==========================================
+    # CHAVES
+    # ==========================================
+    def key_for(self, filepath: str) -> str:
+        return os.path.relpath(filepath, self.config_path).replace(os.sep, KEY_SEPARATOR)
+
+    def path_for(self, key: str) -> str:
+        """Caminho do arquivo de configuração correspondente a uma chave"""
+        filepath = os.path.normpath(os.path.join(self.config_path, key.replace(KEY_SEPARATOR, os.sep)))
+        if os.path.commonpath([filepath, self.config_path]) != os.path.normpath(self.config_path) \
+                or not filepath.endswith(".conf"):
+            raise BackupError(f"Chave de backup inválida: {key}")
+        return filepath
+
+    def _key_dir(self, key: str) -> str:
+        if os.sep in key or key in ("", ".", ".."):
+            raise BackupError(f"Chave de backup inválida: {key}")
+        return os.path.join(self.backup_path, key)
+
+    # ==========================================
+    # BACKUP
+    # ==========================================
+    def backup(self, filepath: str) -> Optional[str]:
+        """Grava uma cópia comprimida do arquivo atual e aplica a retenção.
+
+        Retorna o id do backup (None se o arquivo não existe ou houve erro).
+        """
+        if not os.path.exists(filepath):
+            return None
+
+        key = self.key_for(filepath)
+        directory = self._key_dir(key)
+        backup_id = datetime.now().strftime(_TIMESTAMP_FORMAT)
+        start = time.perf_counter()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+            try:
+                with open(filepath, 'rb') as src, os.fdopen(fd, 'wb') as raw:
+                    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as dst:
+                        shutil.copyfileobj(src, dst)
+                    compressed = raw.tell()
+                os.replace(tmp_path, os.path.join(directory, f"{backup_id}.gz"))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Erro ao criar backup de {filepath}: {e}")
+            metrics.incr("asterisk.backup.failed")
+            return None
+
+        pruned = self.prune(key)
+        metrics.observe("asterisk.backup.duration", time.perf_counter() - start)
+        metrics.incr("asterisk.backup.count")
+        metrics.incr("asterisk.backup.bytes", os.path.getsize(filepath))
+        metrics.incr("asterisk.backup.compressed_bytes", compressed)
+        metrics.incr("asterisk.backup.pruned", pruned)
+        logger.debug(f"Backup criado: {key}/{backup_id}.gz ({compressed} bytes)")
+        return backup_id
+
+    def prune(self, key: str) -> int:
+        """Remove backups além do limite de quantidade ou idade de uma chave"""
+        directory = self._key_dir(key)
+        try:
+            backup_ids = sorted(
+                (name[:-3] for name in os.listdir(directory) if name.endswith(".gz")),
+                reverse=True,
+            )
+        except FileNotFoundError:
+            return 0
+
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days)).strftime(_TIMESTAMP_FORMAT)
+        removed = 0
+        for position, backup_id in enumerate(backup_ids):
+            if position >= self.max_per_file or backup_id < cutoff:
+                os.unlink(os.path.join(directory, f"{backup_id}.gz"))
+                removed += 1
+        return removed
+
+    def prune_legacy(self) -> int:
+        """Aplica a mesma retenção aos backups planos '.bak' do formato antigo"""
+        groups: Dict[str, List[str]] = {}
+        with os.scandir(self.backup_path) as entries:
+            for entry in entries:
+                match = _LEGACY_BACKUP.match(entry.name)
+                if match and entry.is_file():
+                    groups.setdefault(match.group("key"), []).append(entry.name)
+
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days)).strftime("%Y%m%d_%H%M%S")
+        removed = 0
+        for names in groups.values():
+            # O timestamp no nome ordena cronologicamente
+            names.sort(key=lambda name: _LEGACY_BACKUP.match(name).group("ts"), reverse=True)
+            for position, name in enumerate(names):
+                if position >= self.max_per_file or _LEGACY_BACKUP.match(name).group("ts") < cutoff:
+                    os.unlink(os.path.join(self.backup_path, name))
+                    removed += 1
+        if removed:
+            logger.info(f"Backups antigos removidos: {removed}")
+        metrics.incr("asterisk.backup.pruned", removed)
+        return removed
+
+    def prune_all(self) -> int:
+        """Aplica a retenção a todos os arquivos (inclusive backups do formato antigo)"""
+        removed = 0
+        try:
+            removed += self.prune_legacy()
+            with os.scandir(self.backup_path) as entries:
+                keys = [entry.name for entry in entries if entry.is_dir()]
+            for key in keys:
+                removed += self.prune(key)
+        except Exception as e:
+            logger.error(f"Erro ao aplicar retenção de backups: {e}")
+        return removed
+
+    # ==========================================
+    # CONSULTA
+    # ==========================================
+    def list_files(self) -> List[Dict[str, Any]]:
+        """Arquivos com backups (chave, arquivo, quantidade e backup mais recente)"""
+        files = []
+        with os.scandir(self.backup_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                backup_ids = sorted(name[:-3] for name in os.listdir(entry.path) if name.endswith(".gz"))
+                if not backup_ids:
+                    continue
+                files.append({
+                    "key": entry.name,
+                    "file": entry.name.replace(KEY_SEPARATOR, "/"),
+                    "count": len(backup_ids),
+                    "latest": backup_ids[-1],
+                })
+        return sorted(files, key=lambda f: f["key"])
+
+    def list_backups(self, key: str) -> List[Dict[str, Any]]:
+        directory = self._key_dir(key)
+        if not os.path.isdir(directory):
+            raise BackupError(f"Nenhum backup para {key}")
+
+        backups = []
+        for name in sorted(os.listdir(directory), reverse=True):
+            if not name.endswith(".gz") or not _BACKUP_ID.match(name[:-3]):
+                continue
+            backups.append({
+                "id": name[:-3],
+                "created_at": datetime.strptime(name[:-3], _TIMESTAMP_FORMAT),
+                "compressed_size": os.path.getsize(os.path.join(directory, name)),
+            })
+        return backups
+
+    def read(self, key: str, backup_id: str) -> bytes:
+        """Conteúdo descomprimido de um backup"""
+        if not _BACKUP_ID.match(backup_id):
+            raise BackupError(f"Backup inválido: {backup_id}")
+        path = os.path.join(self._key_dir(key), f"{backup_id}.gz")
+        try:
+            with gzip.open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BackupError(f"Backup {backup_id} não encontrado para {key}")
@@ -0,0 +1,158 @@
+import hashlib
+import re
+from datetime import datetime
+from typing import Any, BinaryIO, Iterable, List, Optional, Tuple
+
+# Cabeçalhos variáveis, fora do hash de conteúdo
+_VOLATILE_HEADER = re.compile(r"^; (?:Data|Hash): [^\n]*\n", re.MULTILINE)
+_HASH_HEADER = re.compile(r"^; Hash: (\w+)$", re.MULTILINE)
+_HASH_HEADER_LINES = 10
+_HASH_PLACEHOLDER = "0" * 64
+
+
+def content_hash(config: str) -> str:
+    """Hash SHA-256 do conteúdo gerado, ignorando as linhas '; Data:' e '; Hash:'"""
+    return hashlib.sha256(_VOLATILE_HEADER.sub("", config).encode()).hexdigest()
+
+
+def read_config_hash(filepath: str) -> Optional[str]:
+    """Lê o hash gravado no cabeçalho de um arquivo gerado (None se ausente)"""
+    try:
+        with open(filepath, 'r') as f:
+            header = "".join(f.readline() for _ in range(_HASH_HEADER_LINES))
+    except FileNotFoundError:
+        return None
+    match = _HASH_HEADER.search(header)
+    return match.group(1) if match else None
+
+
+# ==========================================
+# BLOCOS
+# ==========================================
+def render_header(title: str) -> str:
+    """Cabeçalho padrão dos arquivos gerados pelo painel"""
+    return (
+        "; =============================================\n"
+        f"; {title} - Gerado automaticamente pelo Painel\n"
+        f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        "; NAO EDITE MANUALMENTE - Use o painel web\n"
+        "; =============================================\n\n"
+    )
+
+
+def render_section(name: str, options: Iterable[Tuple[str, Any]]) -> str:
+    """Gera uma seção '[name]' com as opções informadas (valores None são omitidos)"""
+    body = "".join([f"{key}={value}\n" for key, value in options if value is not None])
+    return f"[{name}]\n{body}\n"
+
+
+def render_trunk(
+    comment: str,
+    name: str,
+    ip: str,
+    port: Any,
+    codecs: str,
+    context: str,
+    auth_type: str,
+    username: Optional[str],
+    password: Optional[str],
+) -> str:
+    """Seções PJSIP (endpoint, aor, identify e auth) de um tronco por IP.
+
+    Compartilhado por gateways, clientes trunk e provedores.
+    """
+    with_auth = auth_type in ('credentials', 'both') and username
+    sections = [
+        f"; === {comment} ===\n",
+        render_section(name, (
+            ("type", "endpoint"),
+            ("context", context),
+            ("disallow", "all"),
+            ("allow", codecs),
+            ("aors", name),
+            ("auth", name if with_auth else None),
+        )),
+        f"[{name}]\ntype=aor\ncontact=sip:{ip}:{port}\n\n"
+        f"[{name}]\ntype=identify\nendpoint={name}\nmatch={ip}\n\n",
+    ]
+    if with_auth and password:
+        sections.append(render_section(name, (
+            ("type", "auth"),
+            ("auth_type", "userpass"),
+            ("username", username),
+            ("password", password),
+        )))
+    return "".join(sections)
+
+
+# ==========================================
+# ESCRITA EM STREAMING
+# ==========================================
+class ConfigWriter:
+    """Escreve a configuração em blocos num arquivo binário.
+
+    Os blocos são agrupados em lotes de ~flush_size bytes antes de codificar,
+    atualizar o hash e gravar. O hash do conteúdo é calculado à medida que os
+    lotes são escritos; a linha '; Hash:' do cabeçalho é gravada com um
+    marcador de tamanho fixo e preenchida em finish(), sem manter o texto
+    completo em memória.
+    """
+
+    def __init__(self, f: BinaryIO, flush_size: int = 64 * 1024):
+        self._file = f
+        self._flush_size = flush_size
+        self._hash = hashlib.sha256()
+        self._hash_offset: Optional[int] = None
+        self._offset = 0
+        self._pending: List[str] = []
+        self._pending_size = 0
+
+    def _flush(self):
+        if not self._pending:
+            return
+        data = "".join(self._pending).encode()
+        self._pending.clear()
+        self._pending_size = 0
+        self._hash.update(data)
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _put_unhashed(self, chunk: str):
+        self._flush()
+        data = chunk.encode()
+        self._file.write(data)
+        self._offset += len(data)
+
+    def write(self, chunk: str):
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+        if self._pending_size >= self._flush_size:
+            self._flush()
+
+    def writelines(self, chunks: Iterable[str]):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def write_header(self, title: str):
+        """Cabeçalho padrão com a linha '; Hash:' logo após '; Data:'"""
+        for line in render_header(title).splitlines(keepends=True):
+            if line.startswith("; Data: "):
+                self._put_unhashed(line)
+                self.write_hash_placeholder()
+            else:
+                self.write(line)
+
+    def write_hash_placeholder(self):
+        self._put_unhashed("; Hash: ")
+        self._hash_offset = self._offset
+        self._put_unhashed(_HASH_PLACEHOLDER + "\n")
+
+    def finish(self) -> str:
+        """Grava o lote pendente, preenche o hash no cabeçalho e retorna o hash do conteúdo"""
+        self._flush()
+        digest = self._hash.hexdigest()
+        if self._hash_offset is not None:
+            self._file.seek(self._hash_offset)
+            self._file.write(digest.encode())
+            self._file.seek(self._offset)
+        return digest
@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from app.core.metrics import metrics
+
+
+class SnapshotError(Exception):
+    """Snapshot inexistente ou objeto ausente no armazenamento"""
+
+
+class ConfigSnapshotStore:
+    """Snapshots completos dos arquivos gerenciados, com conteúdo deduplicado por hash.
+
+    Layout em snapshot_path:
+      objects/ab/<sha256>.gz   conteúdo de arquivos e árvores (um objeto por conteúdo)
+      index.jsonl              uma linha por snapshot (append-only)
+
+    Cada diretório de fragmentos vira um objeto "árvore" (JSON nome -> hash);
+    diretórios sem alteração reaproveitam a mesma árvore, então um snapshot
+    custa apenas os objetos novos e uma linha no índice.
+    """
+
+    def __init__(self, config_path: str, snapshot_path: str):
+        self.config_path = config_path
+        self.snapshot_path = snapshot_path
+        self.objects_path = os.path.join(snapshot_path, "objects")
+        self.index_file = os.path.join(snapshot_path, "index.jsonl")
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Dict[str, Any]]] = None
+        # (st_ino, st_mtime_ns, st_size) -> hash, por caminho, para não reler arquivos inalterados
+        self._stat_cache: Dict[str, Tuple[Tuple[int, int, int], str]] = {}
+
+    # ==========================================
+    # OBJETOS
+    # ==========================================
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], f"{digest}.gz")
+
+    def _put_object(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=6, mtime=0))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        metrics.incr("asterisk.snapshot.objects_written")
+        return digest
+
+    def get_object(self, digest: str) -> bytes:
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                return gzip.decompress(f.read())
+        except FileNotFoundError:
+            raise SnapshotError(f"Objeto {digest} ausente no armazenamento de snapshots")
+
+    def _file_object(self, path: str) -> str:
+        """Hash (e objeto) do conteúdo atual de um arquivo, evitando reler arquivos inalterados"""
+        stat = os.stat(path)
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._stat_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = self._put_object(f.read())
+        self._stat_cache[path] = (signature, digest)
+        return digest
+
+    def file_hash(self, path: str) -> Optional[str]:
+        """Hash do conteúdo atual de um arquivo (None se não existe)"""
+        try:
+            return self._file_object(path)
+        except FileNotFoundError:
+            return None
+
+    # ==========================================
+    # ÍNDICE
+    # ==========================================
+    def _load_entries(self) -> List[Dict[str, Any]]:
+        if self._entries is None:
+            entries = []
+            try:
+                with open(self.index_file, 'r') as f:
+                    for line in f:
+                        if line.strip():
+                            entries.append(json.loads(line))
+            except FileNotFoundError:
+                pass
+            self._entries = entries
+        return self._entries
+
+    def list(self, limit: int = 50, offset: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+        """Snapshots do mais recente para o mais antigo (total, página)"""
+        with self._lock:
+            entries = self._load_entries()
+            total = len(entries)
+            end = max(total - offset, 0)
+            start = max(end - limit, 0)
+            return total, list(reversed(entries[start:end]))
+
+    def get(self, snapshot_id: int) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._load_entries()
+        # Ids são sequenciais a partir de 1
+        if 1 <= snapshot_id <= len(entries) and entries[snapshot_id - 1]["id"] == snapshot_id:
+            return entries[snapshot_id - 1]
+        for entry in entries:
+            if entry["id"] == snapshot_id:
+                return entry
+        raise SnapshotError(f"Snapshot {snapshot_id} não encontrado")
+
+    # ==========================================
+    # REGISTRO
+    # ==========================================
+    def record(self, files: Iterable[str], directories: Iterable[str], reason: str) -> Dict[str, Any]:
+        """Registra um snapshot dos arquivos e diretórios de fragmentos informados.
+
+        Se o conteúdo é idêntico ao do último snapshot, nada é gravado e o
+        último snapshot é retornado.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            tree: Dict[str, str] = {}
+            count = 0
+            for path in files:
+                digest = self.file_hash(path)
+                if digest:
+                    tree[os.path.relpath(path, self.config_path)] = digest
+                    count += 1
+            for directory in directories:
+                listing = {}
+                if os.path.isdir(directory):
+                    for name in sorted(os.listdir(directory)):
+                        if name.endswith(".conf"):
+                            digest = self.file_hash(os.path.join(directory, name))
+                            if digest:
+                                listing[name] = digest
+                count += len(listing)
+                tree_data = json.dumps(listing, sort_keys=True, separators=(",", ":")).encode()
+                tree[os.path.relpath(directory, self.config_path) + "/"] = self._put_object(tree_data)
+
+            root = self._put_object(json.dumps(tree, sort_keys=True, separators=(",", ":")).encode())
+            entries = self._load_entries()
+            if entries and entries[-1]["root"] == root:
+                return entries[-1]
+
+            entry = {
+                "id": entries[-1]["id"] + 1 if entries else 1,
+                "created_at": datetime.utcnow().isoformat(),
+                "reason": reason,
+                "root": root,
+                "files": count,
+            }
+            os.makedirs(self.snapshot_path, exist_ok=True)
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            entries.append(entry)
+
+        metrics.observe("asterisk.snapshot.duration", time.perf_counter() - start)
+        metrics.incr("asterisk.snapshot.count")
+        logger.info(f"Snapshot {entry['id']} registrado ({reason}, {count} arquivos)")
+        return entry
+
+    def files(self, snapshot_id: int) -> Dict[str, str]:
+        """Arquivos de um snapshot (caminho relativo -> hash), com as árvores expandidas"""
+        entry = self.get(snapshot_id)
+        tree = json.loads(self.get_object(entry["root"]))
+        files = {}
+        for path, digest in tree.items():
+            if path.endswith("/"):
+                for name, file_digest in json.loads(self.get_object(digest)).items():
+                    files[path + name] = file_digest
+            else:
+                files[path] = digest
+        return files
+
+    def directories(self, snapshot_id: int) -> List[str]:
+        """Diretórios de fragmentos (relativos, terminados em '/') cobertos pelo snapshot"""
+        entry = self.get(snapshot_id)
+        return [path for path in json.loads(self.get_object(entry["root"])) if path.endswith("/")]
@@ -0,0 +1,189 @@
+from typing import Dict, FrozenSet, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+# Tokens de um padrão: conjunto de caracteres aceitos em uma posição, ou curinga final
+DIGITS = frozenset("0123456789")
+ANY = "ANY"      # '.' — um ou mais caracteres quaisquer (vira ANY + STAR)
+STAR = "STAR"    # '!' — zero ou mais caracteres quaisquer
+Token = Union[FrozenSet[str], str]
+
+_CLASSES = {
+    "X": DIGITS,
+    "Z": frozenset("123456789"),
+    "N": frozenset("23456789"),
+}
+
+# Limite de estados do autômato determinístico mantidos em cache
+MAX_DFA_STATES = 50000
+
+
+class PatternSyntaxError(ValueError):
+    """Padrão de dialplan inválido"""
+
+
+def parse_pattern(pattern: str) -> Tuple[Tuple[Token, ...], bool]:
+    """Converte um padrão do dialplan do Asterisk em tokens.
+
+    Retorna (tokens, is_pattern). Padrões começam com '_' e aceitam X, Z, N,
+    [1-5a], '.' e '!'; '-' é ignorado como no Asterisk. Sem '_' a extensão é
+    literal e só casa com o número exato.
+    """
+    if not pattern:
+        raise PatternSyntaxError("Padrão vazio")
+
+    if not pattern.startswith("_"):
+        return tuple(frozenset(c) for c in pattern), False
+
+    tokens: List[Token] = []
+    i = 1
+    while i < len(pattern):
+        c = pattern[i]
+        upper = c.upper()
+        if upper in _CLASSES:
+            tokens.append(_CLASSES[upper])
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end < 0:
+                raise PatternSyntaxError(f"'[' sem ']' em {pattern}")
+            tokens.append(_parse_set(pattern[i + 1:end], pattern))
+            i = end
+        elif c == ".":
+            # Curinga encerra o padrão: o restante é ignorado pelo Asterisk
+            tokens.extend((ANY, STAR))
+            break
+        elif c == "!":
+            tokens.append(STAR)
+            break
+        elif c != "-":
+            tokens.append(frozenset(c))
+        i += 1
+
+    if not tokens:
+        raise PatternSyntaxError(f"Padrão sem posições: {pattern}")
+    return tuple(tokens), True
+
+
+def _parse_set(body: str, pattern: str) -> FrozenSet[str]:
+    chars = set()
+    i = 0
+    while i < len(body):
+        if i + 2 < len(body) and body[i + 1] == "-":
+            start, end = body[i], body[i + 2]
+            if start > end:
+                raise PatternSyntaxError(f"Intervalo inválido {start}-{end} em {pattern}")
+            chars.update(chr(code) for code in range(ord(start), ord(end) + 1))
+            i += 3
+        else:
+            chars.add(body[i])
+            i += 1
+    if not chars:
+        raise PatternSyntaxError(f"Conjunto vazio em {pattern}")
+    return frozenset(chars)
+
+
+def specificity(tokens: Tuple[Token, ...], is_pattern: bool) -> Tuple:
+    """Chave de ordenação equivalente à do Asterisk (menor = mais específico).
+
+    Extensões literais vencem padrões; entre padrões, compara posição a
+    posição o tamanho do conjunto aceito (e o menor caractere dele), com
+    '.' e '!' depois de qualquer conjunto.
+    """
+    weights = []
+    for token in tokens:
+        if token is ANY:
+            weights.append(0x10000)
+        elif token is STAR:
+            weights.append(0x20000)
+        else:
+            weights.append((len(token) << 8) | ord(min(token)))
+    return (1 if is_pattern else 0, tuple(weights))
+
+
+class _State:
+    __slots__ = ("positions", "next", "accept")
+
+    def __init__(self, positions: FrozenSet[Tuple[int, int]], accept: Optional[int]):
+        self.positions = positions
+        self.next: Dict[str, "_State"] = {}
+        self.accept = accept
+
+
+class PatternAutomaton(Generic[T]):
+    """Autômato que resolve qual padrão de dialplan casa com um número.
+
+    Os padrões são compilados em um NFA (uma posição por token) que é
+    determinizado sob demanda: cada combinação de posições alcançada vira um
+    estado com transições por caractere em cache, então consultas repetidas
+    custam um acesso a dicionário por dígito. Havendo mais de um padrão
+    casando, vence o mais específico (regra do Asterisk) e, empatados, o que
+    veio primeiro em entries.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, T]]):
+        self.patterns: List[str] = []
+        self.payloads: List[T] = []
+        self._tokens: List[Tuple[Token, ...]] = []
+        self._rank: List[Tuple] = []
+        for index, (pattern, payload) in enumerate(entries):
+            tokens, is_pattern = parse_pattern(pattern)
+            self.patterns.append(pattern)
+            self.payloads.append(payload)
+            self._tokens.append(tokens)
+            self._rank.append((specificity(tokens, is_pattern), index))
+
+        self._states: Dict[FrozenSet[Tuple[int, int]], _State] = {}
+        self._start = self._state(frozenset((i, 0) for i in range(len(self._tokens))))
+
+    def __len__(self) -> int:
+        return len(self.payloads)
+
+    def _state(self, positions: FrozenSet[Tuple[int, int]]) -> _State:
+        state = self._states.get(positions)
+        if state is None:
+            if len(self._states) >= MAX_DFA_STATES:
+                self._reset_cache()
+            best = None
+            for entry, position in positions:
+                tokens = self._tokens[entry]
+                if position == len(tokens) or tokens[position] is STAR:
+                    if best is None or self._rank[entry] < self._rank[best]:
+                        best = entry
+            state = self._states[positions] = _State(positions, best)
+        return state
+
+    def _reset_cache(self):
+        """Descarta os estados em cache (exceto o inicial) para limitar a memória"""
+        start = self._start
+        self._states.clear()
+        start.next.clear()
+        self._states[start.positions] = start
+
+    def _step(self, state: _State, char: str) -> _State:
+        positions = set()
+        for entry, position in state.positions:
+            tokens = self._tokens[entry]
+            if position == len(tokens):
+                continue
+            token = tokens[position]
+            if token is STAR:
+                positions.add((entry, position))
+            elif token is ANY or char in token:
+                positions.add((entry, position + 1))
+        target = self._state(frozenset(positions))
+        state.next[char] = target
+        return target
+
+    def match_index(self, number: str) -> Optional[int]:
+        """Índice do padrão vencedor para o número (None se nenhum casa)"""
+        state = self._start
+        for char in number:
+            following = state.next.get(char)
+            state = following if following is not None else self._step(state, char)
+            if not state.positions:
+                return None
+        return state.accept
+
+    def match(self, number: str) -> Optional[T]:
+        index = self.match_index(number)
+        return None if index is None else self.payloads[index]
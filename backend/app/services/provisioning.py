@@ -0,0 +1,340 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models import Customer, CustomerDID, DID, Gateway, Provider, Route
+from app.services.asterisk import CONFIG_ERROR, CONFIG_UPDATED, asterisk_service
+from app.services.asterisk_config import load_pjsip_extensions
+
+
+# ==========================================
+# SINCRONIZAÇÃO POR DOMÍNIO
+# ==========================================
+# Cada sincronizador só grava os arquivos; o reload fica com a fila (ver _reload).
+# As linhas viram dicts ainda na sessão: a gravação roda numa thread (asyncio.to_thread)
+async def sync_extensions(db: AsyncSession) -> str:
+    """Regenera os fragmentos de ramais (pjsip_extensions.conf)"""
+    extensions = list(await load_pjsip_extensions(db))
+    return await asterisk_service.save_extensions_pjsip_config(extensions)
+
+
+async def sync_customer_trunks(db: AsyncSession) -> str:
+    """Regenera os fragmentos de clientes trunk (pjsip_customer_trunks.conf)"""
+    result = await db.execute(select(Customer).where(Customer.type == "trunk"))
+    customers_data = [
+        {
+            "code": c.code,
+            "name": c.name,
+            "type": c.type,
+            "status": c.status,
+            "trunk_ip": c.trunk_ip,
+            "trunk_port": c.trunk_port or 5060,
+            "trunk_codecs": c.trunk_codecs or "alaw,ulaw",
+            "trunk_context": c.trunk_context or "from-trunk",
+        }
+        for c in result.scalars()
+    ]
+
+    return await asterisk_service.save_customer_trunks_config(customers_data)
+
+
+async def sync_gateways(db: AsyncSession) -> str:
+    """Regenera os fragmentos de gateways (pjsip_gateways.conf)"""
+    result = await db.execute(select(Gateway))
+    gateways_data = [
+        {
+            "name": g.name,
+            "ip_address": g.ip_address,
+            "port": g.port or 5060,
+            "codecs": g.codecs or "alaw,ulaw",
+            "context": g.context or "from-trunk",
+            "auth_type": g.auth_type or "ip",
+            "username": g.username,
+            "password": g.password,
+            "status": g.status,
+        }
+        for g in result.scalars()
+    ]
+
+    return await asterisk_service.save_gateways_config(gateways_data)
+
+
+async def sync_providers(db: AsyncSession) -> str:
+    """Regenera pjsip_providers.conf"""
+    result = await db.execute(select(Provider).where(Provider.status == "active"))
+    providers_data = [
+        {
+            "name": p.name,
+            "ip_address": p.ip_address,
+            "port": p.port,
+            "tech_prefix": p.tech_prefix,
+            "codecs": "alaw,ulaw",
+            "auth_type": p.auth_type,
+            "username": p.username,
+            "password": p.password,
+            "status": p.status
+        }
+        for p in result.scalars()
+    ]
+
+    return await asterisk_service.save_providers_config(providers_data)
+
+
+async def sync_routes(db: AsyncSession) -> str:
+    """Regenera extensions_routes.conf"""
+    routes_result = await db.execute(select(Route))
+    gateways_result = await db.execute(select(Gateway))
+
+    routes_data = [
+        {
+            "id": str(r.id),
+            "name": r.name,
+            "pattern": r.pattern,
+            "gateway_id": str(r.gateway_id) if r.gateway_id else None,
+            "priority": r.priority,
+            "status": r.status,
+        }
+        for r in routes_result.scalars()
+    ]
+
+    gateways_data = [
+        {
+            "id": str(g.id),
+            "name": g.name,
+            "tech_prefix": g.tech_prefix,
+        }
+        for g in gateways_result.scalars()
+    ]
+
+    return await asterisk_service.save_outbound_routes_config(routes_data, gateways_data)
+
+
+async def sync_dids(db: AsyncSession) -> str:
+    """Regenera extensions_dids.conf"""
+    dids_result = await db.execute(
+        select(DID, CustomerDID)
+        .outerjoin(CustomerDID, DID.id == CustomerDID.did_id)
+    )
+    customers_result = await db.execute(select(Customer))
+
+    dids_data = [
+        {
+            "number": did.number,
+            "status": did.status,
+            "customer_id": str(alloc.customer_id) if alloc else None,
+            "destination": alloc.destination if alloc else None,
+            "destination_type": alloc.destination_type if alloc else None,
+        }
+        for did, alloc in dids_result
+    ]
+
+    customers_data = [
+        {
+            "id": str(c.id),
+            "code": c.code,
+            "name": c.name,
+            "type": c.type,
+            "trunk_ip": c.trunk_ip,
+            "trunk_port": c.trunk_port,
+        }
+        for c in customers_result.scalars()
+    ]
+
+    return await asterisk_service.save_inbound_dids_config(dids_data, customers_data)
+
+
+DOMAIN_SYNCERS: Dict[str, Callable[[AsyncSession], Awaitable[str]]] = {
+    "extensions": sync_extensions,
+    "trunks": sync_customer_trunks,
+    "gateways": sync_gateways,
+    "providers": sync_providers,
+    "routes": sync_routes,
+    "dids": sync_dids,
+}
+
+# Módulo do Asterisk recarregado após gravar cada domínio
+DOMAIN_RELOADERS: Dict[str, Callable[[], Awaitable[bool]]] = {
+    "extensions": asterisk_service.reload_pjsip,
+    "trunks": asterisk_service.reload_pjsip,
+    "gateways": asterisk_service.reload_pjsip,
+    "providers": asterisk_service.reload_pjsip,
+    "routes": asterisk_service.reload_dialplan,
+    "dids": asterisk_service.reload_dialplan,
+}
+
+
+# ==========================================
+# FILA DE PROVISIONAMENTO
+# ==========================================
+@dataclass
+class DomainStatus:
+    domain: str
+    pending_changes: int = 0
+    first_pending_at: Optional[datetime] = None
+    scheduled_for: Optional[datetime] = None
+    applying: bool = False
+    # Arquivo gravado mas ainda não recarregado com sucesso no Asterisk
+    reload_pending: bool = False
+    last_applied_at: Optional[datetime] = None
+    last_result: Optional[str] = None
+    last_error: Optional[str] = None
+    last_duration: Optional[float] = None
+    applied_count: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class ProvisioningQueue:
+    """Fila de provisionamento com debounce por domínio de configuração.
+
+    Alterações no banco apenas marcam o domínio como pendente (mark_dirty);
+    cada domínio é regenerado e recarregado no máximo uma vez por janela
+    (PROVISIONING_DEBOUNCE_SECONDS), agrupando edições em massa em uma
+    única escrita de arquivo e um único reload.
+    """
+
+    def __init__(self, window: float = settings.PROVISIONING_DEBOUNCE_SECONDS):
+        self.window = window
+        self.domains: Dict[str, DomainStatus] = {
+            name: DomainStatus(domain=name) for name in DOMAIN_SYNCERS
+        }
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks = set()
+
+    def mark_dirty(self, *domains: str):
+        """Marca domínios como pendentes e agenda a aplicação ao fim da janela"""
+        loop = asyncio.get_running_loop()
+        for name in domains:
+            state = self.domains[name]
+            state.pending_changes += 1
+            if state.first_pending_at is None:
+                state.first_pending_at = datetime.utcnow()
+            if name not in self._timers:
+                self._timers[name] = loop.call_later(self.window, self._spawn_flush, name)
+                state.scheduled_for = datetime.utcnow() + timedelta(seconds=self.window)
+
+    def _spawn_flush(self, name: str):
+        task = asyncio.create_task(self._flush_scheduled(name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_scheduled(self, name: str):
+        self._timers.pop(name, None)
+        await self._flush_domain(name)
+
+    async def flush(self, domain: Optional[str] = None, force: bool = False) -> Dict[str, Optional[str]]:
+        """Aplica imediatamente os domínios pendentes (ou um domínio específico).
+
+        Com force=True o domínio é regenerado mesmo sem alterações pendentes.
+        """
+        names = [domain] if domain else list(self.domains)
+        results = {}
+        for name in names:
+            timer = self._timers.pop(name, None)
+            if timer:
+                timer.cancel()
+            if force or self.domains[name].pending_changes:
+                results[name] = await self._flush_domain(name, force=force)
+        return results
+
+    async def _flush_domain(self, name: str, force: bool = False) -> Optional[str]:
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            state = self.domains[name]
+            if not state.pending_changes and not force:
+                return state.last_result
+
+            # Alterações marcadas durante a aplicação entram na próxima janela
+            state.pending_changes = 0
+            state.first_pending_at = None
+            state.scheduled_for = None
+            state.applying = True
+            start = time.perf_counter()
+            try:
+                async with async_session() as db:
+                    result = await DOMAIN_SYNCERS[name](db)
+                result = await self._reload(name, result, force)
+                state.last_result = result
+                state.last_error = None if result != CONFIG_ERROR else "Falha ao gerar configuração ou recarregar o Asterisk"
+                if result == CONFIG_UPDATED:
+                    await self._record_snapshot(name)
+            except Exception as e:
+                logger.error(f"Erro ao aplicar provisionamento de {name}: {e}")
+                # Os arquivos podem ter sido gravados em parte: recarrega na próxima aplicação
+                state.reload_pending = True
+                state.last_result = CONFIG_ERROR
+                state.last_error = str(e)
+            finally:
+                state.applying = False
+                state.last_duration = time.perf_counter() - start
+                state.last_applied_at = datetime.utcnow()
+                state.applied_count += 1
+                metrics.observe(f"provisioning.{name}.duration", state.last_duration)
+                metrics.incr(f"provisioning.{name}.{state.last_result}")
+            return state.last_result
+
+    async def _reload(self, name: str, result: str, force: bool) -> str:
+        """Recarrega o Asterisk se o domínio foi regravado, se um reload anterior falhou ou com force.
+
+        O hash novo vai para o disco antes do reload; se o reload falha, as
+        próximas gravações encontram o arquivo "sem alterações". Por isso o
+        reload pendente fica marcado no estado do domínio até dar certo.
+        """
+        state = self.domains[name]
+        if result == CONFIG_ERROR:
+            return result
+        pending = state.reload_pending = state.reload_pending or result == CONFIG_UPDATED
+        if not pending and not force:
+            return result
+        if not await DOMAIN_RELOADERS[name]():
+            return CONFIG_ERROR
+        state.reload_pending = False
+        return CONFIG_UPDATED if pending else result
+
+    async def _record_snapshot(self, name: str):
+        """Snapshot de todos os arquivos gerenciados após aplicar um domínio"""
+        try:
+            await asyncio.to_thread(asterisk_service.record_snapshot, f"provisioning:{name}")
+        except Exception as e:
+            logger.error(f"Erro ao registrar snapshot após provisionamento de {name}: {e}")
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Segura os locks de todos os domínios (em ordem fixa, sem deadlock)"""
+        acquired = []
+        try:
+            for name in sorted(self.domains):
+                lock = self._locks.setdefault(name, asyncio.Lock())
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    async def rollback(self, snapshot_id: int) -> Dict:
+        """Rollback para um snapshot sem concorrer com a aplicação de nenhum domínio"""
+        async with self._exclusive():
+            return await asterisk_service.rollback_snapshot(snapshot_id)
+
+    async def restore_backup(self, key: str, backup_id: str) -> str:
+        """Restaura um backup sem concorrer com a aplicação de nenhum domínio"""
+        async with self._exclusive():
+            return await asterisk_service.restore_backup(key, backup_id)
+
+    def status(self) -> List[Dict]:
+        return [state.to_dict() for state in self.domains.values()]
+
+
+# Instância global
+provisioning_queue = ProvisioningQueue()
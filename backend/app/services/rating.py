@@ -0,0 +1,299 @@
+import asyncio
+import time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models import Customer, Tariff, TariffPlan
+from app.models.tariff_plan import tariff_plan_tariffs
+from app.services.dialplan_pattern import PatternAutomaton, PatternSyntaxError, parse_pattern
+
+# Valores monetários são calculados em inteiros de micro-unidades (escala das colunas Numeric(10, 6))
+MICRO = 1000000
+_MICRO_EXPONENT = Decimal("0.000001")
+
+# Plano usado por clientes sem plano de tarifas: tarifas ativas sem cliente
+DEFAULT_PLAN = None
+
+
+def to_micro(value: Any) -> int:
+    return int((Decimal(str(value or 0)) * MICRO).to_integral_value())
+
+
+def from_micro(value: int) -> Decimal:
+    return (Decimal(value) / MICRO).quantize(_MICRO_EXPONENT)
+
+
+def billable_seconds(billsec: int, increment: int, min_duration: int) -> int:
+    """Segundos tarifados: mínimo aplicado e arredondamento para cima no incremento"""
+    if billsec <= 0:
+        return 0
+    seconds = max(billsec, min_duration)
+    if increment > 1:
+        seconds = -(-seconds // increment) * increment
+    return seconds
+
+
+def tariff_pattern(pattern: Optional[str]) -> str:
+    """Padrão do autômato para uma tarifa.
+
+    Padrões de dialplan ('_55XX.') são usados como estão; prefixos simples
+    ('5511', '+5511') valem para qualquer número que comece por eles.
+    """
+    pattern = (pattern or "_X.").strip()
+    if pattern.startswith("_"):
+        return pattern
+    return f"_{pattern.lstrip('+')}!"
+
+
+class Rate:
+    """Tarifa compilada, com valores em micro-unidades"""
+
+    __slots__ = ("tariff_id", "name", "pattern", "cost", "price", "connection_fee", "increment", "min_duration")
+
+    def __init__(self, tariff: Dict[str, Any]):
+        self.tariff_id = tariff["id"]
+        self.name = tariff["name"]
+        self.pattern = tariff["pattern"]
+        self.cost = to_micro(tariff["cost_per_minute"])
+        self.price = to_micro(tariff["price_per_minute"])
+        self.connection_fee = to_micro(tariff["connection_fee"])
+        self.increment = tariff["billing_increment"] or 1
+        self.min_duration = tariff["min_duration"] or 0
+
+    def charge(self, billsec: int) -> Tuple[int, int, int]:
+        """(segundos tarifados, custo, preço) de uma chamada, em micro-unidades.
+
+        A taxa de conexão é somada ao preço apenas em chamadas atendidas.
+        """
+        seconds = billable_seconds(billsec, self.increment, self.min_duration)
+        if not seconds:
+            return 0, 0, 0
+        cost = (self.cost * seconds + 30) // 60
+        price = (self.price * seconds + 30) // 60 + self.connection_fee
+        return seconds, cost, price
+
+
+class Rating:
+    __slots__ = ("tariff_id", "tariff_name", "pattern", "billed_seconds", "cost", "price")
+
+    def __init__(self, rate: Rate, billed_seconds: int, cost: int, price: int):
+        self.tariff_id = rate.tariff_id
+        self.tariff_name = rate.name
+        self.pattern = rate.pattern
+        self.billed_seconds = billed_seconds
+        self.cost = from_micro(cost)
+        self.price = from_micro(price)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tariff_id": self.tariff_id,
+            "tariff_name": self.tariff_name,
+            "pattern": self.pattern,
+            "billed_seconds": self.billed_seconds,
+            "cost": float(self.cost),
+            "price": float(self.price),
+        }
+
+
+class RatePlan:
+    """Índice das tarifas de um plano, por direção (outbound/inbound).
+
+    Vence a tarifa de padrão mais específico (prefixo mais longo); a
+    prioridade da tarifa desempata padrões equivalentes. O custo da consulta
+    é uma transição de autômato em cache por dígito.
+    """
+
+    def __init__(self, tariffs: Iterable[Dict[str, Any]]):
+        by_direction: Dict[str, List[Tuple[str, Rate]]] = {}
+        for tariff in sorted(tariffs, key=lambda t: (t["priority"] or 0, t["name"] or "")):
+            pattern = tariff_pattern(tariff["pattern"])
+            try:
+                parse_pattern(pattern)
+            except PatternSyntaxError as e:
+                logger.warning(f"Tarifa {tariff['name']} ignorada: {e}")
+                continue
+            by_direction.setdefault(tariff["direction"] or "outbound", []).append((pattern, Rate(tariff)))
+        self._automata = {direction: PatternAutomaton(entries) for direction, entries in by_direction.items()}
+
+    def __len__(self) -> int:
+        return sum(len(automaton) for automaton in self._automata.values())
+
+    def lookup(self, number: str, direction: str = "outbound") -> Optional[Rate]:
+        automaton = self._automata.get(direction)
+        return automaton.match(number) if automaton is not None else None
+
+
+class RatingEngine:
+    """Tarifação de chamadas em memória, com os planos compilados em cache.
+
+    Os dados de tarifas são carregados do banco de uma vez e cada plano é
+    compilado na primeira chamada que o usa. Tarifas do próprio cliente
+    (Tariff.customer_id) têm precedência sobre as do plano dele. A validade
+    do cache é conferida a cada RATING_REFRESH_SECONDS (quantidade e maior
+    updated_at de tarifas, planos e clientes) e pode ser forçada com
+    invalidate() após alterações pela API.
+    """
+
+    def __init__(self, refresh_seconds: float = settings.RATING_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = asyncio.Lock()
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._loaded = False
+        # Dados carregados do banco
+        self._plan_tariffs: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        self._customer_tariffs: Dict[str, List[Dict[str, Any]]] = {}
+        self._customer_plan: Dict[str, Optional[str]] = {}
+        # Planos compilados sob demanda
+        self._plans: Dict[Optional[str], RatePlan] = {}
+        self._overrides: Dict[str, RatePlan] = {}
+
+    # ==========================================
+    # CACHE
+    # ==========================================
+    def invalidate(self):
+        """Força o recarregamento das tarifas na próxima tarifação"""
+        self._signature = None
+        self._checked_at = 0.0
+
+    async def _current_signature(self, db: AsyncSession) -> Tuple:
+        result = await db.execute(select(
+            select(func.count(Tariff.id)).scalar_subquery(),
+            select(func.max(Tariff.updated_at)).scalar_subquery(),
+            select(func.count(TariffPlan.id)).scalar_subquery(),
+            select(func.max(TariffPlan.updated_at)).scalar_subquery(),
+            select(func.count()).select_from(tariff_plan_tariffs).scalar_subquery(),
+            select(func.count(Customer.id)).scalar_subquery(),
+            select(func.max(Customer.updated_at)).scalar_subquery(),
+        ))
+        return tuple(result.one())
+
+    async def ensure_fresh(self, db: AsyncSession):
+        """Recarrega as tarifas se mudaram desde a última conferência"""
+        if self._loaded and time.monotonic() - self._checked_at < self.refresh_seconds:
+            return
+        async with self._lock:
+            if self._loaded and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return
+            signature = await self._current_signature(db)
+            if not self._loaded or signature != self._signature:
+                await self._load(db)
+                self._signature = signature
+            self._checked_at = time.monotonic()
+
+    async def _load(self, db: AsyncSession):
+        start = time.perf_counter()
+        tariffs_result = await db.execute(select(Tariff).where(Tariff.status == "active"))
+        tariffs: Dict[str, Dict[str, Any]] = {}
+        customer_tariffs: Dict[str, List[Dict[str, Any]]] = {}
+        default_tariffs: List[Dict[str, Any]] = []
+        for t in tariffs_result.scalars():
+            data = {
+                "id": str(t.id),
+                "name": t.name,
+                "direction": t.direction,
+                "pattern": t.pattern,
+                "cost_per_minute": t.cost_per_minute,
+                "price_per_minute": t.price_per_minute,
+                "connection_fee": t.connection_fee,
+                "billing_increment": t.billing_increment,
+                "min_duration": t.min_duration,
+                "priority": t.priority,
+            }
+            tariffs[data["id"]] = data
+            if t.customer_id:
+                customer_tariffs.setdefault(str(t.customer_id), []).append(data)
+            else:
+                default_tariffs.append(data)
+
+        plans_result = await db.execute(
+            select(tariff_plan_tariffs.c.tariff_plan_id, tariff_plan_tariffs.c.tariff_id)
+            .join(TariffPlan, TariffPlan.id == tariff_plan_tariffs.c.tariff_plan_id)
+            .where(TariffPlan.status == "active")
+        )
+        plan_tariffs: Dict[Optional[str], List[Dict[str, Any]]] = {DEFAULT_PLAN: default_tariffs}
+        for plan_id, tariff_id in plans_result:
+            plan_tariffs.setdefault(str(plan_id), [])
+            tariff = tariffs.get(str(tariff_id))
+            if tariff:
+                plan_tariffs[str(plan_id)].append(tariff)
+
+        customers_result = await db.execute(select(Customer.id, Customer.tariff_plan_id))
+        customer_plan = {}
+        for customer_id, plan_id in customers_result:
+            plan_id = str(plan_id) if plan_id else DEFAULT_PLAN
+            # Plano inativo ou removido: usa o plano padrão
+            customer_plan[str(customer_id)] = plan_id if plan_id in plan_tariffs else DEFAULT_PLAN
+
+        self._plan_tariffs = plan_tariffs
+        self._customer_tariffs = customer_tariffs
+        self._customer_plan = customer_plan
+        self._plans = {}
+        self._overrides = {}
+        self._loaded = True
+        metrics.observe("rating.load", time.perf_counter() - start)
+        logger.info(f"Tarifas carregadas: {len(tariffs)} tarifas, {len(plan_tariffs) - 1} planos")
+
+    def _plan(self, plan_id: Optional[str]) -> RatePlan:
+        plan = self._plans.get(plan_id)
+        if plan is None:
+            plan = self._plans[plan_id] = RatePlan(self._plan_tariffs.get(plan_id, ()))
+        return plan
+
+    def _override(self, customer_id: str) -> Optional[RatePlan]:
+        if customer_id not in self._customer_tariffs:
+            return None
+        plan = self._overrides.get(customer_id)
+        if plan is None:
+            plan = self._overrides[customer_id] = RatePlan(self._customer_tariffs[customer_id])
+        return plan
+
+    # ==========================================
+    # TARIFAÇÃO
+    # ==========================================
+    def find_rate(self, customer_id: Optional[str], number: str, direction: str = "outbound") -> Optional[Rate]:
+        """Tarifa aplicável ao número para o cliente (None se nenhuma casa)"""
+        number = number.lstrip("+")
+        if customer_id:
+            override = self._override(customer_id)
+            if override is not None:
+                rate = override.lookup(number, direction)
+                if rate is not None:
+                    return rate
+        return self._plan(self._customer_plan.get(customer_id, DEFAULT_PLAN)).lookup(number, direction)
+
+    def rate(
+        self,
+        customer_id: Optional[str],
+        number: str,
+        billsec: int,
+        direction: str = "outbound",
+    ) -> Optional[Rating]:
+        """Tarifa uma chamada com os dados em cache (chamar ensure_fresh antes)"""
+        rate = self.find_rate(customer_id, number or "", direction)
+        if rate is None:
+            metrics.incr("rating.unrated")
+            return None
+        metrics.incr("rating.rated")
+        return Rating(rate, *rate.charge(billsec or 0))
+
+    async def rate_cdr(self, db: AsyncSession, cdr: Any) -> Optional[Rating]:
+        """Preenche cost e price de um CDR (não faz commit)"""
+        await self.ensure_fresh(db)
+        rating = self.rate(
+            str(cdr.customer_id) if cdr.customer_id else None,
+            cdr.dst,
+            cdr.billsec,
+            "inbound" if cdr.call_type == "inbound" else "outbound",
+        )
+        if rating is not None:
+            cdr.cost = rating.cost
+            cdr.price = rating.price
+        return rating
+
+
+rating_engine = RatingEngine()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from loguru import logger
+from app.core.metrics import metrics
+from app.services.ami import AMIManager, ami_manager
+
+# Módulo do Asterisk recarregado por cada domínio de configuração
+RELOAD_MODULES = {
+    "pjsip": "res_pjsip.so",
+    "dialplan": "pbx_config.so",
+}
+
+
+class ReloadCoalescer:
+    """Recarrega módulos do Asterisk via AMI (ação Reload) sem bloquear o loop.
+
+    Pedidos concorrentes para o mesmo módulo são agrupados: enquanto um reload
+    está em andamento, todos os novos pedidos compartilham um único reload
+    seguinte (que ainda verá os arquivos gravados depois do reload atual) e
+    recebem o mesmo resultado.
+    """
+
+    def __init__(self, manager: AMIManager = ami_manager):
+        self.manager = manager
+        self._running: Dict[str, asyncio.Task] = {}
+        self._queued: Dict[str, asyncio.Task] = {}
+
+    async def reload(self, name: str) -> bool:
+        """Solicita reload de um domínio ('pjsip', 'dialplan') e aguarda o resultado"""
+        metrics.incr(f"asterisk.reload.{name}.requests")
+        task = self._queued.get(name)
+        if task is None:
+            task = asyncio.create_task(self._run_after(name, self._running.get(name)))
+            self._queued[name] = task
+        return await asyncio.shield(task)
+
+    async def _run_after(self, name: str, previous: Optional[asyncio.Task]) -> bool:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        current = asyncio.current_task()
+        if self._queued.get(name) is current:
+            del self._queued[name]
+        self._running[name] = current
+        try:
+            return await self._execute(name)
+        finally:
+            if self._running.get(name) is current:
+                del self._running[name]
+
+    async def _execute(self, name: str) -> bool:
+        module = RELOAD_MODULES.get(name, name)
+        start = time.perf_counter()
+        try:
+            response = await self.manager.send_action("Reload", Module=module)
+            success = response.get("Response") == "Success"
+            if success:
+                logger.info(f"{name} recarregado com sucesso")
+            else:
+                logger.error(f"Erro ao recarregar {name}: {response.get('Message', '')}")
+        except Exception as e:
+            logger.error(f"Erro ao recarregar {name} via AMI: {e}")
+            success = False
+
+        metrics.observe(f"asterisk.reload.{name}.duration", time.perf_counter() - start)
+        metrics.incr(f"asterisk.reload.{name}.executed")
+        if not success:
+            metrics.incr(f"asterisk.reload.{name}.failed")
+        return success
+
+
+# Instância global
+reloader = ReloadCoalescer()
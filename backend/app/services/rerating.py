@@ -0,0 +1,282 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import bindparam, func, select, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, BIGINT, TIMESTAMP
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models import CDR, RerateJob
+from app.services.cdr_rollups import cdr_rollups
+from app.services.rating import Rate, RatingEngine, rating_engine
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# Grava apenas as linhas cujo valor mudou; valores chegam em micro-unidades.
+# O calldate no join limita cada linha à sua partição mensal.
+_UPDATE_CDR = text("""
+    UPDATE cdr
+    SET cost = v.cost::numeric / 1000000, price = v.price::numeric / 1000000
+    FROM unnest(:ids, :calldates, :costs, :prices) AS v(id, calldate, cost, price)
+    WHERE cdr.id = v.id AND cdr.calldate = v.calldate
+      AND (cdr.cost, cdr.price) IS DISTINCT FROM (v.cost::numeric / 1000000, v.price::numeric / 1000000)
+""").bindparams(
+    bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("calldates", type_=ARRAY(TIMESTAMP)),
+    bindparam("costs", type_=ARRAY(BIGINT)),
+    bindparam("prices", type_=ARRAY(BIGINT)),
+)
+
+
+def rate_chunk(
+    engine: RatingEngine,
+    customer_ids: List[Optional[str]],
+    numbers: List[str],
+    directions: List[str],
+    billsecs: List[int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Tarifa um bloco de chamadas de uma vez.
+
+    As tarifas são resolvidas uma vez por (cliente, direção, número) distinto
+    e os valores calculados em vetores NumPy de inteiros (micro-unidades),
+    com as mesmas regras de Rate.charge. Retorna (rated, cost, price), onde
+    rated indica as linhas com tarifa encontrada.
+    """
+    rates: List[Rate] = []
+    rate_index: Dict[int, int] = {}
+    resolved: Dict[Tuple[Optional[str], str, str], int] = {}
+    indexes = np.empty(len(numbers), dtype=np.int64)
+
+    for row, key in enumerate(zip(customer_ids, directions, numbers)):
+        position = resolved.get(key)
+        if position is None:
+            rate = engine.find_rate(key[0], key[2] or "", key[1])
+            if rate is None:
+                position = -1
+            else:
+                position = rate_index.get(id(rate))
+                if position is None:
+                    position = rate_index[id(rate)] = len(rates)
+                    rates.append(rate)
+            resolved[key] = position
+        indexes[row] = position
+
+    rated = indexes >= 0
+    safe = np.where(rated, indexes, 0)
+    table = np.array(
+        [(r.cost, r.price, r.connection_fee, max(r.increment, 1), r.min_duration) for r in rates] or [(0, 0, 0, 1, 0)],
+        dtype=np.int64,
+    )
+    cost_rate, price_rate, fee, increment, min_duration = (table[safe, column] for column in range(5))
+
+    billsec = np.asarray(billsecs, dtype=np.int64)
+    answered = billsec > 0
+    seconds = np.maximum(billsec, min_duration)
+    seconds = -(-seconds // increment) * increment
+    seconds = np.where(answered, seconds, 0)
+
+    cost = (cost_rate * seconds + 30) // 60
+    price = (price_rate * seconds + 30) // 60 + np.where(answered, fee, 0)
+    return rated, cost, price
+
+
+class RerateService:
+    """Retarifação em lote de CDRs históricos.
+
+    Cada job percorre os CDRs do período (e cliente, se informado) em blocos
+    ordenados por (calldate, id), tarifa o bloco com rate_chunk e grava os
+    valores com um único UPDATE ... FROM unnest(). O cursor do job é gravado
+    na mesma transação do bloco, então um job interrompido retoma exatamente
+    do último bloco confirmado.
+    """
+
+    def __init__(self, engine: RatingEngine = rating_engine):
+        self.engine = engine
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def is_running(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    def start(self, job_id: UUID) -> bool:
+        """Inicia (ou retoma) um job em segundo plano"""
+        key = str(job_id)
+        if self.is_running(key):
+            return False
+        self._tasks[key] = asyncio.create_task(self._run(job_id))
+        return True
+
+    def cancel(self, job_id: UUID) -> bool:
+        task = self._tasks.get(str(job_id))
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def resume_interrupted(self) -> int:
+        """Retoma jobs que estavam em execução quando a aplicação parou"""
+        try:
+            async with async_session() as db:
+                result = await db.execute(select(RerateJob.id).where(RerateJob.status == JOB_RUNNING))
+                job_ids = result.scalars().all()
+        except Exception as e:
+            logger.error(f"Erro ao consultar jobs de retarifação: {e}")
+            return 0
+        for job_id in job_ids:
+            logger.info(f"Retomando retarifação {job_id}")
+            self.start(job_id)
+        return len(job_ids)
+
+    async def _set_status(self, job_id: UUID, status: str, error: Optional[str] = None):
+        async with async_session() as db:
+            job = await db.get(RerateJob, job_id)
+            if job is None:
+                return
+            job.status = status
+            job.error = error
+            if status in (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED):
+                job.finished_at = datetime.utcnow()
+            await db.commit()
+
+    async def _run(self, job_id: UUID):
+        try:
+            await self._process(job_id)
+        except asyncio.CancelledError:
+            logger.info(f"Retarifação {job_id} cancelada")
+            await asyncio.shield(self._set_status(job_id, JOB_CANCELLED))
+            raise
+        except Exception as e:
+            logger.error(f"Erro na retarifação {job_id}: {e}")
+            metrics.incr("rating.rerate.failed")
+            await self._set_status(job_id, JOB_FAILED, str(e))
+        finally:
+            self._tasks.pop(str(job_id), None)
+
+    def _chunk_query(self, job: RerateJob):
+        query = (
+            select(CDR.id, CDR.calldate, CDR.customer_id, CDR.dst, CDR.billsec, CDR.call_type)
+            .where(CDR.calldate >= job.date_from, CDR.calldate < job.date_to)
+            .order_by(CDR.calldate, CDR.id)
+            .limit(job.chunk_size)
+        )
+        if job.customer_id:
+            query = query.where(CDR.customer_id == job.customer_id)
+        if job.last_calldate is not None:
+            query = query.where(tuple_(CDR.calldate, CDR.id) > tuple_(job.last_calldate, job.last_id))
+        return query
+
+    async def _process(self, job_id: UUID):
+        async with async_session() as db:
+            job = await db.get(RerateJob, job_id)
+            if job is None or job.status in (JOB_COMPLETED, JOB_CANCELLED):
+                return
+
+            if job.started_at is None:
+                job.started_at = datetime.utcnow()
+                count_query = (
+                    select(func.count())
+                    .select_from(CDR)
+                    .where(CDR.calldate >= job.date_from, CDR.calldate < job.date_to)
+                )
+                if job.customer_id:
+                    count_query = count_query.where(CDR.customer_id == job.customer_id)
+                job.total_estimate = await db.scalar(count_query)
+            job.status = JOB_RUNNING
+            job.error = None
+            await db.commit()
+            logger.info(f"Retarifação {job_id} iniciada: {job.total_estimate} CDRs estimados")
+
+            while True:
+                chunk_start = time.perf_counter()
+                await self.engine.ensure_fresh(db)
+                rows = (await db.execute(self._chunk_query(job))).all()
+                if not rows:
+                    break
+
+                ids = [row.id for row in rows]
+                calldates = [row.calldate for row in rows]
+                rated, cost, price = await asyncio.to_thread(
+                    rate_chunk,
+                    self.engine,
+                    [str(row.customer_id) if row.customer_id else None for row in rows],
+                    [(row.dst or "").lstrip("+") for row in rows],
+                    ["inbound" if row.call_type == "inbound" else "outbound" for row in rows],
+                    [row.billsec or 0 for row in rows],
+                )
+                selected = np.flatnonzero(rated)
+                updated = 0
+                if len(selected):
+                    result = await db.execute(_UPDATE_CDR, {
+                        "ids": [ids[i] for i in selected],
+                        "calldates": [calldates[i] for i in selected],
+                        "costs": cost[selected].tolist(),
+                        "prices": price[selected].tolist(),
+                    })
+                    updated = result.rowcount
+
+                # Cursor e contadores no mesmo commit do bloco
+                job.last_calldate = rows[-1].calldate
+                job.last_id = rows[-1].id
+                job.processed += len(rows)
+                job.updated_rows += updated
+                job.unrated += len(rows) - len(selected)
+                job.elapsed_seconds += time.perf_counter() - chunk_start
+                await db.commit()
+
+                metrics.incr("rating.rerate.rows", len(rows))
+                metrics.observe("rating.rerate.chunk", time.perf_counter() - chunk_start)
+                logger.debug(
+                    f"Retarifação {job_id}: {job.processed}/{job.total_estimate} CDRs "
+                    f"({self.throughput(job):.0f} CDRs/s)"
+                )
+                if len(rows) < job.chunk_size:
+                    break
+
+            job.status = JOB_COMPLETED
+            job.finished_at = datetime.utcnow()
+            await db.commit()
+            logger.info(
+                f"Retarifação {job_id} concluída: {job.processed} CDRs, {job.updated_rows} alterados, "
+                f"{job.unrated} sem tarifa ({self.throughput(job):.0f} CDRs/s)"
+            )
+            if job.updated_rows:
+                # Custos e preços mudaram: agregados do dashboard do período
+                cdr_rollups.rebuild(job.date_from, job.date_to)
+
+    @staticmethod
+    def throughput(job: RerateJob) -> float:
+        return job.processed / job.elapsed_seconds if job.elapsed_seconds else 0.0
+
+    def progress(self, job: RerateJob) -> Dict[str, Any]:
+        total = job.total_estimate or 0
+        return {
+            "id": str(job.id),
+            "status": job.status,
+            "running": self.is_running(str(job.id)),
+            "date_from": job.date_from,
+            "date_to": job.date_to,
+            "customer_id": str(job.customer_id) if job.customer_id else None,
+            "chunk_size": job.chunk_size,
+            "total_estimate": total,
+            "processed": job.processed,
+            "updated_rows": job.updated_rows,
+            "unrated": job.unrated,
+            "percent": round(min(job.processed / total * 100, 100), 2) if total else None,
+            "rows_per_second": round(self.throughput(job), 1),
+            "last_calldate": job.last_calldate,
+            "error": job.error,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+rerate_service = RerateService()
@@ -0,0 +1,208 @@
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.metrics import metrics
+from app.models import Gateway, Route
+from app.services.dialplan_pattern import PatternAutomaton, PatternSyntaxError, parse_pattern
+
+
+class RouteMatcher:
+    """Resolve qual rota de saída e gateway um número usaria.
+
+    Usa as mesmas regras do dialplan gerado em extensions_routes.conf: apenas
+    rotas ativas com gateway existente, ordenadas por prioridade. Como no
+    Asterisk, vence o padrão mais específico; a prioridade só desempata
+    padrões equivalentes.
+    """
+
+    def __init__(self, routes: Iterable[Dict[str, Any]], gateways: Iterable[Dict[str, Any]]):
+        gateways_by_id = {str(gw.get('id')): gw for gw in gateways}
+        entries: List[Tuple[str, Dict[str, Any]]] = []
+        self.invalid: List[Dict[str, Any]] = []
+
+        for route in sorted(routes, key=lambda x: x.get('priority', 99)):
+            if route.get('status') != 'active':
+                continue
+            gateway = gateways_by_id.get(str(route.get('gateway_id')))
+            if not gateway:
+                continue
+
+            pattern = route.get('pattern', '_X.')
+            try:
+                parse_pattern(pattern)
+            except PatternSyntaxError as e:
+                self.invalid.append({"route_id": str(route.get('id')), "pattern": pattern, "error": str(e)})
+                continue
+
+            entries.append((pattern, {
+                "route_id": str(route.get('id')),
+                "route_name": route.get('name'),
+                "pattern": pattern,
+                "priority": route.get('priority'),
+                "gateway_id": str(gateway.get('id')),
+                "gateway_name": gateway.get('name'),
+                "tech_prefix": gateway.get('tech_prefix') or '',
+            }))
+
+        self.automaton = PatternAutomaton(entries)
+
+    def __len__(self) -> int:
+        return len(self.automaton)
+
+    def match(self, number: str) -> Optional[Dict[str, Any]]:
+        """Rota escolhida para o número (None se nenhuma rota casa)"""
+        route = self.automaton.match(number)
+        if route is None:
+            return None
+        return {
+            "route_id": route["route_id"],
+            "route_name": route["route_name"],
+            "pattern": route["pattern"],
+            "priority": route["priority"],
+            "gateway_id": route["gateway_id"],
+            "gateway_name": route["gateway_name"],
+            "dial": f"PJSIP/{route['tech_prefix']}{number}@{route['gateway_name']}",
+        }
+
+
+def route_data(route: Any) -> Dict[str, Any]:
+    return {
+        "id": str(route.id),
+        "name": route.name,
+        "pattern": route.pattern,
+        "gateway_id": str(route.gateway_id) if route.gateway_id else None,
+        "priority": route.priority,
+        "status": route.status,
+    }
+
+
+def gateway_data(gateway: Any) -> Dict[str, Any]:
+    return {
+        "id": str(gateway.id),
+        "name": gateway.name,
+        "tech_prefix": gateway.tech_prefix,
+    }
+
+
+class RouteMatcherCache:
+    """Mantém o RouteMatcher das rotas atuais, recompilado quando rotas ou gateways mudam.
+
+    A validade é conferida por uma consulta leve (quantidade e maior
+    updated_at de rotas e gateways), o que funciona também com vários
+    workers e com alterações feitas fora da API.
+    """
+
+    def __init__(self):
+        self._matcher: Optional[RouteMatcher] = None
+        self._signature: Optional[Tuple] = None
+        self._lock = asyncio.Lock()
+
+    async def _current_signature(self, db: AsyncSession) -> Tuple:
+        routes = await db.execute(select(func.count(Route.id), func.max(Route.updated_at)))
+        gateways = await db.execute(select(func.count(Gateway.id), func.max(Gateway.updated_at)))
+        return tuple(routes.one()) + tuple(gateways.one())
+
+    async def get(self, db: AsyncSession) -> RouteMatcher:
+        signature = await self._current_signature(db)
+        if self._matcher is not None and signature == self._signature:
+            return self._matcher
+
+        async with self._lock:
+            if self._matcher is not None and signature == self._signature:
+                return self._matcher
+            routes_result = await db.execute(select(Route))
+            gateways_result = await db.execute(select(Gateway))
+            start = time.perf_counter()
+            matcher = RouteMatcher(
+                (route_data(r) for r in routes_result.scalars()),
+                (gateway_data(g) for g in gateways_result.scalars()),
+            )
+            metrics.observe("routing.matcher.compile", time.perf_counter() - start)
+            logger.debug(f"Rotas compiladas: {len(matcher)} padrões")
+            self._matcher = matcher
+            self._signature = signature
+            return matcher
+
+    def invalidate(self):
+        self._matcher = None
+        self._signature = None
+
+
+def simulate(
+    current: RouteMatcher,
+    numbers: Iterable[str],
+    proposed: Optional[RouteMatcher] = None,
+    sample_size: int = 100,
+) -> Dict[str, Any]:
+    """Roteia uma lista de números e resume o resultado por rota.
+
+    Com proposed, compara as rotas atuais com as propostas e conta quantos
+    números mudariam de rota (com uma amostra das mudanças).
+    """
+    per_route: Dict[Optional[str], int] = {}
+    per_route_proposed: Dict[Optional[str], int] = {}
+    changes: List[Dict[str, Any]] = []
+    changed = 0
+    total = 0
+    start = time.perf_counter()
+
+    match_current = current.automaton.match
+    match_proposed = proposed.automaton.match if proposed is not None else None
+    for number in numbers:
+        total += 1
+        route = match_current(number)
+        route_id = route["route_id"] if route else None
+        per_route[route_id] = per_route.get(route_id, 0) + 1
+
+        if match_proposed is not None:
+            new_route = match_proposed(number)
+            new_route_id = new_route["route_id"] if new_route else None
+            per_route_proposed[new_route_id] = per_route_proposed.get(new_route_id, 0) + 1
+            if new_route_id != route_id:
+                changed += 1
+                if len(changes) < sample_size:
+                    changes.append({
+                        "number": number,
+                        "current": current.match(number),
+                        "proposed": proposed.match(number),
+                    })
+
+    elapsed = time.perf_counter() - start
+    metrics.observe("routing.simulate.duration", elapsed)
+
+    def summarize(matcher: RouteMatcher, counts: Dict[Optional[str], int]) -> List[Dict[str, Any]]:
+        names = {p["route_id"]: p for p in matcher.automaton.payloads}
+        return sorted(
+            (
+                {
+                    "route_id": route_id,
+                    "route_name": names[route_id]["route_name"] if route_id in names else None,
+                    "gateway_name": names[route_id]["gateway_name"] if route_id in names else None,
+                    "count": count,
+                }
+                for route_id, count in counts.items()
+            ),
+            key=lambda r: -r["count"],
+        )
+
+    result: Dict[str, Any] = {
+        "total": total,
+        "unmatched": per_route.get(None, 0),
+        "routes": summarize(current, per_route),
+        "elapsed_ms": round(elapsed * 1000, 3),
+    }
+    if proposed is not None:
+        result["proposed"] = {
+            "unmatched": per_route_proposed.get(None, 0),
+            "routes": summarize(proposed, per_route_proposed),
+            "invalid_patterns": proposed.invalid,
+        }
+        result["changed"] = changed
+        result["changes"] = changes
+    return result
+
+
+route_matcher_cache = RouteMatcherCache()
@@ -0,0 +1,734 @@
+import ctypes
+import re
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from loguru import logger
+
+# Protocolos de camada de rede (ethertype) e de transporte
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+_VLAN_TYPES = (0x8100, 0x88A8, 0x9100)
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+# Tipos de enlace do formato pcap (LINKTYPE_*)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+# IP sem cabeçalho de enlace com os números de DLT_RAW de alguns sistemas (BSD),
+# presentes em capturas antigas
+LINKTYPE_DLT_RAW1 = 12
+LINKTYPE_DLT_RAW2 = 14
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_IPV6 = struct.Struct("!IHBB16s16s")
+_UDP = struct.Struct("!HHHH")
+_TCP = struct.Struct("!HHIIBB")
+_PCAP_HEADER = struct.Struct("IHHiIII")
+_PCAP_RECORD = struct.Struct("IIII")
+# Segundos aguardando o tcpdump sair após SIGTERM antes do SIGKILL
+_TCPDUMP_STOP_TIMEOUT = 5.0
+
+_TCP_FIN, _TCP_SYN, _TCP_RST = 0x01, 0x02, 0x04
+_SEQ_MASK = 0xFFFFFFFF
+_IPV6_EXTENSIONS = (0, 43, 60)
+
+_CONTENT_LENGTH = re.compile(rb"\r\n(?:content-length|l)[ \t]*:[ \t]*(\d+)", re.IGNORECASE)
+_SIP_START = re.compile(rb"\r\n(?=(?:[A-Z]+ \S+ SIP/2\.0|SIP/2\.0 \d{3} ))")
+
+
+def is_sip_start(data) -> bool:
+    """Verifica se os bytes começam com a linha inicial de uma mensagem SIP"""
+    if bytes(data[:8]) == b"SIP/2.0 ":
+        return True
+    end = bytes(data[:256]).find(b"\r\n")
+    return end > 0 and bytes(data[end - 8:end]) == b" SIP/2.0"
+
+
+@dataclass
+class SIPPacket:
+    """Mensagem SIP completa, com os endereços do pacote (ou do fluxo TCP) que a trouxe"""
+    timestamp: float
+    source_ip: str
+    source_port: int
+    dest_ip: str
+    dest_port: int
+    transport: str
+    data: bytes
+
+
+class TCPSegment(NamedTuple):
+    """Segmento TCP na porta SIP, para remontagem fora do decodificador que o leu"""
+    timestamp: float
+    key: Tuple[bytes, int, bytes, int]
+    family: int
+    seq: int
+    flags: int
+    payload: bytes
+
+
+class CaptureCounters:
+    """Contadores da captura: pacotes vistos, decodificados e descartados (por motivo)"""
+
+    def __init__(self):
+        self.seen = 0
+        self.parsed = 0
+        self.messages = 0
+        self.bytes = 0
+        self.dropped: Dict[str, int] = {}
+
+    def drop(self, reason: str, count: int = 1):
+        self.dropped[reason] = self.dropped.get(reason, 0) + count
+
+    def merge(self, other: "CaptureCounters"):
+        self.seen += other.seen
+        self.parsed += other.parsed
+        self.messages += other.messages
+        self.bytes += other.bytes
+        for reason, count in other.dropped.items():
+            self.drop(reason, count)
+
+    def to_dict(self) -> Dict:
+        # Cópia primeiro: a thread de captura pode incluir motivos durante a leitura
+        dropped = dict(self.dropped)
+        return {
+            "seen": self.seen,
+            "parsed": self.parsed,
+            "dropped": sum(dropped.values()),
+            "dropped_by_reason": dropped,
+            "messages": self.messages,
+            "bytes": self.bytes,
+        }
+
+
+def link_payload(view: memoryview, linktype: int) -> Optional[Tuple[int, memoryview]]:
+    """(ethertype, camada de rede) de um quadro do tipo de enlace informado.
+
+    Para enlaces sem ethertype (IP puro), retorna 0 e a versão é lida do
+    próprio cabeçalho IP.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(view) < 14:
+            return None
+        ethertype = (view[12] << 8) | view[13]
+        offset = 14
+        while ethertype in _VLAN_TYPES and len(view) >= offset + 4:
+            ethertype = (view[offset + 2] << 8) | view[offset + 3]
+            offset += 4
+        return ethertype, view[offset:]
+    if linktype == LINKTYPE_LINUX_SLL:
+        return ((view[14] << 8) | view[15], view[16:]) if len(view) >= 16 else None
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return ((view[0] << 8) | view[1], view[20:]) if len(view) >= 20 else None
+    if linktype == LINKTYPE_NULL:
+        return (0, view[4:]) if len(view) >= 4 else None
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_DLT_RAW1, LINKTYPE_DLT_RAW2):
+        return 0, view
+    return None
+
+
+class _TCPStream:
+    """Remontagem de um sentido de uma conexão TCP"""
+
+    __slots__ = ("next_seq", "buffer", "pending", "pending_bytes")
+
+    def __init__(self):
+        self.next_seq: Optional[int] = None
+        self.buffer = bytearray()
+        self.pending: Dict[int, bytes] = {}
+        self.pending_bytes = 0
+
+
+class SIPPacketDecoder:
+    """Decodifica quadros brutos em mensagens SIP, sem passar por texto.
+
+    Os cabeçalhos IPv4/IPv6/UDP/TCP são lidos direto do memoryview do
+    buffer de captura; só o payload SIP é copiado. Datagramas UDP viram uma
+    mensagem cada (fragmentos IPv4 são remontados antes); em TCP, os
+    segmentos de cada sentido são remontados em ordem de sequência e
+    separados em mensagens pelo Content-Length.
+
+    Com defer_tcp, os segmentos TCP vão para out como TCPSegment, sem
+    remontagem: usado quando trechos de um arquivo são decodificados em
+    paralelo e os fluxos precisam ser remontados em ordem depois (ver
+    feed_segment).
+    """
+
+    def __init__(
+        self,
+        ports: Iterable[int] = (5060,),
+        counters: Optional[CaptureCounters] = None,
+        max_message_size: int = 65536,
+        max_streams: int = 4096,
+        max_fragments: int = 1024,
+        defer_tcp: bool = False,
+    ):
+        self.ports = frozenset(ports)
+        self.defer_tcp = defer_tcp
+        self.counters = counters or CaptureCounters()
+        self.max_message_size = max_message_size
+        self.max_streams = max_streams
+        self.max_fragments = max_fragments
+        self._streams: "OrderedDict[Tuple, _TCPStream]" = OrderedDict()
+        self._fragments: "OrderedDict[Tuple, Dict]" = OrderedDict()
+
+    def decode(self, view: memoryview, ethertype: int, timestamp: float, out: List[Union[SIPPacket, TCPSegment]]):
+        """Decodifica um pacote a partir da camada de rede; mensagens completas vão para out"""
+        counters = self.counters
+        counters.seen += 1
+        counters.bytes += len(view)
+        if not view:
+            counters.drop("truncated")
+            return
+        version = view[0] >> 4
+        if ethertype == ETH_P_IP or (ethertype == 0 and version == 4):
+            self._decode_ipv4(view, timestamp, out)
+        elif ethertype == ETH_P_IPV6 or (ethertype == 0 and version == 6):
+            self._decode_ipv6(view, timestamp, out)
+        else:
+            counters.drop("not_ip")
+
+    def decode_frame(self, view: memoryview, linktype: int, timestamp: float, out: List[SIPPacket]):
+        """Como decode, para um quadro com cabeçalho de enlace (pcap)"""
+        network = link_payload(view, linktype)
+        if network is None:
+            self.counters.seen += 1
+            self.counters.drop("unsupported_link")
+            return
+        self.decode(network[1], network[0], timestamp, out)
+
+    # ==========================================
+    # CAMADA DE REDE
+    # ==========================================
+    def _decode_ipv4(self, view: memoryview, timestamp: float, out: List[SIPPacket]):
+        if len(view) < 20:
+            self.counters.drop("truncated")
+            return
+        version_ihl, _, total, ident, fragment, _, protocol, _, src, dst = _IPV4.unpack_from(view)
+        header = (version_ihl & 0x0F) * 4
+        end = min(total, len(view))
+        if header < 20 or end < header:
+            self.counters.drop("truncated")
+            return
+        payload = view[header:end]
+        if fragment & 0x3FFF:
+            payload = self._reassemble((src, dst, ident, protocol), fragment, payload)
+            if payload is None:
+                return
+        self._decode_transport(protocol, socket.AF_INET, src, dst, payload, timestamp, out)
+
+    def _reassemble(self, key: Tuple, fragment: int, payload: memoryview) -> Optional[memoryview]:
+        """Junta os fragmentos de um datagrama IPv4; retorna o payload quando completo"""
+        entry = self._fragments.get(key)
+        if entry is None:
+            if len(self._fragments) >= self.max_fragments:
+                self._fragments.popitem(last=False)
+                self.counters.drop("fragments_expired")
+            entry = self._fragments[key] = {"parts": {}, "size": None, "received": 0}
+        offset = (fragment & 0x1FFF) * 8
+        if offset not in entry["parts"]:
+            entry["parts"][offset] = bytes(payload)
+            entry["received"] += len(payload)
+        if not fragment & 0x2000:
+            entry["size"] = offset + len(payload)
+        if entry["size"] is None or entry["received"] < entry["size"]:
+            return None
+        del self._fragments[key]
+        data = bytearray()
+        for offset, part in sorted(entry["parts"].items()):
+            if offset != len(data):
+                self.counters.drop("fragments_overlap")
+                return None
+            data += part
+        return memoryview(data)
+
+    def _decode_ipv6(self, view: memoryview, timestamp: float, out: List[SIPPacket]):
+        if len(view) < 40:
+            self.counters.drop("truncated")
+            return
+        _, length, protocol, _, src, dst = _IPV6.unpack_from(view)
+        end = min(40 + length, len(view))
+        offset = 40
+        while protocol in _IPV6_EXTENSIONS and offset + 8 <= end:
+            protocol = view[offset]
+            offset += (view[offset + 1] + 1) * 8
+        if protocol == 44:
+            self.counters.drop("ipv6_fragment")
+            return
+        if offset > end:
+            self.counters.drop("truncated")
+            return
+        self._decode_transport(protocol, socket.AF_INET6, src, dst, view[offset:end], timestamp, out)
+
+    # ==========================================
+    # TRANSPORTE
+    # ==========================================
+    def _decode_transport(
+        self, protocol: int, family: int, src: bytes, dst: bytes,
+        view: memoryview, timestamp: float, out: List[SIPPacket],
+    ):
+        counters = self.counters
+        if protocol == IPPROTO_UDP:
+            if len(view) < 8:
+                counters.drop("truncated")
+                return
+            sport, dport, length, _ = _UDP.unpack_from(view)
+            if sport not in self.ports and dport not in self.ports:
+                counters.drop("filtered")
+                return
+            counters.parsed += 1
+            payload = view[8:min(length, len(view))]
+            if not is_sip_start(payload):
+                # Keep-alives (CRLF) e STUN na porta SIP
+                counters.drop("not_sip")
+                return
+            counters.messages += 1
+            out.append(SIPPacket(
+                timestamp, socket.inet_ntop(family, src), sport,
+                socket.inet_ntop(family, dst), dport, "UDP", bytes(payload),
+            ))
+        elif protocol == IPPROTO_TCP:
+            if len(view) < 20:
+                counters.drop("truncated")
+                return
+            sport, dport, seq, _, offset, flags = _TCP.unpack_from(view)
+            if sport not in self.ports and dport not in self.ports:
+                counters.drop("filtered")
+                return
+            counters.parsed += 1
+            payload = view[(offset >> 4) * 4:]
+            if not self.defer_tcp:
+                self._decode_tcp((src, sport, dst, dport), family, seq, flags, payload, timestamp, out)
+            elif payload or flags & (_TCP_SYN | _TCP_FIN | _TCP_RST):
+                out.append(TCPSegment(timestamp, (src, sport, dst, dport), family, seq, flags, bytes(payload)))
+        else:
+            counters.drop("not_udp_tcp")
+
+    def feed_segment(self, segment: TCPSegment, out: List[SIPPacket]):
+        """Remonta um segmento emitido por um decodificador com defer_tcp"""
+        self._decode_tcp(
+            segment.key, segment.family, segment.seq, segment.flags,
+            memoryview(segment.payload), segment.timestamp, out,
+        )
+
+    def _decode_tcp(
+        self, key: Tuple, family: int, seq: int, flags: int,
+        payload: memoryview, timestamp: float, out: List[SIPPacket],
+    ):
+        stream = self._streams.get(key)
+        if flags & _TCP_SYN:
+            stream = self._stream(key, reset=True)
+            stream.next_seq = (seq + 1) & _SEQ_MASK
+        if payload:
+            if stream is None:
+                stream = self._stream(key)
+            else:
+                self._streams.move_to_end(key)
+            self._append(stream, seq, payload)
+            self._frame(stream, key, family, timestamp, out)
+        if flags & (_TCP_FIN | _TCP_RST):
+            self._streams.pop(key, None)
+
+    def _stream(self, key: Tuple, reset: bool = False) -> _TCPStream:
+        stream = self._streams.get(key)
+        if stream is None or reset:
+            if stream is None and len(self._streams) >= self.max_streams:
+                self._streams.popitem(last=False)
+                self.counters.drop("tcp_streams_evicted")
+            stream = self._streams[key] = _TCPStream()
+        return stream
+
+    def _append(self, stream: _TCPStream, seq: int, payload: memoryview):
+        if stream.next_seq is None:
+            # Conexão já estabelecida antes da captura: começa do primeiro segmento visto
+            stream.next_seq = seq
+        ahead = (seq - stream.next_seq) & _SEQ_MASK
+        if ahead == 0:
+            stream.buffer += payload
+            stream.next_seq = (seq + len(payload)) & _SEQ_MASK
+        elif ahead >= 0x80000000:
+            # Retransmissão: aproveita só o que passa do já recebido
+            behind = (stream.next_seq - seq) & _SEQ_MASK
+            if behind >= len(payload):
+                return
+            stream.buffer += payload[behind:]
+            stream.next_seq = (seq + len(payload)) & _SEQ_MASK
+        elif stream.pending_bytes + len(payload) <= self.max_message_size:
+            # Fora de ordem: guarda até o buraco ser preenchido
+            if seq not in stream.pending:
+                stream.pending[seq] = bytes(payload)
+                stream.pending_bytes += len(payload)
+            return
+        else:
+            # Buraco que não se fecha (perda na captura): descarta e recomeça deste segmento
+            self.counters.drop("tcp_gap")
+            stream.buffer.clear()
+            stream.pending.clear()
+            stream.pending_bytes = 0
+            stream.buffer += payload
+            stream.next_seq = (seq + len(payload)) & _SEQ_MASK
+        while stream.next_seq in stream.pending:
+            data = stream.pending.pop(stream.next_seq)
+            stream.pending_bytes -= len(data)
+            stream.buffer += data
+            stream.next_seq = (stream.next_seq + len(data)) & _SEQ_MASK
+
+    def _frame(self, stream: _TCPStream, key: Tuple, family: int, timestamp: float, out: List[SIPPacket]):
+        """Separa as mensagens SIP completas do buffer do fluxo"""
+        buffer = stream.buffer
+        while buffer:
+            start = 0
+            while buffer[start:start + 2] == b"\r\n":
+                start += 2
+            if start:
+                del buffer[:start]
+                continue
+            head = buffer.find(b"\r\n\r\n")
+            if head < 0:
+                if len(buffer) > self.max_message_size:
+                    self.counters.drop("tcp_oversized")
+                    buffer.clear()
+                return
+            if not is_sip_start(buffer):
+                self.counters.drop("tcp_resync")
+                match = _SIP_START.search(buffer)
+                if match is None:
+                    buffer.clear()
+                    return
+                del buffer[:match.end()]
+                continue
+            length = _CONTENT_LENGTH.search(buffer, 0, head + 2)
+            end = head + 4 + (int(length.group(1)) if length else 0)
+            if end > len(buffer):
+                if end - head > self.max_message_size:
+                    self.counters.drop("tcp_oversized")
+                    buffer.clear()
+                return
+            self.counters.messages += 1
+            src, sport, dst, dport = key
+            out.append(SIPPacket(
+                timestamp, socket.inet_ntop(family, src), sport,
+                socket.inet_ntop(family, dst), dport, "TCP", bytes(buffer[:end]),
+            ))
+            del buffer[:end]
+
+
+# ==========================================
+# FONTES DE PACOTES
+# ==========================================
+def _bpf_port_filter(ports: Iterable[int], snaplen: int) -> bytes:
+    """Filtro BPF clássico 'udp or tcp port P...' para sockets AF_PACKET SOCK_DGRAM.
+
+    Os offsets partem do cabeçalho IP (SOCK_DGRAM não entrega o enlace).
+    Fragmentos e cabeçalhos de extensão IPv6 passam e são tratados pelo
+    decodificador.
+    """
+    ports = sorted(set(ports))
+    program: List[Tuple[int, int, object, object]] = []
+    labels: Dict[str, int] = {}
+
+    def op(code: int, k: int = 0, jt: object = None, jf: object = None):
+        program.append((code, k, jt, jf))
+
+    def label(name: str):
+        labels[name] = len(program)
+
+    def ports_at(load: int, offset: int):
+        op(load, offset)
+        for port in ports:
+            op(0x15, port, "accept")  # jeq #port
+
+    op(0x30, 0)  # ldb [0]
+    op(0x54, 0xF0)  # and #0xf0
+    op(0x15, 0x40, None, "ipv6")  # jeq #0x40
+    op(0x30, 9)  # ldb [9]
+    op(0x15, IPPROTO_UDP, "ipv4_ports")
+    op(0x15, IPPROTO_TCP, "ipv4_ports", "reject")
+    label("ipv4_ports")
+    op(0x28, 6)  # ldh [6]
+    op(0x45, 0x1FFF, "accept")  # jset #0x1fff: fragmento sem cabeçalho de transporte
+    op(0xB1, 0)  # ldxb 4*([0]&0xf)
+    ports_at(0x48, 0)  # ldh [x+0]
+    ports_at(0x48, 2)  # ldh [x+2]
+    op(0x06, 0)  # ret #0
+    label("ipv6")
+    op(0x15, 0x60, None, "reject")
+    op(0x30, 6)  # ldb [6]
+    op(0x15, IPPROTO_UDP, "ipv6_ports")
+    op(0x15, IPPROTO_TCP, "ipv6_ports")
+    for protocol in _IPV6_EXTENSIONS + (44,):
+        op(0x15, protocol, "accept")
+    op(0x06, 0)
+    label("ipv6_ports")
+    ports_at(0x28, 40)
+    ports_at(0x28, 42)
+    label("reject")
+    op(0x06, 0)
+    label("accept")
+    op(0x06, snaplen)
+
+    code = bytearray()
+    for index, (opcode, k, jt, jf) in enumerate(program):
+        jt = labels[jt] - index - 1 if jt else 0
+        jf = labels[jf] - index - 1 if jf else 0
+        code += struct.pack("HBBI", opcode, jt, jf, k)
+    return bytes(code)
+
+
+class AFPacketSource:
+    """Captura por socket AF_PACKET (Linux), num buffer de recepção pré-alocado.
+
+    O socket SOCK_DGRAM entrega os pacotes a partir da camada de rede, já
+    filtrados no kernel pelas portas SIP (BPF). Cada recvfrom_into escreve
+    no mesmo buffer; o quadro só vale até a próxima leitura.
+    """
+
+    SOL_PACKET = 263
+    PACKET_STATISTICS = 6
+    SO_ATTACH_FILTER = 26
+    PACKET_OUTGOING = 4
+    ARPHRD_LOOPBACK = 772
+
+    def __init__(self, interface: str, ports: Iterable[int], snaplen: int = 65535, socket_buffer: int = 8 * 1024 * 1024):
+        self.interface = interface
+        self.ports = tuple(ports)
+        self.snaplen = snaplen
+        self.socket_buffer = socket_buffer
+        self._buffer = bytearray(snaplen)
+        self._view = memoryview(self._buffer)
+        self._socket: Optional[socket.socket] = None
+
+    def open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer)
+            program = _bpf_port_filter(self.ports, self.snaplen)
+            instructions = ctypes.create_string_buffer(program, len(program))
+            fprog = struct.pack("HL", len(program) // 8, ctypes.addressof(instructions))
+            sock.setsockopt(socket.SOL_SOCKET, self.SO_ATTACH_FILTER, fprog)
+            if self.interface and self.interface != "any":
+                sock.bind((self.interface, 0))
+            sock.settimeout(0.2)
+        except Exception:
+            sock.close()
+            raise
+        self._socket = sock
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def kernel_drops(self) -> int:
+        """Pacotes descartados pelo kernel desde a última consulta (buffer do socket cheio)"""
+        if self._socket is None:
+            return 0
+        stats = self._socket.getsockopt(self.SOL_PACKET, self.PACKET_STATISTICS, 8)
+        return struct.unpack("II", stats)[1]
+
+    def frames(self) -> Iterator[Optional[Tuple[memoryview, int, float]]]:
+        """(camada de rede, ethertype, timestamp) por pacote; None quando ocioso"""
+        sock, view = self._socket, self._view
+        while self._socket is not None:
+            try:
+                size, address = sock.recvfrom_into(self._buffer)
+            except socket.timeout:
+                yield None
+                continue
+            except OSError:
+                if self._socket is None:
+                    return
+                raise
+            # No loopback cada pacote aparece duas vezes (saída e entrada)
+            if address[2] == self.PACKET_OUTGOING and address[3] == self.ARPHRD_LOOPBACK:
+                continue
+            yield view[:size], address[1], time.time()
+
+
+def _read_exact(stream: BinaryIO, view: memoryview) -> bool:
+    """Preenche view a partir do stream; False no fim dos dados"""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+
+@dataclass(frozen=True)
+class PcapHeader:
+    """Cabeçalho global de um arquivo pcap"""
+    order: str
+    divisor: float
+    linktype: int
+    snaplen: int
+
+    SIZE = _PCAP_HEADER.size
+
+    @classmethod
+    def parse(cls, data: bytes) -> "PcapHeader":
+        magic = bytes(data[:4])
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            order = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            order = ">"
+        else:
+            raise ValueError("Arquivo não está no formato pcap")
+        _, _, _, _, _, snaplen, linktype = struct.unpack_from(order + _PCAP_HEADER.format, data)
+        divisor = 1e9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e6
+        return cls(order, divisor, linktype & 0xFFFF, snaplen)
+
+
+def pcap_records(
+    stream: BinaryIO,
+    header: PcapHeader,
+    limit: Optional[int] = None,
+    ready: Optional[Callable[[], bool]] = None,
+) -> Iterator[Optional[Tuple[memoryview, int, float]]]:
+    """(quadro, linktype, timestamp) dos registros pcap a partir da posição atual.
+
+    Cada registro é lido no mesmo buffer pré-alocado; o quadro só vale até
+    o próximo. limit encerra a leitura após esse número de bytes (trechos
+    de arquivo); com ready (streams ao vivo), gera None enquanto não houver
+    dados para ler.
+    """
+    record = struct.Struct(header.order + _PCAP_RECORD.format)
+    record_buffer = bytearray(record.size)
+    record_view = memoryview(record_buffer)
+    buffer = bytearray(max(header.snaplen, 65536))
+    view = memoryview(buffer)
+    linktype, divisor = header.linktype, header.divisor
+    consumed = 0
+    while limit is None or consumed < limit:
+        while ready is not None and not ready():
+            yield None
+        if not _read_exact(stream, record_view):
+            return
+        seconds, fraction, captured, _ = record.unpack_from(record_buffer)
+        if captured > len(buffer):
+            buffer = bytearray(captured)
+            view = memoryview(buffer)
+        if not _read_exact(stream, view[:captured]):
+            return
+        consumed += record.size + captured
+        yield view[:captured], linktype, seconds + fraction / divisor
+
+
+def pcap_frames(
+    stream: BinaryIO,
+    ready: Optional[Callable[[], bool]] = None,
+) -> Iterator[Optional[Tuple[memoryview, int, float]]]:
+    """Como pcap_records, para um stream pcap completo (com o cabeçalho global)"""
+    header = bytearray(PcapHeader.SIZE)
+    if not _read_exact(stream, memoryview(header)):
+        return
+    yield from pcap_records(stream, PcapHeader.parse(header), ready=ready)
+
+
+class PcapStreamSource:
+    """Captura pelo tcpdump gravando pcap binário na saída padrão (-w -).
+
+    Alternativa ao AF_PACKET sem privilégio de socket raw no processo: o
+    tcpdump só captura, e os quadros são decodificados como na outra fonte.
+    """
+
+    def __init__(self, interface: str, ports: Iterable[int], snaplen: int = 65535, tcpdump: str = "/usr/bin/tcpdump"):
+        self.interface = interface
+        self.ports = tuple(ports)
+        self.snaplen = snaplen
+        self.tcpdump = tcpdump
+        self._process: Optional[subprocess.Popen] = None
+
+    def open(self):
+        expression = " or ".join(f"port {port}" for port in self.ports)
+        self._process = subprocess.Popen(
+            [self.tcpdump, "-i", self.interface or "any", "-n", "-U", "-s", str(self.snaplen), "-w", "-", expression],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        )
+
+    def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.terminate()
+            process.wait(timeout=_TCPDUMP_STOP_TIMEOUT)
+        except ProcessLookupError:
+            pass
+        except subprocess.TimeoutExpired:
+            logger.warning("tcpdump não encerrou após SIGTERM; enviando SIGKILL")
+            process.kill()
+            process.wait()
+        finally:
+            if process.stdout is not None:
+                process.stdout.close()
+
+    def kernel_drops(self) -> int:
+        return 0
+
+    def frames(self) -> Iterator[Optional[Tuple[memoryview, int, float]]]:
+        process = self._process
+        stdout = process.stdout
+
+        def ready() -> bool:
+            return bool(select.select([stdout], [], [], 0.2)[0])
+
+        for frame in pcap_frames(stdout, ready):
+            if frame is None:
+                yield None
+                continue
+            view, linktype, timestamp = frame
+            network = link_payload(view, linktype)
+            yield (network[1], network[0], timestamp) if network else (view, -1, timestamp)
+        process.wait()
+
+
+def run_capture(
+    source,
+    decoder: SIPPacketDecoder,
+    deliver: Callable[[List[SIPPacket]], None],
+    stopped: threading.Event,
+    batch_size: int = 256,
+    flush_seconds: float = 0.05,
+):
+    """Laço de captura (roda numa thread): lê, decodifica e entrega as mensagens em lotes"""
+    batch: List[SIPPacket] = []
+    flushed = stats_at = time.monotonic()
+    try:
+        for frame in source.frames():
+            if stopped.is_set():
+                break
+            if frame is not None:
+                decoder.decode(*frame, batch)
+            now = time.monotonic()
+            if batch and (len(batch) >= batch_size or now - flushed >= flush_seconds or frame is None):
+                deliver(batch)
+                batch = []
+                flushed = now
+            if now - stats_at >= 1.0:
+                drops = source.kernel_drops()
+                if drops:
+                    decoder.counters.drop("kernel", drops)
+                stats_at = now
+        if batch:
+            deliver(batch)
+    except Exception as e:
+        logger.error(f"Erro na captura SIP: {e}")
+    finally:
+        source.close()
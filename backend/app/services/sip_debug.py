@@ -1,11 +1,70 @@
 import asyncio
-import subprocess
-import re
+import multiprocessing
+import os
+import socket
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Deque, Dict, List, Optional, Tuple, Union
 from dataclasses import dataclass, asdict
 
-@dataclass 
+from loguru import logger
+from app.core.config import settings
+from app.services.sip_capture import (
+    AFPacketSource, CaptureCounters, PcapStreamSource, SIPPacket, SIPPacketDecoder, TCPSegment, run_capture,
+)
+from app.services.sip_pcap import decode_chunk, scan_chunks
+
+CAPTURE_BACKENDS = ("auto", "af_packet", "tcpdump")
+
+# Rótulos usados desde a captura por texto; demais respostas usam "código motivo"
+_RESPONSE_LABELS = {
+    100: "100 Trying",
+    180: "180 Ringing",
+    183: "183 Progress",
+    200: "200 OK",
+    401: "401 Unauthorized",
+    403: "403 Forbidden",
+    404: "404 Not Found",
+    486: "486 Busy",
+    487: "487 Cancelled",
+    503: "503 Unavailable",
+}
+_COMPACT_HEADERS = {"i": "call-id", "f": "from", "t": "to"}
+
+
+def capture_ports() -> List[int]:
+    return [int(port) for port in settings.SIP_CAPTURE_PORTS.split(",") if port.strip()]
+
+
+def parse_sip(data: bytes) -> Tuple[str, Dict[str, str]]:
+    """Linha inicial e cabeçalhos (nomes em minúsculas, formas compactas expandidas)"""
+    head = data.split(b"\r\n\r\n", 1)[0].decode("utf-8", errors="replace")
+    lines = head.split("\r\n")
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            name = name.strip().lower()
+            headers.setdefault(_COMPACT_HEADERS.get(name, name), value.strip())
+    return lines[0], headers
+
+
+def method_label(start_line: str) -> str:
+    """Método da requisição ou rótulo da resposta ('180 Ringing')"""
+    if start_line.startswith("SIP/2.0 "):
+        parts = start_line.split(" ", 2)
+        code = int(parts[1]) if parts[1].isdigit() else 0
+        return _RESPONSE_LABELS.get(code) or " ".join(parts[1:])
+    return start_line.split(" ", 1)[0]
+
+
+def _status_code(method: str) -> int:
+    return int(method[:3]) if method[:3].isdigit() else 0
+
+
+@dataclass
 class SIPMessage:
     timestamp: str
     source_ip: str
@@ -33,144 +92,115 @@ class ActiveCall:
 
 class SIPDebugService:
     def __init__(self):
-        self.active_calls: Dict[str, ActiveCall] = {}
-        self.message_history: List[SIPMessage] = []
+        # LRU por última mensagem: além de max_calls, sai a chamada parada há mais tempo
+        self.active_calls: "OrderedDict[str, ActiveCall]" = OrderedDict()
+        self.max_calls = settings.SIP_DEBUG_MAX_CALLS
+        self.max_call_messages = settings.SIP_DEBUG_MAX_CALL_MESSAGES
         self.max_history = 500
+        self.message_history: Deque[SIPMessage] = deque(maxlen=self.max_history)
         self.capturing = False
-        self.capture_process = None
+        self.backend: Optional[str] = None
+        self.counters = CaptureCounters()
+        self._stopped = threading.Event()
+        self.pcap_state: Dict = {"status": "idle"}
+        self._pcap_counters = CaptureCounters()
+        self._pcap_task: Optional[asyncio.Task] = None
 
-    async def capture_with_tcpdump(self, interface: str = "eth0", callback=None):
-        """Captura pacotes SIP com tcpdump"""
+    async def capture(self, interface: str = "eth0", callback=None, backend: str = settings.SIP_CAPTURE_BACKEND):
+        """Captura pacotes SIP da interface e alimenta a análise.
+
+        Os quadros são lidos e decodificados numa thread (socket AF_PACKET
+        ou pcap do tcpdump, ver sip_capture) e as mensagens SIP completas
+        chegam aqui em lotes. Se a análise não acompanhar, os lotes
+        excedentes são descartados e contados em counters.
+        """
         self.capturing = True
-        cmd = [
-            "/usr/bin/tcpdump", "-i", interface, "-n", "-l",
-            "-A", "port", "5060"
-        ]
+        self._stopped = threading.Event()
+        self.counters = CaptureCounters()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def enqueue(batch: List[SIPPacket]):
+            if queue.qsize() >= settings.SIP_CAPTURE_QUEUE_SIZE:
+                self.counters.drop("analyzer_backlog", len(batch))
+            else:
+                queue.put_nowait(batch)
 
+        capture_task = None
         try:
-            self.capture_process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+            self.backend, source = self._open_source(interface, backend)
+            decoder = SIPPacketDecoder(capture_ports(), self.counters)
+            logger.info(f"Captura SIP iniciada em {interface} ({self.backend})")
+            capture_task = asyncio.create_task(asyncio.to_thread(
+                run_capture, source, decoder,
+                lambda batch: loop.call_soon_threadsafe(enqueue, batch),
+                self._stopped,
+            ))
+            capture_task.add_done_callback(lambda _: queue.put_nowait(None))
 
-            current_packet = []
-            
-            async for line in self.capture_process.stdout:
-                if not self.capturing:
-                    break
-
-                decoded = line.decode('utf-8', errors='ignore').strip()
-                
-                # Nova linha de pacote começa com timestamp
-                if re.match(r'^\d{2}:\d{2}:\d{2}', decoded):
-                    # Processar pacote anterior
-                    if current_packet:
-                        await self._process_packet(current_packet, callback)
-                    current_packet = [decoded]
-                elif decoded:
-                    current_packet.append(decoded)
+            while (batch := await queue.get()) is not None:
+                for packet in batch:
+                    await self.process_packet(packet, callback)
 
         except Exception as e:
-            print(f"Erro na captura: {e}")
+            logger.error(f"Erro na captura SIP: {e}")
         finally:
+            self._stopped.set()
             self.capturing = False
+            if capture_task is not None:
+                await asyncio.shield(capture_task)
+
+    def _open_source(self, interface: str, backend: str):
+        """Abre a fonte de pacotes: AF_PACKET se disponível (auto), senão tcpdump"""
+        ports = capture_ports()
+        if backend in ("auto", "af_packet") and hasattr(socket, "AF_PACKET"):
+            source = AFPacketSource(interface, ports, settings.SIP_CAPTURE_SNAPLEN)
+            try:
+                source.open()
+                return "af_packet", source
+            except OSError as e:
+                if backend == "af_packet":
+                    raise
+                logger.warning(f"Socket AF_PACKET indisponivel ({e}), capturando com tcpdump")
+        source = PcapStreamSource(interface, ports, settings.SIP_CAPTURE_SNAPLEN)
+        source.open()
+        return "tcpdump", source
 
-    async def _process_packet(self, lines: List[str], callback=None):
-        """Processa um pacote SIP capturado"""
+    async def process_packet(self, packet: SIPPacket, callback=None):
+        """Analisa uma mensagem SIP capturada"""
         try:
-            if not lines:
-                return
-                
-            first_line = lines[0]
-            
-            # Extrair IPs do cabeçalho tcpdump
-            # Formato: 08:18:46.219507 IP 187.109.88.49.41738 > 159.223.159.183.5060: SIP: INVITE...
-            ip_match = re.search(r'IP (\d+\.\d+\.\d+\.\d+)\.\d+ > (\d+\.\d+\.\d+\.\d+)\.\d+', first_line)
-            source_ip = ip_match.group(1) if ip_match else ""
-            dest_ip = ip_match.group(2) if ip_match else ""
-            
-            # Detectar método SIP
-            method = ""
-            call_id = ""
-            
-            full_text = '\n'.join(lines)
-            
-            # Método SIP
-            if 'INVITE' in first_line:
-                method = 'INVITE'
-            elif 'SIP/2.0 100' in full_text:
-                method = '100 Trying'
-            elif 'SIP/2.0 180' in full_text:
-                method = '180 Ringing'
-            elif 'SIP/2.0 183' in full_text:
-                method = '183 Progress'
-            elif 'SIP/2.0 200' in full_text:
-                method = '200 OK'
-            elif 'SIP/2.0 401' in full_text:
-                method = '401 Unauthorized'
-            elif 'SIP/2.0 403' in full_text:
-                method = '403 Forbidden'
-            elif 'SIP/2.0 404' in full_text:
-                method = '404 Not Found'
-            elif 'SIP/2.0 486' in full_text:
-                method = '486 Busy'
-            elif 'SIP/2.0 487' in full_text:
-                method = '487 Cancelled'
-            elif 'SIP/2.0 503' in full_text:
-                method = '503 Unavailable'
-            elif 'ACK' in first_line:
-                method = 'ACK'
-            elif 'BYE' in first_line:
-                method = 'BYE'
-            elif 'CANCEL' in first_line:
-                method = 'CANCEL'
-            elif 'REGISTER' in first_line:
-                method = 'REGISTER'
-            elif 'OPTIONS' in first_line:
-                method = 'OPTIONS'
-            
-            # Call-ID
-            call_id_match = re.search(r'Call-ID:\s*([^\s\r\n]+)', full_text, re.IGNORECASE)
-            if call_id_match:
-                call_id = call_id_match.group(1)
-            
-            if method:
-                msg = SIPMessage(
-                    timestamp=datetime.now().isoformat(),
-                    source_ip=source_ip,
-                    dest_ip=dest_ip,
-                    method=method,
-                    call_id=call_id,
-                    raw_line=first_line[:100]
-                )
-                
-                self.message_history.append(msg)
-                if len(self.message_history) > self.max_history:
-                    self.message_history.pop(0)
-                
-                # Atualizar chamadas ativas
-                self._update_call(msg, full_text)
-                
-                if callback:
-                    await callback(msg.to_dict())
-                    
+            msg = self.analyze(packet)
+            if msg and callback:
+                await callback(msg.to_dict())
         except Exception as e:
-            print(f"Erro ao processar pacote: {e}")
+            logger.error(f"Erro ao processar mensagem SIP: {e}")
+
+    def analyze(self, packet: SIPPacket) -> Optional[SIPMessage]:
+        """Registra a mensagem no histórico e atualiza a chamada correspondente"""
+        start_line, headers = parse_sip(packet.data)
+        method = method_label(start_line)
+        if not method:
+            return None
 
-    def _update_call(self, msg: SIPMessage, full_text: str):
+        msg = SIPMessage(
+            timestamp=datetime.fromtimestamp(packet.timestamp).isoformat(),
+            source_ip=packet.source_ip,
+            dest_ip=packet.dest_ip,
+            method=method,
+            call_id=headers.get("call-id", ""),
+            raw_line=start_line[:100]
+        )
+        self.message_history.append(msg)
+        self._update_call(msg, headers.get("from", ""), headers.get("to", ""))
+        return msg
+
+    def _update_call(self, msg: SIPMessage, from_uri: str, to_uri: str):
         """Atualiza o status das chamadas"""
         if not msg.call_id:
             return
-            
-        # Extrair From e To
-        from_match = re.search(r'From:\s*([^\r\n]+)', full_text, re.IGNORECASE)
-        to_match = re.search(r'To:\s*([^\r\n]+)', full_text, re.IGNORECASE)
-        from_uri = from_match.group(1) if from_match else ""
-        to_uri = to_match.group(1) if to_match else ""
-        
+
         if msg.call_id not in self.active_calls:
-            if 'INVITE' in msg.method:
+            if msg.method == 'INVITE':
                 self.active_calls[msg.call_id] = ActiveCall(
                     call_id=msg.call_id,
                     from_uri=from_uri,
@@ -181,29 +211,149 @@ class SIPDebugService:
                     status="trying",
                     messages=[]
                 )
-        
+                if len(self.active_calls) > self.max_calls:
+                    self.active_calls.popitem(last=False)
+
         if msg.call_id in self.active_calls:
             call = self.active_calls[msg.call_id]
+            self.active_calls.move_to_end(msg.call_id)
             call.messages.append(msg.to_dict())
-            
+            if len(call.messages) > self.max_call_messages:
+                del call.messages[0]
+
             # Atualizar status
-            if '180' in msg.method or '183' in msg.method:
+            code = _status_code(msg.method)
+            if code in (180, 183):
                 call.status = "ringing"
-            elif '200' in msg.method:
+            elif code == 200:
                 call.status = "answered"
-            elif '4' in msg.method or '5' in msg.method:
+            elif code >= 400:
                 call.status = "failed"
-            elif 'BYE' in msg.method:
+            elif msg.method == 'BYE':
                 call.status = "ended"
 
+    # ==========================================
+    # ARQUIVOS PCAP
+    # ==========================================
+    @property
+    def pcap_running(self) -> bool:
+        return self._pcap_task is not None and not self._pcap_task.done()
+
+    def start_pcap(self, path: str, clear: bool = False, remove: bool = False):
+        """Agenda a análise de um arquivo pcap/pcapng (ver analyze_pcap)"""
+        if self.pcap_running:
+            raise RuntimeError("Análise de pcap já em andamento")
+        self.pcap_state = {"status": "queued", "file": os.path.basename(path)}
+        self._pcap_task = asyncio.create_task(self.analyze_pcap(path, clear, remove))
+
+    def cancel_pcap(self) -> bool:
+        if not self.pcap_running:
+            return False
+        self._pcap_task.cancel()
+        return True
+
+    def pcap_status(self) -> Dict:
+        return {**self.pcap_state, "counters": self._pcap_counters.to_dict()}
+
+    async def analyze_pcap(self, path: str, clear: bool = False, remove: bool = False) -> Dict:
+        """Analisa um arquivo pcap/pcapng como se os pacotes viessem da captura.
+
+        O arquivo é dividido em trechos alinhados a registros, decodificados
+        em paralelo num pool de processos sem carregar o arquivo inteiro. Os
+        resultados são aplicados na ordem do arquivo (os fluxos TCP são
+        remontados aqui) e alimentam as mesmas chamadas, histórico e
+        problemas da captura ao vivo.
+        """
+        counters = self._pcap_counters = CaptureCounters()
+        state = self.pcap_state = {
+            "status": "running",
+            "file": os.path.basename(path),
+            "size_bytes": None,
+            "chunks": 0,
+            "chunks_done": 0,
+            "error": None,
+            "started_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        ports = capture_ports()
+        reassembler = SIPPacketDecoder(ports, counters)
+        pool = None
+        try:
+            # Dentro do try: arquivo ausente marca a análise como failed e o upload é removido
+            state["size_bytes"] = os.path.getsize(path)
+            chunks = await asyncio.to_thread(scan_chunks, path, settings.SIP_PCAP_CHUNK_MB * 1024 * 1024)
+            state["chunks"] = len(chunks)
+            if clear:
+                self.clear()
+
+            loop = asyncio.get_running_loop()
+            workers = max(1, min(settings.SIP_PCAP_WORKERS or os.cpu_count() or 1, len(chunks)))
+            if workers > 1:
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+            def submit(chunk):
+                if pool is None:
+                    return asyncio.ensure_future(asyncio.to_thread(decode_chunk, path, chunk, ports))
+                return loop.run_in_executor(pool, decode_chunk, path, chunk, ports)
+
+            # Até dois trechos por processo em andamento: limita os resultados à espera na memória
+            pending = deque(chunks)
+            running = deque()
+            while pending or running:
+                while pending and len(running) < workers * 2:
+                    running.append(submit(pending.popleft()))
+                items, chunk_counters = await running.popleft()
+                counters.merge(chunk_counters)
+                await self._apply_pcap_items(items, reassembler)
+                state["chunks_done"] += 1
+            state["status"] = "completed"
+        except asyncio.CancelledError:
+            state["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Erro na análise do pcap {path}: {e}")
+            state["status"] = "failed"
+            state["error"] = str(e)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            state["finished_at"] = datetime.utcnow()
+            if remove:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            logger.info(
+                f"Análise do pcap {state['file']}: {state['status']}, "
+                f"{counters.seen} pacotes, {counters.messages} mensagens SIP"
+            )
+        return self.pcap_status()
+
+    async def _apply_pcap_items(self, items: List[Union[SIPPacket, TCPSegment]], reassembler: SIPPacketDecoder):
+        packets: List[SIPPacket] = []
+        for index, item in enumerate(items, 1):
+            if isinstance(item, TCPSegment):
+                reassembler.feed_segment(item, packets)
+            else:
+                packets.append(item)
+            for packet in packets:
+                await self.process_packet(packet)
+            packets.clear()
+            if index % 5000 == 0:
+                # Devolve o loop às requisições durante trechos grandes
+                await asyncio.sleep(0)
+
     def stop_capture(self):
-        """Para a captura"""
+        """Para a captura (a thread encerra na próxima leitura, em até 0,2 s)"""
         self.capturing = False
-        if self.capture_process:
-            try:
-                self.capture_process.terminate()
-            except:
-                pass
+        self._stopped.set()
+
+    def capture_status(self) -> Dict:
+        return {
+            "capturing": self.capturing,
+            "backend": self.backend,
+            "counters": self.counters.to_dict(),
+        }
 
     def get_active_calls(self) -> List[Dict]:
         """Retorna chamadas ativas"""
@@ -217,7 +367,7 @@ class SIPDebugService:
 
     def get_messages(self, limit: int = 50) -> List[Dict]:
         """Retorna últimas mensagens"""
-        return [msg.to_dict() for msg in self.message_history[-limit:]]
+        return [msg.to_dict() for msg in list(self.message_history)[-limit:]]
 
     def get_call_flow(self, call_id: str) -> Optional[Dict]:
         """Retorna fluxo de uma chamada específica"""
@@ -272,8 +422,8 @@ class SIPDebugService:
 
     def clear(self):
         """Limpa histórico"""
-        self.message_history = []
-        self.active_calls = {}
+        self.message_history.clear()
+        self.active_calls = OrderedDict()
 
 # Instância global
 sip_debug_service = SIPDebugService()
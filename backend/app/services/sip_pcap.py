@@ -0,0 +1,208 @@
+import os
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+from app.services.sip_capture import (
+    CaptureCounters, PcapHeader, SIPPacket, SIPPacketDecoder, TCPSegment, pcap_records,
+)
+
+# Blocos do formato pcapng
+_SHB = b"\x0a\x0d\x0d\x0a"
+_IDB = 1
+_PB = 2
+_SPB = 3
+_EPB = 6
+_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+_IF_TSRESOL = 9
+
+_READ_BUFFER = 1024 * 1024
+
+# (linktype, divisor do timestamp, snaplen) de cada interface de uma seção pcapng
+Interface = Tuple[int, float, int]
+
+
+@dataclass
+class PcapChunk:
+    """Trecho [start, end) de um arquivo, alinhado a registros, com o contexto para lê-lo isolado.
+
+    context é o PcapHeader (pcap) ou (ordem de bytes, interfaces) da seção
+    pcapng em que o trecho começa.
+    """
+    start: int
+    end: int
+    kind: str
+    context: Union[PcapHeader, Tuple[str, List[Interface]]]
+
+
+def detect_format(stream: BinaryIO) -> str:
+    magic = stream.read(4)
+    stream.seek(-len(magic), os.SEEK_CUR)
+    if magic == _SHB:
+        return "pcapng"
+    PcapHeader.parse(magic + bytes(20))
+    return "pcap"
+
+
+def _parse_idb(body: memoryview, order: str) -> Interface:
+    """Interface de um bloco IDB: linktype, resolução do timestamp (if_tsresol) e snaplen"""
+    linktype, _, snaplen = struct.unpack_from(order + "HHI", body)
+    divisor = 1e6
+    offset = 8
+    while offset + 4 <= len(body):
+        code, length = struct.unpack_from(order + "HH", body, offset)
+        if code == 0:
+            break
+        if code == _IF_TSRESOL and length >= 1:
+            value = body[offset + 4]
+            divisor = float(2 ** (value & 0x7F)) if value & 0x80 else float(10 ** value)
+        offset += 4 + (length + 3) // 4 * 4
+    return linktype, divisor, snaplen
+
+
+def _read_into(stream: BinaryIO, buffer: bytearray, size: int) -> Optional[memoryview]:
+    view = memoryview(buffer)[:size]
+    filled = 0
+    while filled < size:
+        count = stream.readinto(view[filled:])
+        if not count:
+            return None
+        filled += count
+    return view
+
+
+def pcapng_frames(
+    stream: BinaryIO,
+    order: str = "<",
+    interfaces: Optional[List[Interface]] = None,
+    limit: Optional[int] = None,
+) -> Iterator[Tuple[memoryview, int, float]]:
+    """(quadro, linktype, timestamp) dos blocos pcapng a partir da posição atual.
+
+    Lê bloco a bloco num buffer reaproveitado (EPB, SPB e o PB obsoleto);
+    SHB e IDB atualizam a ordem de bytes e as interfaces da seção. Os demais
+    blocos são ignorados.
+    """
+    interfaces = list(interfaces or [])
+    buffer = bytearray(65536)
+    consumed = 0
+    while limit is None or consumed < limit:
+        header = _read_into(stream, buffer, 8)
+        if header is None:
+            return
+        if bytes(header[:4]) == _SHB:
+            magic = stream.read(4)
+            if len(magic) < 4:
+                return
+            order = "<" if struct.unpack("<I", magic)[0] == _BYTE_ORDER_MAGIC else ">"
+            total = struct.unpack_from(order + "I", header, 4)[0]
+            if len(stream.read(total - 12)) < total - 12:
+                return
+            interfaces = []
+            consumed += total
+            continue
+
+        block_type, total = struct.unpack_from(order + "II", header)
+        if total < 12:
+            raise ValueError("Bloco pcapng inválido")
+        if total > len(buffer):
+            buffer = bytearray(total)
+        body = _read_into(stream, buffer, total - 8)
+        if body is None:
+            return
+        consumed += total
+
+        if block_type == _EPB:
+            interface, high, low, captured = struct.unpack_from(order + "IIII", body)
+            linktype, divisor, _ = interfaces[interface]
+            yield body[20:20 + captured], linktype, ((high << 32) | low) / divisor
+        elif block_type == _SPB:
+            length = struct.unpack_from(order + "I", body)[0]
+            linktype, _, snaplen = interfaces[0]
+            captured = min(length, snaplen or length, len(body) - 8)
+            yield body[4:4 + captured], linktype, 0.0
+        elif block_type == _PB:
+            interface, _, high, low, captured = struct.unpack_from(order + "HHIII", body)
+            linktype, divisor, _ = interfaces[interface]
+            yield body[20:20 + captured], linktype, ((high << 32) | low) / divisor
+        elif block_type == _IDB:
+            interfaces.append(_parse_idb(body, order))
+
+
+def scan_chunks(path: str, chunk_size: int) -> List[PcapChunk]:
+    """Divide o arquivo em trechos de ~chunk_size bytes alinhados a registros/blocos.
+
+    Só os cabeçalhos de registro são lidos (o restante é pulado com seek),
+    além dos blocos SHB/IDB, que definem o contexto de cada trecho.
+    """
+    size = os.path.getsize(path)
+    chunks: List[PcapChunk] = []
+    with open(path, "rb", buffering=_READ_BUFFER) as stream:
+        kind = detect_format(stream)
+        if kind == "pcap":
+            header = PcapHeader.parse(stream.read(PcapHeader.SIZE))
+            start = offset = PcapHeader.SIZE
+            if size - start <= chunk_size:
+                return [PcapChunk(start, size, kind, header)]
+            record = struct.Struct(header.order + "IIII")
+            while True:
+                data = stream.read(record.size)
+                if len(data) < record.size:
+                    break
+                captured = record.unpack(data)[2]
+                stream.seek(captured, os.SEEK_CUR)
+                offset += record.size + captured
+                if offset - start >= chunk_size:
+                    chunks.append(PcapChunk(start, offset, kind, header))
+                    start = offset
+            if start < size:
+                chunks.append(PcapChunk(start, size, kind, header))
+            return chunks
+
+        order, interfaces = "<", []
+        start = offset = 0
+        context: Tuple[str, List[Interface]] = (order, [])
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                break
+            if header[:4] == _SHB:
+                magic = stream.read(4)
+                order = "<" if struct.unpack("<I", magic)[0] == _BYTE_ORDER_MAGIC else ">"
+                total = struct.unpack_from(order + "I", header, 4)[0]
+                stream.seek(total - 12, os.SEEK_CUR)
+                interfaces = []
+            else:
+                block_type, total = struct.unpack_from(order + "II", header)
+                if block_type == _IDB:
+                    interfaces.append(_parse_idb(memoryview(stream.read(total - 8)), order))
+                else:
+                    stream.seek(total - 8, os.SEEK_CUR)
+            offset += total
+            if offset - start >= chunk_size:
+                chunks.append(PcapChunk(start, offset, kind, context))
+                start = offset
+                context = (order, list(interfaces))
+        if start < size:
+            chunks.append(PcapChunk(start, size, kind, context))
+        return chunks
+
+
+def decode_chunk(path: str, chunk: PcapChunk, ports: List[int]) -> Tuple[List[Union[SIPPacket, TCPSegment]], CaptureCounters]:
+    """Decodifica um trecho do arquivo (roda nos processos do pool).
+
+    Os segmentos TCP saem sem remontagem: um fluxo pode atravessar trechos,
+    então é remontado em ordem por quem junta os resultados.
+    """
+    decoder = SIPPacketDecoder(ports, defer_tcp=True)
+    out: List[Union[SIPPacket, TCPSegment]] = []
+    with open(path, "rb", buffering=_READ_BUFFER) as stream:
+        stream.seek(chunk.start)
+        limit = chunk.end - chunk.start
+        if chunk.kind == "pcap":
+            frames = pcap_records(stream, chunk.context, limit)
+        else:
+            frames = pcapng_frames(stream, *chunk.context, limit)
+        for view, linktype, timestamp in frames:
+            decoder.decode_frame(view, linktype, timestamp, out)
+    return out, decoder.counters
@@ -0,0 +1,148 @@
+"""
+Micro-benchmark: parser AMI incremental x abordagem antiga (str += chunk).
+
+Gera uma captura sintética de PJSIPShowEndpoints com 20k EndpointList e
+alimenta os dois parsers em pedaços de 4 KB, como chegam do socket.
+"parser" faz o mesmo trabalho do legado (só extrai os endpoints);
+"incremental" inclui o agrupamento da lista no EventListCollector, que
+mantém todos os eventos em memória até o EventList: Complete.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_ami_parser [--endpoints 20000] [--chunk 4096] [--repeat 5]
+"""
+import argparse
+import time
+
+from app.services.ami_parser import AMIFrameParser, EventListCollector
+
+
+def build_capture(endpoints: int) -> bytes:
+    action_id = "trunkflow-1"
+    parts = [
+        f"Response: Success\r\nActionID: {action_id}\r\nEventList: start\r\n"
+        f"Message: A listing of Endpoints follows, presented as EndpointList events\r\n\r\n"
+    ]
+    for i in range(endpoints):
+        parts.append(
+            f"Event: EndpointList\r\nActionID: {action_id}\r\nObjectType: endpoint\r\n"
+            f"ObjectName: {10000 + i}\r\nTransport: transport-udp\r\nAor: {10000 + i}\r\n"
+            f"Auths: {10000 + i}\r\nOutboundAuths: \r\nContacts: {10000 + i}/sip:{10000 + i}@10.0.0.1:5060,\r\n"
+            f"DeviceState: Not in use\r\nActiveChannels: \r\n\r\n"
+        )
+    parts.append(
+        f"Event: EndpointListComplete\r\nActionID: {action_id}\r\nEventList: Complete\r\n"
+        f"ListItems: {endpoints}\r\n\r\n"
+    )
+    return "".join(parts).encode()
+
+
+def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def legacy_parse(data: bytes, size: int) -> dict:
+    """Reproduz o antigo AMIClient.get_pjsip_endpoints"""
+    endpoints = {}
+    response = ""
+    for raw in chunks(data, size):
+        chunk = raw.decode(errors="ignore")
+        response += chunk
+        if "EventList: Complete" in chunk or not chunk:
+            break
+
+    for block in response.split("\r\n\r\n"):
+        if "Event: EndpointList" in block:
+            endpoint_name = ""
+            device_state = "Unavailable"
+            for line in block.split("\r\n"):
+                if line.startswith("ObjectName:"):
+                    endpoint_name = line.split(":", 1)[1].strip()
+                elif line.startswith("DeviceState:"):
+                    device_state = line.split(":", 1)[1].strip()
+            if endpoint_name and endpoint_name.isdigit():
+                endpoints[endpoint_name] = device_state
+    return endpoints
+
+
+def incremental_parse(data: bytes, size: int) -> dict:
+    parser = AMIFrameParser()
+    lists = EventListCollector()
+    endpoints = {}
+    for raw in chunks(data, size):
+        for message in parser.feed(raw):
+            if "Response" in message and message.get("EventList") == "start":
+                lists.start(message["ActionID"], message)
+                continue
+            done = lists.add(message)
+            if done is None:
+                continue
+            for event in done[1]:
+                name = event.get("ObjectName", "")
+                if name.isdigit():
+                    endpoints[name] = event.get("DeviceState", "Unavailable")
+    return endpoints
+
+
+def parser_only(data: bytes, size: int) -> dict:
+    """Mesmo trabalho do legado: só o AMIFrameParser, sem agrupar por ActionID"""
+    parser = AMIFrameParser()
+    endpoints = {}
+    for raw in chunks(data, size):
+        for message in parser.feed(raw):
+            if message.get("Event") == "EndpointList":
+                name = message.get("ObjectName", "")
+                if name.isdigit():
+                    endpoints[name] = message.get("DeviceState", "Unavailable")
+    return endpoints
+
+
+def first_message_latency(data: bytes, size: int) -> float:
+    """Tempo até o parser incremental entregar a primeira mensagem"""
+    parser = AMIFrameParser()
+    start = time.perf_counter()
+    for raw in chunks(data, size):
+        if parser.feed(raw):
+            break
+    return time.perf_counter() - start
+
+
+def marker_split(data: bytes, size: int) -> bool:
+    """Indica se 'EventList: Complete' cai entre dois pedaços (o legado esperaria o timeout)"""
+    return not any(b"EventList: Complete" in raw for raw in chunks(data, size))
+
+
+def run(name, func, data, size, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data, size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<12} {best * 1000:9.1f} ms  endpoints={len(result)}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = build_capture(args.endpoints)
+    print(f"Captura: {args.endpoints} endpoints, {len(data) / 1024 / 1024:.1f} MB, pedaços de {args.chunk} bytes")
+    legacy = run("legado", legacy_parse, data, args.chunk, args.repeat)
+    run("parser", parser_only, data, args.chunk, args.repeat)
+    incremental = run("incremental", incremental_parse, data, args.chunk, args.repeat)
+    print(f"Primeira mensagem (incremental): {first_message_latency(data, args.chunk) * 1e6:.0f} us; "
+          f"legado só responde após ler a lista inteira")
+    if marker_split(data, args.chunk):
+        print("Marcador 'EventList: Complete' dividido entre pedaços: o legado ficaria bloqueado até o timeout do socket")
+    if legacy != incremental:
+        print(f"Divergência: legado encontrou {len(legacy)} endpoints, incremental {len(incremental)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark: busca em src/dst dos CDRs com os índices da migration 014.
+
+Cria uma tabela sintética (UNLOGGED) com os mesmos índices de busca da
+tabela cdr, carrega --rows CDRs gerados no próprio PostgreSQL e mede as
+consultas no formato do /reports/cdr (filtro de busca + ORDER BY calldate
+DESC LIMIT 100) em cada modo:
+
+  exact     src = x OR dst = x                      (B-tree text_pattern_ops)
+  prefix    LIKE 'x%'                               (B-tree text_pattern_ops)
+  suffix    reverse(...) LIKE 'x%'                  (B-tree em reverse())
+  contains  ILIKE '%x%'                             (GIN pg_trgm)
+  baseline  ILIKE '%x%' sem índice trigram (opcional, --baseline)
+
+Os predicados são os de app.services.cdr_search, os mesmos da API.
+
+Requer um PostgreSQL com a extensão pg_trgm disponível. A carga de 50M
+linhas leva alguns minutos e ocupa alguns GB; use --keep para reaproveitar
+a tabela nas próximas execuções.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_cdr_search [--rows 50000000] [--dsn postgresql://...]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import asyncpg
+from sqlalchemy import select, table, column, String, DateTime
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+from app.services.cdr_search import search_predicate
+
+TABLE = "bench_cdr_search"
+TARGET_MS = 100.0
+LOAD_BATCH = 1000000
+
+_bench = table(
+    TABLE,
+    column("id"),
+    column("calldate", DateTime),
+    column("src", String),
+    column("dst", String),
+)
+
+_CREATE = f"""
+    CREATE UNLOGGED TABLE {TABLE} (
+        id BIGINT PRIMARY KEY,
+        calldate TIMESTAMP NOT NULL,
+        src VARCHAR(50),
+        dst VARCHAR(50)
+    )
+"""
+
+# Ramais de 4 dígitos ou números de 12-13 dígitos (55 + DDD + número)
+_LOAD = f"""
+    INSERT INTO {TABLE} (id, calldate, src, dst)
+    SELECT g,
+           TIMESTAMP '2026-01-01' + (random() * INTERVAL '180 days'),
+           CASE WHEN random() < 0.5 THEN (1000 + (random() * 8999)::int)::text
+                ELSE '55' || (11 + (random() * 88)::int)::text || lpad((random() * 999999999)::bigint::text, 9, '0') END,
+           '55' || (11 + (random() * 88)::int)::text || lpad((random() * 999999999)::bigint::text, 9, '0')
+    FROM generate_series($1::bigint, $2::bigint) AS g
+"""
+
+_INDEXES = [
+    f"CREATE INDEX ON {TABLE} (calldate)",
+    f"CREATE INDEX ON {TABLE} (src text_pattern_ops)",
+    f"CREATE INDEX ON {TABLE} (dst text_pattern_ops)",
+    f"CREATE INDEX ON {TABLE} (reverse(src) text_pattern_ops)",
+    f"CREATE INDEX ON {TABLE} (reverse(dst) text_pattern_ops)",
+    f"CREATE INDEX ON {TABLE} USING gin (src gin_trgm_ops)",
+    f"CREATE INDEX ON {TABLE} USING gin (dst gin_trgm_ops)",
+]
+
+
+def search_sql(term: str, mode: str) -> str:
+    """SQL da busca com o filtro da API, apontando para a tabela sintética"""
+    where = search_predicate((_bench.c.src, _bench.c.dst), term, mode)
+    query = (
+        select(_bench.c.id, _bench.c.calldate, _bench.c.src, _bench.c.dst)
+        .where(where)
+        .order_by(_bench.c.calldate.desc())
+        .limit(100)
+    )
+    return str(query.compile(dialect=postgresql.asyncpg.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+async def prepare(conn: asyncpg.Connection, rows: int, keep: bool):
+    exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", TABLE)
+    if exists and keep:
+        count = await conn.fetchval(f"SELECT reltuples::bigint FROM pg_class WHERE relname = '{TABLE}'")
+        print(f"Reaproveitando {TABLE} (~{count} linhas)")
+        return
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    await conn.execute(_CREATE)
+
+    start = time.perf_counter()
+    for first in range(1, rows + 1, LOAD_BATCH):
+        last = min(first + LOAD_BATCH - 1, rows)
+        await conn.execute(_LOAD, first, last)
+        print(f"\rCarga: {last}/{rows} linhas", end="", flush=True)
+    print(f" ({time.perf_counter() - start:.0f} s)")
+
+    start = time.perf_counter()
+    await conn.execute("SET maintenance_work_mem = '1GB'")
+    for statement in _INDEXES:
+        await conn.execute(statement)
+    await conn.execute(f"ANALYZE {TABLE}")
+    print(f"Índices: {time.perf_counter() - start:.0f} s")
+
+
+async def sample_terms(conn: asyncpg.Connection, count: int, rows: int):
+    """Termos de busca a partir de números existentes (amostra aleatória da tabela)"""
+    percent = min(100.0, max(0.01, count * 1000 * 100 / rows))
+    numbers = [
+        r["dst"] for r in await conn.fetch(f"SELECT dst FROM {TABLE} TABLESAMPLE SYSTEM ({percent}) LIMIT {count}")
+    ]
+    rng = random.Random(42)
+    return {
+        "exact": numbers,
+        "prefix": [n[:rng.randint(6, 9)] for n in numbers],
+        "suffix": [n[-rng.randint(4, 6):] for n in numbers],
+        "contains": [n[rng.randint(2, 5):][:rng.randint(5, 7)] for n in numbers],
+    }
+
+
+async def measure(conn: asyncpg.Connection, mode: str, terms) -> list:
+    timings = []
+    for term in terms:
+        sql = search_sql(term, mode if mode != "baseline" else "contains")
+        start = time.perf_counter()
+        await conn.fetch(sql)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def run(args):
+    dsn = args.dsn or settings.DATABASE_URL.replace("+asyncpg", "")
+    conn = await asyncpg.connect(dsn)
+    try:
+        await prepare(conn, args.rows, args.keep)
+        terms = await sample_terms(conn, args.queries, args.rows)
+        print(f"{'modo':<10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        failed = False
+        for mode in ("exact", "prefix", "suffix", "contains"):
+            timings = sorted(await measure(conn, mode, terms[mode]))
+            p50 = statistics.median(timings)
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            status = "ok" if p95 < TARGET_MS else "ACIMA DO ALVO"
+            failed |= p95 >= TARGET_MS
+            print(f"{mode:<10} {p50:9.1f} {p95:9.1f} {timings[-1]:9.1f}  {status}")
+
+        if args.baseline:
+            # Mesma busca por trecho sem os índices trigram (varredura sequencial)
+            async with conn.transaction():
+                await conn.execute("SET LOCAL enable_bitmapscan = off")
+                timings = await measure(conn, "baseline", terms["contains"][:3])
+            print(f"{'baseline':<10} {statistics.median(timings):9.1f}")
+
+        if args.explain:
+            for mode in ("exact", "prefix", "suffix", "contains"):
+                plan = await conn.fetch("EXPLAIN ANALYZE " + search_sql(terms[mode][0], mode))
+                print(f"\n-- {mode}")
+                print("\n".join(r[0] for r in plan))
+
+        print(f"\nAlvo: p95 < {TARGET_MS:.0f} ms -> {'falhou' if failed else 'atingido'}")
+        if not args.keep:
+            await conn.execute(f"DROP TABLE {TABLE}")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=50000000)
+    parser.add_argument("--queries", type=int, default=50, help="consultas por modo")
+    parser.add_argument("--dsn", help="DSN do PostgreSQL (padrão: DATABASE_URL)")
+    parser.add_argument("--keep", action="store_true", help="mantém/reaproveita a tabela sintética")
+    parser.add_argument("--baseline", action="store_true", help="mede também a busca sem índice trigram")
+    parser.add_argument("--explain", action="store_true", help="mostra o plano de cada modo")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
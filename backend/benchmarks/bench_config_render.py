@@ -0,0 +1,261 @@
+"""
+Benchmark: geração de configuração PJSIP com 'config += ...' x fragmentos por objeto.
+
+Gera 100k ramais e 10k clientes trunk sintéticos e grava a configuração
+PJSIP de ramais e clientes trunk de quatro formas:
+
+  legado        lista completa de dicts + texto montado com '+=' + write()
+                (arquivo único, sem fsync, como antes dos fragmentos)
+  streaming     arquivo único gerado em blocos via _stream_config (hash no
+                cabeçalho, rename atômico e um fsync por arquivo)
+  fragmentos    caminho de produção: save_extensions_pjsip_config e
+                save_customer_trunks_config com o diretório vazio (um
+                fragmento por objeto + stub, rename atômico e fsync)
+  resync        o mesmo caminho numa segunda sincronização sem alterações
+                (só compara hashes; a primeira fica fora da medição)
+
+A primeira gravação dos fragmentos é a mais cara de todas: cada fragmento
+é um arquivo com o seu próprio fsync (o do diretório já é um por lote),
+e com 100k ramais isso custa dezenas de vezes o legado, dominado pelo
+disco. É um custo único (implantação ou diretório perdido); nas
+sincronizações seguintes só os fragmentos alterados são regravados.
+
+Cada variante roda em um processo separado, num diretório temporário
+removido ao final, para medir o pico de RSS (ru_maxrss) sem interferência
+da outra; o valor informado é o acréscimo sobre o RSS após os imports (no
+resync, após a primeira sincronização).
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_config_render [--extensions 100000] [--trunks 10000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def extension_rows(count: int):
+    for i in range(count):
+        yield {
+            "extension": str(100000 + i),
+            "name": f"Ramal {i}",
+            "secret": f"s3cr3t{i:06d}",
+            "context": "from-internal",
+            "codecs": "alaw,ulaw",
+            "callerid": f'"Ramal {i}" <{100000 + i}>' if i % 3 else None,
+            "max_contacts": 1 + i % 3,
+            "nat_enabled": i % 2 == 0,
+            "customer_name": f"Cliente {i // 50}",
+            "status": "active",
+        }
+
+
+def trunk_rows(count: int):
+    for i in range(count):
+        yield {
+            "code": f"{i:05d}",
+            "name": f"Cliente Trunk {i}",
+            "type": "trunk",
+            "status": "active",
+            "trunk_ip": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "trunk_port": 5060,
+            "trunk_codecs": "alaw,ulaw",
+            "trunk_context": "from-trunk",
+            "trunk_auth_type": "both" if i % 4 == 0 else "ip",
+            "trunk_username": f"trunk{i}",
+            "trunk_password": f"pw{i}",
+        }
+
+
+# ==========================================
+# LEGADO (reprodução dos geradores com +=)
+# ==========================================
+def legacy_header(title: str) -> str:
+    config = "; =============================================\n"
+    config += f"; {title} - Gerado automaticamente pelo Painel\n"
+    config += f"; Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    config += "; NAO EDITE MANUALMENTE - Use o painel web\n"
+    config += "; =============================================\n\n"
+    return config
+
+
+def legacy_extensions(extensions) -> str:
+    config = legacy_header("RAMAIS")
+    for ext in extensions:
+        if ext.get('status') != 'active':
+            continue
+        exten = ext['extension']
+        name = ext.get('name') or exten
+        config += f"; === Ramal: {exten} - {name} ({ext.get('customer_name')}) ===\n"
+        config += f"[{exten}]\n"
+        config += f"type=endpoint\n"
+        config += f"context={ext.get('context') or 'from-internal'}\n"
+        config += f"disallow=all\n"
+        config += f"allow={ext.get('codecs') or 'alaw,ulaw'}\n"
+        config += f"auth={exten}\n"
+        config += f"aors={exten}\n"
+        if ext.get('callerid'):
+            config += f"callerid={ext['callerid']}\n"
+        if ext.get('nat_enabled'):
+            config += f"direct_media=no\n"
+            config += f"rtp_symmetric=yes\n"
+            config += f"force_rport=yes\n"
+            config += f"rewrite_contact=yes\n"
+        config += f"\n"
+        config += f"[{exten}]\n"
+        config += f"type=auth\n"
+        config += f"auth_type=userpass\n"
+        config += f"username={exten}\n"
+        config += f"password={ext.get('secret') or ''}\n\n"
+        config += f"[{exten}]\n"
+        config += f"type=aor\n"
+        config += f"max_contacts={ext.get('max_contacts') or 1}\n\n"
+    return config
+
+
+def legacy_trunks(customers) -> str:
+    config = legacy_header("CLIENTES TRUNK")
+    for customer in customers:
+        if customer.get('type') != 'trunk' or customer.get('status') != 'active':
+            continue
+        name = f"CLI_{customer['code']}"
+        ip = customer['trunk_ip']
+        auth_type = customer.get('trunk_auth_type', 'ip')
+        username = customer.get('trunk_username')
+        password = customer.get('trunk_password')
+        config += f"; === Cliente: {customer['name']} ({customer['code']}) ===\n"
+        config += f"[{name}]\n"
+        config += f"type=endpoint\n"
+        config += f"context={customer.get('trunk_context', 'from-trunk')}\n"
+        config += f"disallow=all\n"
+        config += f"allow={customer.get('trunk_codecs', 'alaw,ulaw')}\n"
+        config += f"aors={name}\n"
+        if auth_type in ['credentials', 'both'] and username:
+            config += f"auth={name}\n"
+        config += f"\n"
+        config += f"[{name}]\n"
+        config += f"type=aor\n"
+        config += f"contact=sip:{ip}:{customer.get('trunk_port', 5060)}\n\n"
+        config += f"[{name}]\n"
+        config += f"type=identify\n"
+        config += f"endpoint={name}\n"
+        config += f"match={ip}\n\n"
+        if auth_type in ['credentials', 'both'] and username and password:
+            config += f"[{name}]\n"
+            config += f"type=auth\n"
+            config += f"auth_type=userpass\n"
+            config += f"username={username}\n"
+            config += f"password={password}\n\n"
+    return config
+
+
+def run_legacy(directory: str, extensions: int, trunks: int):
+    rows = list(extension_rows(extensions))
+    with open(os.path.join(directory, "pjsip_extensions.conf"), 'w') as f:
+        f.write(legacy_extensions(rows))
+    del rows
+    rows = list(trunk_rows(trunks))
+    with open(os.path.join(directory, "pjsip_customer_trunks.conf"), 'w') as f:
+        f.write(legacy_trunks(rows))
+
+
+def run_fragments(directory: str, extensions: int, trunks: int):
+    from app.services.asterisk import CONFIG_ERROR, asterisk_service
+
+    async def save():
+        results = (
+            await asterisk_service.save_extensions_pjsip_config(extension_rows(extensions)),
+            await asterisk_service.save_customer_trunks_config(trunk_rows(trunks)),
+        )
+        if CONFIG_ERROR in results:
+            raise RuntimeError("Falha ao gravar fragmentos (ver log)")
+
+    asyncio.run(save())
+
+
+def run_streaming(directory: str, extensions: int, trunks: int):
+    from app.services.asterisk import asterisk_service
+
+    asterisk_service._stream_config(
+        os.path.join(directory, "pjsip_extensions.conf"), "RAMAIS",
+        asterisk_service.iter_extensions_pjsip_config(extension_rows(extensions)),
+    )
+    asterisk_service._stream_config(
+        os.path.join(directory, "pjsip_customer_trunks.conf"), "CLIENTES TRUNK",
+        asterisk_service.iter_customer_trunks_config(trunk_rows(trunks)),
+    )
+
+
+# variante -> (preparação fora da medição, execução medida)
+VARIANTS = {
+    "legado": (None, run_legacy),
+    "streaming": (None, run_streaming),
+    "fragmentos": (None, run_fragments),
+    "resync": (run_fragments, run_fragments),
+}
+
+
+def output_size(directory: str) -> int:
+    """Bytes de configuração gerados (sem backups e snapshots)"""
+    skip = {os.path.join(directory, "backups"), os.path.join(directory, "snapshots")}
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in skip]
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files if name.endswith(".conf"))
+    return total
+
+
+def child(variant: str, extensions: int, trunks: int):
+    """Executa uma variante e imprime tempo, RSS e tamanho gerado em JSON"""
+    with tempfile.TemporaryDirectory(prefix="bench_render_") as directory:
+        os.environ["ASTERISK_CONFIG_PATH"] = directory
+        from loguru import logger
+        from app.services import asterisk  # noqa: F401  (imports fora da medição)
+        logger.remove()
+
+        prepare, run = VARIANTS[variant]
+        if prepare:
+            prepare(directory, extensions, trunks)
+
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        run(directory, extensions, trunks)
+        elapsed = time.perf_counter() - start
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        size = output_size(directory)
+    print(json.dumps({"elapsed": elapsed, "rss_kb": peak_rss - base_rss, "bytes": size}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extensions", type=int, default=100000)
+    parser.add_argument("--trunks", type=int, default=10000)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        child(args.variant, args.extensions, args.trunks)
+        return
+
+    print(f"{args.extensions} ramais, {args.trunks} clientes trunk")
+    for variant in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_config_render", "--variant", variant,
+             "--extensions", str(args.extensions), "--trunks", str(args.trunks)],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{variant:<10} {result['elapsed'] * 1000:9.1f} ms  "
+              f"pico RSS +{result['rss_kb'] / 1024:7.1f} MB  "
+              f"saída {result['bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
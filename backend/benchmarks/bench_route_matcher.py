@@ -0,0 +1,106 @@
+"""
+Micro-benchmark: RouteMatcher (autômato) x varredura linear das rotas.
+
+Gera rotas sintéticas por prefixo (DDI/DDD/celular) e roteia números
+aleatórios com as duas abordagens:
+
+  linear     testa cada rota (regex compilada) e fica com a mais específica
+  automaton  RouteMatcher, com as transições do autômato em cache
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_route_matcher [--routes 2000] [--numbers 100000]
+"""
+import argparse
+import random
+import re
+import time
+
+from app.services.dialplan_pattern import ANY, STAR, parse_pattern, specificity
+from app.services.route_matcher import RouteMatcher
+
+
+def build_routes(count: int):
+    rng = random.Random(42)
+    routes = [{"id": "default", "name": "Default", "pattern": "_X.", "gateway_id": "gw0", "priority": 99, "status": "active"}]
+    for i in range(count):
+        prefix = "".join(rng.choice("0123456789") for _ in range(rng.randint(2, 6)))
+        tail = rng.choice(["X.", "XXXXXXXX", "9XXXXXXXX", "NXXXXXXX"])
+        routes.append({
+            "id": f"r{i}",
+            "name": f"Rota {i}",
+            "pattern": f"_{prefix}{tail}",
+            "gateway_id": f"gw{i % 20}",
+            "priority": rng.randint(1, 10),
+            "status": "active",
+        })
+    gateways = [{"id": f"gw{i}", "name": f"gateway{i}", "tech_prefix": ""} for i in range(20)]
+    return routes, gateways
+
+
+def build_numbers(count: int):
+    rng = random.Random(7)
+    return ["".join(rng.choice("0123456789") for _ in range(rng.randint(10, 13))) for _ in range(count)]
+
+
+def linear_matcher(routes):
+    compiled = []
+    for index, route in enumerate(sorted(routes, key=lambda r: r["priority"])):
+        tokens, is_pattern = parse_pattern(route["pattern"])
+        regex = ""
+        for token in tokens:
+            if token is ANY:
+                regex += ".+"
+            elif token is STAR:
+                regex += "" if regex.endswith(".+") else ".*"
+            else:
+                regex += "[" + "".join(re.escape(c) for c in sorted(token)) + "]"
+        compiled.append(((specificity(tokens, is_pattern), index), re.compile(regex), route["id"]))
+
+    def match(number: str):
+        best = None
+        for rank, regex, route_id in compiled:
+            if regex.fullmatch(number) and (best is None or rank < best[0]):
+                best = (rank, route_id)
+        return best[1] if best else None
+
+    return match
+
+
+def run(name: str, match, numbers) -> list:
+    start = time.perf_counter()
+    result = [match(number) for number in numbers]
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {elapsed * 1000:9.1f} ms  {elapsed / len(numbers) * 1e6:8.2f} us/numero")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--routes", type=int, default=2000)
+    parser.add_argument("--numbers", type=int, default=100000)
+    parser.add_argument("--linear-numbers", type=int, default=2000,
+                        help="números usados na varredura linear (lenta)")
+    args = parser.parse_args()
+
+    routes, gateways = build_routes(args.routes)
+    numbers = build_numbers(args.numbers)
+    print(f"Rotas: {len(routes)}, números: {len(numbers)}")
+
+    start = time.perf_counter()
+    matcher = RouteMatcher(routes, gateways)
+    print(f"Compilação: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def automaton_match(number):
+        route = matcher.automaton.match(number)
+        return route["route_id"] if route else None
+
+    sample = numbers[:args.linear_numbers]
+    linear = run("linear", linear_matcher(routes), sample)
+    run("automaton", automaton_match, numbers)
+    run("automaton", automaton_match, numbers)
+    if linear != [automaton_match(number) for number in sample]:
+        print("Divergência entre varredura linear e autômato")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+-- Migration 009: Jobs de retarifação de CDRs
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+
+CREATE TABLE IF NOT EXISTS rerating_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    date_from TIMESTAMP NOT NULL,
+    date_to TIMESTAMP NOT NULL,
+    customer_id UUID REFERENCES customers(id) ON DELETE CASCADE,
+    chunk_size INTEGER DEFAULT 50000,
+    status VARCHAR(20) DEFAULT 'pending',
+    -- Cursor do último bloco gravado (retomada)
+    last_calldate TIMESTAMP,
+    last_id UUID,
+    total_estimate BIGINT DEFAULT 0,
+    processed BIGINT DEFAULT 0,
+    updated_rows BIGINT DEFAULT 0,
+    unrated BIGINT DEFAULT 0,
+    elapsed_seconds DOUBLE PRECISION DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_rerating_jobs_status ON rerating_jobs(status);
+
+-- Leitura em blocos ordenados por (calldate, id)
+CREATE INDEX IF NOT EXISTS idx_cdr_calldate_id ON cdr(calldate, id);
+
+COMMENT ON TABLE rerating_jobs IS 'Retarifação em lote de CDRs por período e cliente, retomável pelo cursor';
@@ -0,0 +1,14 @@
+-- Migration 010: Ingestão de CDRs em lote
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+
+-- Remove duplicatas existentes antes da chave única (mantém a primeira gravada)
+DELETE FROM cdr a
+USING cdr b
+WHERE a.uniqueid = b.uniqueid
+  AND a.sequence = b.sequence
+  AND (a.created_at, a.id) > (b.created_at, b.id);
+
+-- Deduplicação da ingestão (INSERT ... ON CONFLICT DO NOTHING)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cdr_uniqueid_sequence ON cdr(uniqueid, sequence);
+
+COMMENT ON INDEX uq_cdr_uniqueid_sequence IS 'Um CDR por uniqueid+sequence (reenvios do Asterisk são ignorados)';
@@ -0,0 +1,14 @@
+-- Migration 011: Atribuição de CDRs (cliente, gateway, rota)
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+
+-- Relatórios por cliente/gateway/rota filtram também por período
+CREATE INDEX IF NOT EXISTS idx_cdr_customer_calldate ON cdr(customer_id, calldate);
+CREATE INDEX IF NOT EXISTS idx_cdr_gateway_calldate ON cdr(gateway_id, calldate);
+CREATE INDEX IF NOT EXISTS idx_cdr_route_calldate ON cdr(route_id, calldate);
+
+-- Backfill: CDRs ainda sem cliente e gateway
+CREATE INDEX IF NOT EXISTS idx_cdr_unattributed ON cdr(calldate, id)
+    WHERE customer_id IS NULL AND gateway_id IS NULL;
+
+-- Substituído por idx_cdr_customer_calldate
+DROP INDEX IF EXISTS idx_cdr_customer;
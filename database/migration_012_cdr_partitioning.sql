@@ -0,0 +1,82 @@
+-- Migration 012: Particionamento mensal da tabela cdr (RANGE por calldate)
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+--
+-- Recria cdr como tabela particionada e copia os dados existentes. Em bases
+-- grandes, executar em janela de manutenção (a cópia reescreve a tabela).
+
+BEGIN;
+
+ALTER TABLE cdr RENAME TO cdr_unpartitioned;
+
+-- calldate passa a ser a chave de partição (obrigatória)
+UPDATE cdr_unpartitioned
+SET calldate = COALESCE(start_time, created_at, CURRENT_TIMESTAMP)
+WHERE calldate IS NULL;
+
+CREATE TABLE cdr (LIKE cdr_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (calldate);
+
+ALTER TABLE cdr ALTER COLUMN calldate SET NOT NULL;
+ALTER TABLE cdr ALTER COLUMN calldate SET DEFAULT CURRENT_TIMESTAMP;
+
+-- Chaves únicas de tabelas particionadas precisam incluir a chave de partição
+ALTER TABLE cdr ADD PRIMARY KEY (id, calldate);
+
+ALTER TABLE cdr ADD FOREIGN KEY (customer_id) REFERENCES customers(id) ON DELETE SET NULL;
+ALTER TABLE cdr ADD FOREIGN KEY (extension_id) REFERENCES extensions(id) ON DELETE SET NULL;
+ALTER TABLE cdr ADD FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE SET NULL;
+ALTER TABLE cdr ADD FOREIGN KEY (gateway_id) REFERENCES gateways(id) ON DELETE SET NULL;
+
+-- Cria (se não existir) a partição do mês que contém a data informada
+CREATE OR REPLACE FUNCTION cdr_create_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month)::date;
+    end_date DATE := (date_trunc('month', month) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'cdr_' || to_char(start_date, 'YYYY_MM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF cdr FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start_date, end_date
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partições do mês mais antigo existente até 3 meses à frente
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE((SELECT min(calldate) FROM cdr_unpartitioned), CURRENT_TIMESTAMP)),
+            date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        PERFORM cdr_create_partition(month);
+    END LOOP;
+END $$;
+
+-- Datas fora das partições mensais (relógio errado, meses ainda não criados)
+CREATE TABLE IF NOT EXISTS cdr_default PARTITION OF cdr DEFAULT;
+
+INSERT INTO cdr SELECT * FROM cdr_unpartitioned;
+DROP TABLE cdr_unpartitioned;
+
+-- Índices (criados em cada partição)
+CREATE INDEX IF NOT EXISTS idx_cdr_calldate_id ON cdr(calldate, id);
+CREATE INDEX IF NOT EXISTS idx_cdr_call_id ON cdr(call_id);
+CREATE INDEX IF NOT EXISTS idx_cdr_src ON cdr(src);
+CREATE INDEX IF NOT EXISTS idx_cdr_dst ON cdr(dst);
+CREATE INDEX IF NOT EXISTS idx_cdr_customer_calldate ON cdr(customer_id, calldate);
+CREATE INDEX IF NOT EXISTS idx_cdr_gateway_calldate ON cdr(gateway_id, calldate);
+CREATE INDEX IF NOT EXISTS idx_cdr_route_calldate ON cdr(route_id, calldate);
+CREATE INDEX IF NOT EXISTS idx_cdr_unattributed ON cdr(calldate, id)
+    WHERE customer_id IS NULL AND gateway_id IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cdr_uniqueid_sequence ON cdr(uniqueid, sequence, calldate);
+
+-- Partições removidas pela retenção com ação 'archive'
+CREATE SCHEMA IF NOT EXISTS cdr_archive;
+
+COMMIT;
@@ -0,0 +1,37 @@
+-- Migration 013: Agregados horários de CDR para o dashboard
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+--
+-- Uma linha por hora x cliente x gateway x prefixo de destino x disposition.
+-- Mantida pela ingestão (incremental) e recalculada por período via
+-- POST /api/v1/dashboard/rollups/rebuild.
+
+CREATE TABLE IF NOT EXISTS cdr_hourly (
+    hour TIMESTAMP NOT NULL,
+    customer_id UUID,
+    gateway_id UUID,
+    prefix VARCHAR(4) NOT NULL DEFAULT '',
+    disposition VARCHAR(50) NOT NULL DEFAULT '',
+    calls BIGINT NOT NULL DEFAULT 0,
+    billsec BIGINT NOT NULL DEFAULT 0,
+    cost NUMERIC(16, 6) NOT NULL DEFAULT 0,
+    price NUMERIC(16, 6) NOT NULL DEFAULT 0
+);
+
+-- Chave do agregado (NULL de cliente/gateway conta como um valor)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cdr_hourly_key ON cdr_hourly (
+    hour,
+    COALESCE(customer_id, '00000000-0000-0000-0000-000000000000'::uuid),
+    COALESCE(gateway_id, '00000000-0000-0000-0000-000000000000'::uuid),
+    prefix,
+    disposition
+);
+CREATE INDEX IF NOT EXISTS idx_cdr_hourly_customer ON cdr_hourly(customer_id, hour);
+CREATE INDEX IF NOT EXISTS idx_cdr_hourly_gateway ON cdr_hourly(gateway_id, hour);
+
+-- Carga inicial a partir dos CDRs existentes
+INSERT INTO cdr_hourly (hour, customer_id, gateway_id, prefix, disposition, calls, billsec, cost, price)
+SELECT date_trunc('hour', calldate), customer_id, gateway_id,
+       COALESCE(substr(dst, 1, 4), ''), COALESCE(disposition, ''),
+       count(*), COALESCE(sum(billsec), 0), COALESCE(sum(cost), 0), COALESCE(sum(price), 0)
+FROM cdr
+GROUP BY 1, 2, 3, 4, 5;
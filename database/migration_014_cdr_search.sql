@@ -0,0 +1,21 @@
+-- Migration 014: Índices de busca em src/dst dos CDRs
+-- TrunkFlow - Sistema de Gerenciamento VoIP
+--
+-- Modos de busca do /reports/cdr (ver app/services/cdr_search.py):
+--   exact / prefix  B-tree text_pattern_ops   (dst = '...', dst LIKE '55119%')
+--   suffix          B-tree em reverse(...)    (reverse(dst) LIKE '4321%')
+--   contains        GIN pg_trgm               (dst ILIKE '%1199%', termos com 3+ caracteres)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- text_pattern_ops atende igualdade e LIKE 'prefixo%' em qualquer collation
+DROP INDEX IF EXISTS idx_cdr_src;
+DROP INDEX IF EXISTS idx_cdr_dst;
+CREATE INDEX IF NOT EXISTS idx_cdr_src ON cdr (src text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_cdr_dst ON cdr (dst text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_cdr_src_reverse ON cdr (reverse(src) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_cdr_dst_reverse ON cdr (reverse(dst) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_cdr_src_trgm ON cdr USING gin (src gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_cdr_dst_trgm ON cdr USING gin (dst gin_trgm_ops);